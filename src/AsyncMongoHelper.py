@@ -0,0 +1,197 @@
+import asyncio
+from typing import AsyncIterator, Generator, Union
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+from src import QuerySpecs
+from src.ClientRegistry import DEFAULT_OPTIONS, ClientOptions, acquire_client, release_client
+from src.CompactSchema import COMPACT_COLLECTIONS, decode_document, encode_filter, encode_pipeline
+from src.QueryCache import QueryCache, cached_query
+from src.QueryInstrumentation import QueryInstrumentation, instrumented
+from src.QuerySpecs import CACHE_TAGS, Aggregate, Compute, Find, Query, Request, Rows, format_results
+
+
+class AsyncMongoHelper:
+    """
+    asyncio counterpart of the read queries of MongoHelper, every query is a coroutine returning the same result of
+    the MongoHelper method with the same name, so independent queries can run concurrently on one client. Both run
+    the queries of QuerySpecs
+    """
+
+    def database(self):
+        return self.__db
+
+    def __init__(self, host: str, port: int, dbName: str, client_options: ClientOptions = DEFAULT_OPTIONS,
+                 query_cache: QueryCache = None, instrumentation: QueryInstrumentation = None,
+                 compact: bool = False):
+        """
+        :param query_cache: cache of the query results, shared with the MongoHelper running the commands so that
+        they invalidate it. None disables it
+        :param instrumentation: times the queries, see MongoHelper
+        :param compact: the Restaurants collection holds documents of the compact schema, see CompactSchema
+        """
+        if instrumentation is not None:
+            client_options = client_options._replace(
+                event_listeners=client_options.event_listeners + (instrumentation,))
+        self.instrumentation = instrumentation
+        self.query_cache = query_cache
+        self.compact = compact
+        self.__address = (host, port, client_options)
+        # a motor client is bound to the event loop that uses it, so it is not shared through the ClientRegistry
+        self.__client: AsyncIOMotorClient = AsyncIOMotorClient(host=host, port=port, **client_options.client_kwargs())
+        self.__db = self.__client[dbName]
+        self.__explain_client = None
+
+    def explain_client(self) -> MongoClient:
+        """
+        synchronous client on which the instrumentation explains the slow commands, acquired on first use
+        """
+        if self.__explain_client is None:
+            self.__explain_client = acquire_client(*self.__address)
+        return self.__explain_client
+
+    def close(self):
+        self.__client.close()
+        if self.__explain_client is not None:
+            self.__explain_client = None
+            release_client(*self.__address)
+
+    # Queries -----------------------------------------------------------------
+    # the queries are defined in QuerySpecs, shared with the MongoHelper
+
+    async def _documents(self, request: Union[Find, Aggregate, list]) -> AsyncIterator[dict]:
+        """
+        the documents read by a Find or an Aggregate, translated from the compact schema if needed
+        """
+        if isinstance(request, list):
+            for document in request:
+                yield document
+            return
+        collection = self.__db[request.collection]
+        compact = self.compact and request.collection in COMPACT_COLLECTIONS
+        if isinstance(request, Find):
+            cursor = collection.find(encode_filter(request.filter) if compact else request.filter,
+                                     request.projection, sort=request.sort, skip=request.skip, limit=request.limit,
+                                     batch_size=request.batch_size)
+        else:
+            cursor = collection.aggregate(encode_pipeline(request.pipeline) if compact else request.pipeline)
+        async for document in cursor:
+            if not compact:
+                yield document
+            elif isinstance(request, Find):
+                yield decode_document(document, request.projection)
+            else:
+                yield decode_document(document, defaults=False)
+
+    async def _fetch(self, request: Request):
+        if isinstance(request, Compute):
+            # CPU bound, it runs in a thread to keep the event loop free for the other queries
+            return await asyncio.to_thread(request.function, *request.args)
+        return [document async for document in self._documents(request)]
+
+    async def _run(self, query: Query, stream: bool = False):
+        """
+        run a query of QuerySpecs
+        :param stream: return an asynchronous generator reading the final documents lazily
+        """
+        if isinstance(query, Generator):
+            try:
+                request = next(query)
+                while True:
+                    request = query.send(await self._fetch(request))
+            except StopIteration as stop:
+                query = stop.value
+        if not isinstance(query, Rows):
+            return query
+        if stream:
+            return self._stream(query)
+        documents = query.documents if isinstance(query.documents, list) else await self._fetch(query.documents)
+        return format_results(documents, query.pretty, query.row, plain=query.plain)
+
+    async def _stream(self, rows: Rows) -> AsyncIterator:
+        async for document in self._documents(rows.documents):
+            if rows.pretty:
+                yield str(rows.row(document))
+            else:
+                yield document if rows.plain is None else rows.plain(document)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_with_feature"])
+    async def search_with_feature(self, feature: str, city: str, pretty: bool, projection: dict = None,
+                                  stream: bool = False, batch_size: int = 0):
+        return await self._run(QuerySpecs.search_with_feature(feature, city, pretty, projection, batch_size), stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_popular_in_city"])
+    async def search_popular_in_city(self, city_name: str, pretty: bool, limit: int = 3):
+        return await self._run(QuerySpecs.search_popular_in_city(city_name, pretty, limit))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_restaurants_in_radius"])
+    async def search_restaurants_in_radius(self, my_latitude: float, my_longitude: float, max_distance: float,
+                                           pretty: bool):
+        return await self._run(QuerySpecs.search_restaurants_in_radius(my_latitude, my_longitude, max_distance,
+                                                                       pretty))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["get_vegan_restaurants_in_cities"])
+    async def get_vegan_restaurants_in_cities(self, cities: list[str], pretty: bool, projection: dict = None,
+                                              stream: bool = False, batch_size: int = 0):
+        return await self._run(QuerySpecs.get_vegan_restaurants_in_cities(cities, pretty, projection, batch_size),
+                               stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["sort_with_weighted_rating"])
+    async def sort_with_weighted_rating(self, country: str, pretty: bool, limit: int = 30):
+        return await self._run(QuerySpecs.sort_with_weighted_rating(country, pretty, limit))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["get_english_speaking_always_open_restaurants"])
+    async def get_english_speaking_always_open_restaurants(self, open_days: int, reviews: int, min_price: int,
+                                                           max_price: int, pretty: bool, projection: dict = None,
+                                                           stream: bool = False, batch_size: int = 0):
+        return await self._run(QuerySpecs.get_english_speaking_always_open_restaurants(
+            open_days, reviews, min_price, max_price, pretty, projection, batch_size), stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["find_open_at"])
+    async def find_open_at(self, day: str, hour: int, minute: int = 0, city: str = None, pretty: bool = True,
+                           projection: dict = None, stream: bool = False, batch_size: int = 0):
+        return await self._run(QuerySpecs.find_open_at(day, hour, minute, city, pretty, projection, batch_size),
+                               stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_text"])
+    async def search_text(self, text: str, country: str = None, city: str = None, page: int = 0, page_size: int = 10,
+                          pretty: bool = True, projection: dict = None):
+        return await self._run(QuerySpecs.search_text(text, country, city, page, page_size, pretty, projection))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["autocomplete"])
+    async def autocomplete(self, prefix: str, city: str = None, limit: int = 10, pretty: bool = True):
+        return await self._run(QuerySpecs.autocomplete(prefix, city, limit, pretty))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["find_most_expensive_restaurant_in_each_country"])
+    async def find_most_expensive_restaurant_in_each_country(self, pretty: bool):
+        return await self._run(QuerySpecs.find_most_expensive_restaurant_in_each_country(pretty))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["find_top10_highest_rating_restaurant_in_the_5most_popular_cities"])
+    async def find_top10_highest_rating_restaurant_in_the_5most_popular_cities(self, pretty: bool,
+                                                                                projection: dict = None,
+                                                                                stream: bool = False):
+        return await self._run(QuerySpecs.find_top10_highest_rating_restaurant_in_the_5most_popular_cities(
+            pretty, projection), stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["get_top5_countries_with_the_highest_average_excellent_reviews"])
+    async def get_top5_countries_with_the_highest_average_excellent_reviews(self, pretty: bool):
+        return await self._run(QuerySpecs.get_top5_countries_with_the_highest_average_excellent_reviews(pretty))
+
+    @instrumented
+    async def find_the_closest_three_restaurant_in_randon_city(self, pretty: bool = True, k: int = 3,
+                                                               city_name: str = None, min_restaurants: int = 20):
+        return await self._run(QuerySpecs.find_the_closest_three_restaurant_in_randon_city(pretty, k, city_name,
+                                                                                            min_restaurants))
@@ -0,0 +1,98 @@
+import atexit
+import os
+import threading
+from typing import NamedTuple, Optional, Union
+
+from pymongo import MongoClient
+
+
+class ClientOptions(NamedTuple):
+    """
+    options of the connection pool of a MongoClient, None leaves the pymongo default
+    :param max_pool_size: maximum number of connections to each server
+    :param min_pool_size: connections kept open even when idle
+    :param connect_timeout_ms: timeout to open a connection
+    :param server_selection_timeout_ms: timeout to find a server for an operation
+    :param socket_timeout_ms: timeout of a single read or write on a connection
+    :param w: write concern, number of nodes or "majority"
+    :param journal: wait for the journal before acknowledging writes
+    :param read_preference: e.g. "primary", "secondaryPreferred", "nearest"
+    :param event_listeners: pymongo monitoring listeners of the client, e.g. a QueryInstrumentation
+    """
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    connect_timeout_ms: int = 20000
+    server_selection_timeout_ms: int = 30000
+    socket_timeout_ms: Optional[int] = None
+    w: Optional[Union[int, str]] = None
+    journal: Optional[bool] = None
+    read_preference: str = "primary"
+    event_listeners: tuple = ()
+
+    def client_kwargs(self) -> dict:
+        kwargs = {"maxPoolSize": self.max_pool_size,
+                  "minPoolSize": self.min_pool_size,
+                  "connectTimeoutMS": self.connect_timeout_ms,
+                  "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+                  "socketTimeoutMS": self.socket_timeout_ms,
+                  "w": self.w,
+                  "journal": self.journal,
+                  "readPreference": self.read_preference,
+                  "event_listeners": list(self.event_listeners) or None}
+        return {key: value for key, value in kwargs.items() if value is not None}
+
+
+DEFAULT_OPTIONS = ClientOptions()
+
+# (host, port, options) -> [client, number of helpers using it]
+_clients: dict[tuple, list] = {}
+_lock = threading.Lock()
+
+
+def acquire_client(host: str, port: int, options: ClientOptions = DEFAULT_OPTIONS) -> MongoClient:
+    """
+    return the MongoClient of the process for host, port and options, creating it the first time. A MongoClient
+    is thread safe and pools its connections, so all the helpers of the process share the same connections
+    """
+    key = (host, port, options)
+    with _lock:
+        entry = _clients.get(key)
+        if entry is None:
+            entry = _clients[key] = [MongoClient(host=host, port=port, **options.client_kwargs()), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release_client(host: str, port: int, options: ClientOptions = DEFAULT_OPTIONS):
+    """
+    signal that a helper does not use the client anymore. The client stays open for the next helpers, close it with
+    close_all_clients
+    """
+    with _lock:
+        entry = _clients.get((host, port, options))
+        if entry is not None and entry[1] > 0:
+            entry[1] -= 1
+
+
+def close_all_clients():
+    with _lock:
+        for client, _ in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def registry_stats() -> list[dict]:
+    with _lock:
+        return [{"host": host, "port": port, "options": options._asdict(), "references": references}
+                for (host, port, options), (_, references) in _clients.items()]
+
+
+def _forget_clients_after_fork():
+    # a MongoClient must not be used across fork, a child process opens its own connections
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+os.register_at_fork(after_in_child=_forget_clients_after_fork)
+atexit.register(close_all_clients)
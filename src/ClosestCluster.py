@@ -0,0 +1,134 @@
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+EARTH_RADIUS_M = 6_371_008.8
+
+# largest number of distances computed at once, bounds the memory of a cell with many restaurants
+MAX_DISTANCES = 1 << 20
+
+
+class Cluster(NamedTuple):
+    """
+    :param indices: positions of the restaurants of the cluster in the input arrays, the center first
+    :param radius: distance in meters between the center and the farthest restaurant of the cluster
+    :param diameter: largest distance in meters between two restaurants of the cluster
+    """
+    indices: list[int]
+    radius: float
+    diameter: float
+
+
+def haversine(latitudes_a: np.ndarray, longitudes_a: np.ndarray,
+              latitudes_b: np.ndarray, longitudes_b: np.ndarray) -> np.ndarray:
+    """
+    great circle distance in meters between every point of a (rows) and every point of b (columns), the
+    coordinates are in radians
+    """
+    d_latitude = latitudes_b[np.newaxis, :] - latitudes_a[:, np.newaxis]
+    d_longitude = longitudes_b[np.newaxis, :] - longitudes_a[:, np.newaxis]
+    h = (np.sin(d_latitude / 2) ** 2
+         + np.cos(latitudes_a)[:, np.newaxis] * np.cos(latitudes_b)[np.newaxis, :] * np.sin(d_longitude / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def project(latitudes: np.ndarray, longitudes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    equirectangular projection in meters around the median latitude, accurate at the scale of a city. The median is
+    not moved by a few mis-geocoded restaurants
+    """
+    reference = np.median(latitudes)
+    return EARTH_RADIUS_M * longitudes * np.cos(reference), EARTH_RADIUS_M * latitudes
+
+
+def tightest_cluster(latitudes, longitudes, k: int = 3) -> Optional[Cluster]:
+    """
+    find the k restaurants closest to each other, i.e. the restaurant whose k - 1 nearest neighbours are within the
+    smallest radius, together with those neighbours.
+    The points are bucketed in a grid on projected coordinates, the neighbours of a point are searched only in the
+    3x3 block of cells around it and the distances are computed with a vectorized haversine, at most MAX_DISTANCES at
+    a time. The cell size comes from the extent of the central 98% of the points, so a few restaurants with wrong
+    coordinates far away do not make the cells huge. When the cells turn out to be smaller than the best radius the
+    grid is rebuilt with larger cells, so the result is exact
+    :param latitudes: latitudes in degrees
+    :param longitudes: longitudes in degrees
+    :param k: size of the cluster
+    :return: the cluster, None if there are less than k points
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    n = len(latitudes)
+    if k < 2 or n < k:
+        return None
+    x, y = project(latitudes, longitudes)
+    (x_low, x_high), (y_low, y_high) = np.percentile(x, [1, 99]), np.percentile(y, [1, 99])
+    area = max((x_high - x_low) * (y_high - y_low), 1.0)
+    # cells holding about k points each where the restaurants are
+    cell_size = max(np.sqrt(area * k / n), 1.0)
+
+    while True:
+        best = _best_in_grid(latitudes, longitudes, x, y, k, cell_size)
+        # projected distances differ slightly from the haversine ones, keep a margin before trusting the grid
+        if best is not None and best[1] <= 0.9 * cell_size:
+            break
+        if cell_size > 4 * max(x.max() - x.min(), y.max() - y.min(), 1.0):
+            break
+        cell_size *= 2
+
+    center, radius, neighbours = best
+    members = [center] + neighbours
+    distances = haversine(latitudes[members], longitudes[members], latitudes[members], longitudes[members])
+    return Cluster(indices=[int(i) for i in members], radius=float(radius), diameter=float(distances.max()))
+
+
+def _best_in_grid(latitudes, longitudes, x, y, k: int, cell_size: float):
+    cell_x = np.floor((x - x.min()) / cell_size).astype(np.int64)
+    cell_y = np.floor((y - y.min()) / cell_size).astype(np.int64)
+    width = int(cell_x.max()) + 3
+    cell_id = (cell_y + 1) * width + (cell_x + 1)
+
+    order = np.argsort(cell_id, kind="stable")
+    sorted_ids = cell_id[order]
+    cells, starts, counts = np.unique(sorted_ids, return_index=True, return_counts=True)
+    slots = dict(zip(cells.tolist(), zip(starts.tolist(), counts.tolist())))
+    offsets = [dy * width + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+    best = None
+    for cell, (start, count) in slots.items():
+        block = [order[s:s + c] for s, c in (slots.get(cell + offset, (0, 0)) for offset in offsets) if c]
+        candidates = np.concatenate(block)
+        if len(candidates) < k:
+            continue
+        points = order[start:start + count]
+        for rows, radii, nearest in _k_nearest(latitudes, longitudes, points, candidates, k):
+            row = int(np.argmin(radii))
+            if best is None or radii[row] < best[1]:
+                center = int(rows[row])
+                best = (center, float(radii[row]), [int(i) for i in nearest[row] if i != center])
+    return best
+
+
+def _k_nearest(latitudes, longitudes, points: np.ndarray, candidates: np.ndarray, k: int):
+    """
+    the k nearest candidates of every point, a point being the first of its own nearest. The points are taken in
+    chunks of rows and the candidates in chunks of columns, so that at most MAX_DISTANCES distances are in memory
+    :return: for every chunk of points, the points, the distance to their k-th nearest and the k nearest candidates
+    """
+    columns = min(len(candidates), MAX_DISTANCES)
+    rows = max(1, MAX_DISTANCES // columns)
+    for row_start in range(0, len(points), rows):
+        chunk = points[row_start:row_start + rows]
+        best_distances = best_indices = None
+        for column_start in range(0, len(candidates), columns):
+            block = candidates[column_start:column_start + columns]
+            distances = haversine(latitudes[chunk], longitudes[chunk], latitudes[block], longitudes[block])
+            # every point is the first of its own k nearest, even when other restaurants share its coordinates
+            distances[chunk[:, np.newaxis] == block[np.newaxis, :]] = -1
+            indices = np.broadcast_to(block, distances.shape)
+            if column_start:
+                distances = np.concatenate([best_distances, distances], axis=1)
+                indices = np.concatenate([best_indices, indices], axis=1)
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            best_distances = np.take_along_axis(distances, nearest, axis=1)
+            best_indices = np.take_along_axis(indices, nearest, axis=1)
+        yield chunk, best_distances.max(axis=1), best_indices
@@ -1,20 +1,185 @@
+from array import array
 from pathlib import Path
+from typing import Iterator
 import csv
+import mmap
+import os
+import random
 
 
 class CsvHandler:
     def __init__(self, path):
         self._csv_path: Path = Path(path)
-        self._lines: list[list[str]] = []
+        # only the header is read eagerly, rows are streamed on demand by rows()
         with open(path, newline='',  mode="r", encoding="utf-8") as csvfile:
             reader = csv.reader(csvfile, delimiter=',')
             headers = next(reader)
             self._headers = {el: idx for idx, el in enumerate(headers)}
-            for row in reader:
-                self._lines.append(row)
+
+    def rows(self) -> Iterator[list[str]]:
+        """
+        lazily iterate over the rows of the csv, the header excluded
+        :return: generator of rows, memory usage does not depend on the size of the file
+        """
+        with open(self._csv_path, newline='', mode="r", encoding="utf-8") as csvfile:
+            reader = csv.reader(csvfile, delimiter=',')
+            next(reader)
+            yield from reader
 
     def content(self):
-        return self._lines
+        return list(self.rows())
 
     def header(self):
         return self._headers
+
+
+class MappedCsvHandler(CsvHandler):
+    """
+    CsvHandler on a memory mapped file with an index of the byte offset of every row, rows are read and parsed only
+    when accessed. The index is cached in <csv>.idx and rebuilt when the csv changes
+    """
+    INDEX_MAGIC = b"CSVIDX1\n"
+
+    def __init__(self, path, index_path=None):
+        """
+        :param path: path to the csv
+        :param index_path: where the row index is cached, next to the csv if None
+        """
+        super().__init__(path)
+        self._file = open(self._csv_path, mode="rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # an empty file cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._index_path = Path(index_path) if index_path is not None else Path(f"{self._csv_path}.idx")
+        self._offsets: array = self._load_index()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _signature(self) -> array:
+        stat = self._csv_path.stat()
+        return array("Q", [stat.st_size, stat.st_mtime_ns])
+
+    def _load_index(self) -> array:
+        signature = self._signature()
+        try:
+            with open(self._index_path, mode="rb") as index_file:
+                if index_file.read(len(self.INDEX_MAGIC)) == self.INDEX_MAGIC:
+                    cached = array("Q")
+                    cached.frombytes(index_file.read(signature.itemsize * len(signature)))
+                    if cached == signature:
+                        offsets = array("Q")
+                        offsets.frombytes(index_file.read())
+                        return offsets
+        except (OSError, ValueError):
+            pass
+        offsets = self._build_index()
+        try:
+            with open(self._index_path, mode="wb") as index_file:
+                index_file.write(self.INDEX_MAGIC)
+                signature.tofile(index_file)
+                offsets.tofile(index_file)
+        except OSError:
+            # e.g. a read only directory, the index is rebuilt next time
+            pass
+        return offsets
+
+    def _build_index(self) -> array:
+        """
+        byte offset of the beginning of every row after the header, followed by the size of the file. A new line
+        ends a row only outside of quotes, i.e. when the quotes seen since the beginning of the row are even
+        """
+        data = self._map
+        size = len(data)
+        offsets = array("Q")
+        position = 0
+        quotes = 0
+        while position < size:
+            newline = data.find(b"\n", position)
+            end = size if newline == -1 else newline + 1
+            quotes += data[position:end].count(b'"')
+            position = end
+            # the end of the header is the beginning of the first row
+            if quotes % 2 == 0 and position < size:
+                quotes = 0
+                offsets.append(position)
+        offsets.append(size)
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _lines(self, start: int, end: int) -> Iterator[str]:
+        """
+        the lines of the mapped file in [start, end), one at a time, so only the pages of the rows read are resident
+        """
+        data = self._map
+        position = start
+        while position < end:
+            newline = data.find(b"\n", position, end)
+            line_end = end if newline == -1 else newline + 1
+            yield data[position:line_end].decode("utf-8")
+            position = line_end
+
+    def _parse(self, start: int, end: int) -> Iterator[list[str]]:
+        # like ParallelImporter.read_byte_range, the reader joins the lines of the quoted fields spanning several
+        return csv.reader(self._lines(start, end), delimiter=',')
+
+    def row(self, index: int) -> list[str]:
+        """
+        parse a single row, in O(1)
+        :param index: position of the row, the header excluded. Negative indices count from the end
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"row {index} out of range")
+        return next(self._parse(self._offsets[index], self._offsets[index + 1]))
+
+    def __getitem__(self, index: int) -> list[str]:
+        return self.row(index)
+
+    def rows(self, start: int = 0, stop: int = None) -> Iterator[list[str]]:
+        """
+        lazily iterate over the rows in [start, stop), all the rows by default
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return iter(())
+        return self._parse(self._offsets[start], self._offsets[stop])
+
+    def column(self, name: str, start: int = 0, stop: int = None) -> Iterator[str]:
+        """
+        lazily extract the cells of a column from the rows in [start, stop)
+        """
+        index = self._headers[name]
+        return (line[index] for line in self.rows(start, stop))
+
+    def sample(self, k: int, seed: int = None) -> list[list[str]]:
+        """
+        k rows chosen at random, only these rows are read
+        """
+        return [self.row(index) for index in sorted(random.Random(seed).sample(range(len(self)), k))]
+
+    def row_ranges(self, parts: int) -> list[tuple[int, int]]:
+        """
+        split the rows in at most parts contiguous ranges of about the same number of rows
+        :return: list of (start, stop) row indices, stop excluded
+        """
+        bounds = [len(self) * part // parts for part in range(parts + 1)]
+        return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if start < stop]
+
+    def byte_ranges(self, parts: int) -> list[tuple[int, int]]:
+        """
+        the row ranges of row_ranges as byte offsets in the file, every range starts at the beginning of a row even
+        when quoted fields contain new lines
+        """
+        return [(self._offsets[start], self._offsets[stop]) for start, stop in self.row_ranges(parts)]
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import re
+import unicodedata
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+import bson
+
+
+class Column(NamedTuple):
+    """
+    declaration of how a csv column is stored in the restaurant document
+    :param name: name of the column in the csv header
+    :param path: dotted path of the field in the document, e.g. Rating.excellent
+    :param type: conversion applied to non empty cells, None keeps the string as it is
+    :param default: value stored when the cell is empty, [] and {} are copied for every document
+    """
+    name: str
+    path: str
+    type: Optional[Callable[[str], Any]] = None
+    default: Any = ""
+
+
+def split_list(value: str) -> list[str]:
+    return value.replace(" ", "").split(",")
+
+
+def split_list_keep_spaces(value: str) -> list[str]:
+    return value.split(",")
+
+
+def continent(original_location: str) -> str:
+    return original_location.replace("[", "").replace('"', "").split(",")[0]
+
+
+def _price_bounds(price_range: str) -> list[str]:
+    return price_range.replace(",", "").replace("CHF\u00A0", "$").split("-")
+
+
+def min_price(price_range: str) -> int:
+    return int(_price_bounds(price_range)[0][1:])
+
+
+def max_price(price_range: str) -> int:
+    return int(_price_bounds(price_range)[1][1:])
+
+
+def add_location(document: dict):
+    """
+    store the coordinates as a GeoJSON point usable by a 2dsphere index. Rows with a missing coordinate (stored as 0)
+    or coordinates out of range get no point, a 2dsphere index would reject the whole document
+    """
+    position = document["Position"]
+    latitude, longitude = position["latitude"], position["longitude"]
+    if latitude != 0 and longitude != 0 and -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        position["location"] = {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+# e.g. "#12 of 1,310 places to eat in Osnabruck"
+POPULARITY_PATTERN = re.compile(r"^#([\d,]+) of ([\d,]+) (.+?) in (.+)$")
+
+
+def parse_popularity(popularity: str) -> Optional[dict]:
+    """
+    :return: rank, rank_total, category and scope_city of a popularity string, None if it has another format
+    """
+    match = POPULARITY_PATTERN.match(popularity)
+    if match is None:
+        return None
+    rank, total, category, city = match.groups()
+    return {"rank": int(rank.replace(",", "")), "rank_total": int(total.replace(",", "")),
+            "category": category, "scope_city": city}
+
+
+def add_popularity_rank(document: dict):
+    """
+    store the rank of popularity_generic as numbers, so the most popular restaurants of a city are an index range
+    sorted numerically ("#10" after "#2")
+    """
+    popularity = document["Popularity"]
+    ranking = parse_popularity(popularity["popularity_generic"])
+    if ranking is not None:
+        popularity.update(ranking)
+
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# e.g. "12:00-14:30", a shift ending at or before its start ends the next day
+SHIFT_PATTERN = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$")
+
+
+def minute_of_week(day: str, hour: int, minute: int = 0) -> int:
+    return DAYS.index(day) * MINUTES_PER_DAY + hour * 60 + minute
+
+
+def open_intervals(open_hours: dict) -> list[tuple[int, int]]:
+    """
+    opening hours as sorted, disjoint [start, end) intervals of minutes of the week, Monday 00:00 is 0.
+    Shifts past Sunday midnight continue on Monday, shifts in another format are ignored
+    :param open_hours: map from day to list of shifts, as in original_open_hours
+    """
+    if not isinstance(open_hours, dict):
+        return []
+    intervals = []
+    for day, shifts in open_hours.items():
+        if day not in DAYS or not isinstance(shifts, list):
+            continue
+        for shift in shifts:
+            match = SHIFT_PATTERN.match(shift) if isinstance(shift, str) else None
+            if match is None:
+                continue
+            start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+            start = minute_of_week(day, start_hour, start_minute)
+            end = minute_of_week(day, end_hour, end_minute)
+            if end <= start:
+                end += MINUTES_PER_DAY
+            if end > MINUTES_PER_WEEK:
+                intervals.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            intervals.append((start, end))
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def add_open_hours(document: dict):
+    """
+    store the opening hours as minute of the week intervals, for exact checks, and as the hours of the week
+    (0 to 167) with at least one open minute, an array indexed by a multikey index
+    """
+    schedule = document["Schedule"]
+    intervals = open_intervals(schedule["original_open_hours"])
+    schedule["open_intervals"] = [{"start": start, "end": end} for start, end in intervals]
+    schedule["open_slots"] = sorted({hour for start, end in intervals
+                                     for hour in range(start // 60, (end - 1) // 60 + 1)})
+
+
+# weight of each Rating field in the weightedRating of a restaurant, after a change run
+# MongoHelper.recompute_weighted_ratings on the imported restaurants
+RATING_WEIGHTS: dict[str, float] = {"food": 1, "atmosphere": 1, "value": 1, "service": 1}
+
+
+def weighted_rating(rating: dict) -> float:
+    return sum(weight * (rating.get(name) or 0) for name, weight in RATING_WEIGHTS.items())
+
+
+def add_weighted_rating(document: dict):
+    """
+    store the weighted sum of the ratings, indexed with the country so the best restaurants of a country are read
+    from the index already sorted
+    """
+    document["weightedRating"] = weighted_rating(document["Rating"])
+
+
+def normalize_name(name: str) -> str:
+    """
+    lower case name without accents and repeated spaces, "Café  de Flore" -> "cafe de flore"
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).casefold().split())
+
+
+def add_search_name(document: dict):
+    """
+    store the normalized name, the autocomplete reads the names starting with a prefix as a range of its index
+    """
+    document["search_name"] = normalize_name(document["restaurant_name"])
+
+
+def add_sync_hash(document: dict):
+    """
+    store a hash of the document, an incremental sync rewrites only the restaurants whose hash changed.
+    Must be the last derived field, the fields added after it are not part of the hash
+    """
+    document["sync_hash"] = hashlib.blake2b(bson.encode(document), digest_size=16).hexdigest()
+
+
+# conversions that the compiled converter writes inline instead of calling, {0} is the cell
+INLINE_CONVERSIONS: dict[Callable, str] = {
+    split_list: "{0}.replace(' ', '').split(',')",
+    split_list_keep_spaces: "{0}.split(',')",
+    float: "float({0})",
+}
+
+RESTAURANT_SCHEMA: list[Column] = [
+    Column("restaurant_link", "restaurant_link"),
+    Column("restaurant_name", "restaurant_name"),
+    Column("claimed", "claimed"),
+    Column("awards", "awards", split_list_keep_spaces, []),
+    Column("keywords", "keywords", split_list_keep_spaces, []),
+    Column("features", "features", split_list, []),
+
+    Column("original_location", "Position.continent", continent, ""),
+    Column("country", "Position.country"),
+    Column("region", "Position.region"),
+    Column("province", "Position.province"),
+    Column("city", "Position.city"),
+    Column("address", "Position.address"),
+    Column("latitude", "Position.latitude", float, 0),
+    Column("longitude", "Position.longitude", float, 0),
+
+    Column("popularity_detailed", "Popularity.popularity_detailed"),
+    Column("popularity_generic", "Popularity.popularity_generic"),
+    Column("top_tags", "Popularity.top_tags", split_list, []),
+
+    Column("price_level", "Price.price_level"),
+    Column("price_range", "Price.min_price", min_price, None),
+    Column("price_range", "Price.max_price", max_price, None),
+
+    Column("meals", "FoodInfo.meals", split_list, []),
+    Column("cuisines", "FoodInfo.cuisines", split_list, []),
+    Column("special_diets", "FoodInfo.special_diets", split_list, []),
+    Column("vegetarian_friendly", "FoodInfo.vegetarian_friendly"),
+    Column("vegan_options", "FoodInfo.vegan_options"),
+    Column("gluten_free", "FoodInfo.gluten_free"),
+
+    Column("original_open_hours", "Schedule.original_open_hours", json.loads, {}),
+    Column("open_days_per_week", "Schedule.open_days_per_week", float, None),
+    Column("open_hours_per_week", "Schedule.open_hours_per_week", float, None),
+    Column("working_shifts_per_week", "Schedule.working_shifts_per_week", float, None),
+
+    Column("total_reviews_count", "Review.total_reviews_count", float, 0),
+    Column("default_language", "Review.default_language"),
+    Column("reviews_count_in_default_language", "Review.reviews_count_in_default_language", float, 0),
+
+    Column("avg_rating", "Rating.avg_rating", float, 0),
+    Column("excellent", "Rating.excellent", float, 0),
+    Column("very_good", "Rating.very_good", float, 0),
+    Column("average", "Rating.average", float, 0),
+    Column("poor", "Rating.poor", float, 0),
+    Column("terrible", "Rating.terrible", float, 0),
+    Column("food", "Rating.food", float, 0),
+    Column("service", "Rating.service", float, 0),
+    Column("value", "Rating.value", float, 0),
+    Column("atmosphere", "Rating.atmosphere", float, 0),
+]
+
+# fields computed from the converted document, applied in order
+RESTAURANT_DERIVED_FIELDS: list[Callable[[dict], None]] = [
+    add_location,
+    add_popularity_rank,
+    add_open_hours,
+    add_weighted_rating,
+    add_search_name,
+    add_sync_hash,
+]
+
+
+def compile_schema(schema: list[Column], headers: dict[str, int],
+                   derived: list[Callable[[dict], None]] = ()) -> Callable[[list[str]], dict]:
+    """
+    compile the schema against the csv header in a single function converting a row in a document.
+    The cells are extracted at once with an itemgetter on precomputed indices and the nested document is built by
+    generated code, so a row costs no dictionary lookup on the header and no repeated indexing
+    :param schema: list of columns, the order of the columns is the order of the fields in the document
+    :param headers: map from column name to index, see CsvHandler.header()
+    :param derived: functions completing the document in place once all the columns are converted
+    :return: function from csv row to document
+    """
+    missing = [column.name for column in schema if column.name not in headers]
+    if missing:
+        raise ValueError(f"columns {missing} not found in csv header")
+
+    indices = [headers[column.name] for column in schema]
+    # itemgetter returns a bare value instead of a tuple when it gets a single index
+    namespace: dict[str, Any] = {"_get": itemgetter(*indices) if len(indices) > 1 else lambda line: (line[indices[0]],)}
+    tree: dict = {}
+    for position, column in enumerate(schema):
+        value = f"v{position}"
+        if isinstance(column.default, (list, dict)):
+            namespace[f"d{position}"] = type(column.default)
+            default = f"d{position}()"
+        else:
+            namespace[f"d{position}"] = column.default
+            default = f"d{position}"
+        if column.type is None and column.default == "":
+            expression = value
+        elif column.type is None:
+            expression = f"({value} if {value} != '' else {default})"
+        elif column.type in INLINE_CONVERSIONS:
+            conversion = INLINE_CONVERSIONS[column.type].format(value)
+            expression = f"({conversion} if {value} != '' else {default})"
+        else:
+            namespace[f"t{position}"] = column.type
+            expression = f"(t{position}({value}) if {value} != '' else {default})"
+        *parents, leaf = column.path.split(".")
+        node = tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = expression
+
+    def literal(node: dict) -> str:
+        return "{" + ", ".join(f"{key!r}: {literal(child) if isinstance(child, dict) else child}"
+                               for key, child in node.items()) + "}"
+
+    unpacked = ", ".join(f"v{position}" for position in range(len(schema)))
+    body = [f"{unpacked}, = _get(line)", f"document = {literal(tree)}"]
+    for position, function in enumerate(derived):
+        namespace[f"f{position}"] = function
+        body.append(f"f{position}(document)")
+    body.append("return document")
+    source = "def convert(line):\n" + "".join(f"    {statement}\n" for statement in body)
+    exec(compile(source, "<restaurant schema>", "exec"), namespace)
+    return namespace["convert"]
+
+
+def transform_rows(rows: Iterable[list[str]], headers: dict[str, int]) -> Iterator[dict]:
+    """
+    lazily transform a stream of csv rows in restaurant documents
+    """
+    convert = compile_schema(RESTAURANT_SCHEMA, headers, RESTAURANT_DERIVED_FIELDS)
+    for line in rows:
+        yield convert(line)
@@ -0,0 +1,221 @@
+import threading
+from typing import Iterable, NamedTuple, Union
+
+from pymongo.collection import Collection
+
+# facet name -> field of the restaurant document holding a list of values
+FACET_FIELDS: dict[str, str] = {
+    "features": "features",
+    "cuisines": "FoodInfo.cuisines",
+    "special_diets": "FoodInfo.special_diets",
+    "top_tags": "Popularity.top_tags",
+}
+
+FACET_PROJECTION = {"_id": 0, "restaurant_link": 1, "Position.city": 1,
+                    **{field: 1 for field in FACET_FIELDS.values()}}
+
+
+class Term(NamedTuple):
+    """
+    restaurants having value in facet, e.g. Term("features", "Seating")
+    """
+    facet: str
+    value: str
+
+
+class All(NamedTuple):
+    """
+    restaurants matching all the expressions
+    """
+    expressions: tuple
+
+
+class Any(NamedTuple):
+    """
+    restaurants matching at least one of the expressions
+    """
+    expressions: tuple
+
+
+class Not(NamedTuple):
+    expression: "Expression"
+
+
+Expression = Union[Term, All, Any, Not]
+
+
+def _values(document: dict, field: str) -> list:
+    node = document
+    for key in field.split("."):
+        if not isinstance(node, dict):
+            return []
+        node = node.get(key)
+    return node if isinstance(node, list) else []
+
+
+class _CityIndex:
+    """
+    bitsets of the restaurants of one city, bit i is the i-th restaurant indexed in the city. Numbering the
+    restaurants per city keeps the bitsets dense, so a Python int is a compact bitset
+    """
+
+    def __init__(self):
+        self.links: list[str] = []
+        self.present = 0
+        # (facet, value) -> bitset
+        self.bits: dict[tuple[str, str], int] = {}
+
+    def evaluate(self, expression: Expression) -> int:
+        if isinstance(expression, Term):
+            return self.bits.get(expression, 0)
+        if isinstance(expression, All):
+            result = self.present
+            for child in expression.expressions:
+                result &= self.evaluate(child)
+                if not result:
+                    break
+            return result
+        if isinstance(expression, Any):
+            result = 0
+            for child in expression.expressions:
+                result |= self.evaluate(child)
+            return result
+        if isinstance(expression, Not):
+            return self.present & ~self.evaluate(expression.expression)
+        raise TypeError(f"unknown facet expression {expression!r}")
+
+
+class FacetIndex:
+    """
+    in process index of the multi valued fields of the restaurants (FACET_FIELDS), with one bitset per city and
+    facet value. Filters combining facets with All, Any and Not and their counts are bitwise operations.
+    Readers and writers share one lock, a read never sees a restaurant half refreshed
+    """
+
+    def __init__(self):
+        self._cities: dict[str, _CityIndex] = {}
+        # restaurant_link -> (city, bit)
+        self._positions: dict[str, tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, documents: Iterable[dict]) -> "FacetIndex":
+        """
+        :param documents: restaurants with restaurant_link, Position.city and the fields of FACET_FIELDS
+        """
+        index = cls()
+        for document in documents:
+            index.refresh(document)
+        return index
+
+    @classmethod
+    def from_collection(cls, collection: Collection) -> "FacetIndex":
+        return cls.build(collection.find({}, FACET_PROJECTION, batch_size=10_000))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._positions)
+
+    def refresh(self, document: dict):
+        """
+        index a new restaurant or replace the facet values of an indexed one
+        """
+        link = document["restaurant_link"]
+        city = document.get("Position", {}).get("city", "")
+        with self._lock:
+            position = self._positions.get(link)
+            if position is not None and position[0] != city:
+                self._remove(link)
+                position = None
+            if position is None:
+                city_index = self._cities.setdefault(city, _CityIndex())
+                bit = len(city_index.links)
+                city_index.links.append(link)
+                self._positions[link] = (city, bit)
+            else:
+                city_index = self._cities[city]
+                bit = position[1]
+                self._clear(city_index, bit)
+            mask = 1 << bit
+            city_index.present |= mask
+            for facet, field in FACET_FIELDS.items():
+                for value in _values(document, field):
+                    key = Term(facet, value)
+                    city_index.bits[key] = city_index.bits.get(key, 0) | mask
+
+    def add_value(self, restaurant_link: str, facet: str, value: str):
+        """
+        add a single facet value to an indexed restaurant, e.g. after update_restaurant_feature
+        """
+        with self._lock:
+            position = self._positions.get(restaurant_link)
+            if position is None:
+                return
+            city, bit = position
+            city_index = self._cities[city]
+            key = Term(facet, value)
+            city_index.bits[key] = city_index.bits.get(key, 0) | (1 << bit)
+
+    def remove(self, restaurant_link: str):
+        with self._lock:
+            self._remove(restaurant_link)
+
+    def _remove(self, restaurant_link: str):
+        position = self._positions.pop(restaurant_link, None)
+        if position is None:
+            return
+        city_index = self._cities[position[0]]
+        # the bit is not reused, the restaurant is only marked as absent
+        self._clear(city_index, position[1])
+        city_index.present &= ~(1 << position[1])
+
+    @staticmethod
+    def _clear(city_index: _CityIndex, bit: int):
+        mask = ~(1 << bit)
+        for key, bits in list(city_index.bits.items()):
+            if bits >> bit & 1:
+                city_index.bits[key] = bits & mask
+
+    def _selected(self, cities: Iterable[str] = None) -> list[_CityIndex]:
+        if cities is None:
+            return list(self._cities.values())
+        return [self._cities[city] for city in cities if city in self._cities]
+
+    def count(self, expression: Expression, cities: Iterable[str] = None) -> int:
+        """
+        number of restaurants matching the expression, in the given cities or everywhere
+        """
+        with self._lock:
+            return sum(city_index.evaluate(expression).bit_count() for city_index in self._selected(cities))
+
+    def search(self, expression: Expression, cities: Iterable[str] = None, limit: int = None) -> list[str]:
+        """
+        :return: links of the restaurants matching the expression, at most limit
+        """
+        links = []
+        with self._lock:
+            for city_index in self._selected(cities):
+                bits = city_index.evaluate(expression)
+                while bits and (limit is None or len(links) < limit):
+                    lowest = bits & -bits
+                    links.append(city_index.links[lowest.bit_length() - 1])
+                    bits ^= lowest
+        return links
+
+    def facet_counts(self, expression: Expression, facet: str, cities: Iterable[str] = None) -> dict[str, int]:
+        """
+        for every value of facet, the number of restaurants matching the expression that have it, the counts shown
+        next to the values of a filter
+        """
+        counts: dict[str, int] = {}
+        with self._lock:
+            for city_index in self._selected(cities):
+                bits = city_index.evaluate(expression)
+                if not bits:
+                    continue
+                for key, value_bits in city_index.bits.items():
+                    if key.facet == facet:
+                        count = (bits & value_bits).bit_count()
+                        if count:
+                            counts[key.value] = counts.get(key.value, 0) + count
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
@@ -0,0 +1,85 @@
+import time
+from typing import Iterable
+
+from pymongo import ReplaceOne
+from pymongo.collection import Collection
+
+from src.CompactSchema import compact_rows
+from src.CsvHandler import CsvHandler
+from src.DocumentTransformer import add_sync_hash, transform_rows
+from src.MongoHelper import MongoHelper, batched
+
+
+def stored_hashes(collection: Collection) -> dict[str, tuple]:
+    """
+    :return: map from restaurant_link to (sync_hash, country, city) of the stored restaurants, the hash is None for
+    restaurants imported without it
+    """
+    cursor = collection.find({}, {"_id": 0, "restaurant_link": 1, "sync_hash": 1, "Position.country": 1,
+                                  "Position.city": 1}, batch_size=10_000)
+    return {restaurant["restaurant_link"]: (restaurant.get("sync_hash"),
+                                            restaurant.get("Position", {}).get("country"),
+                                            restaurant.get("Position", {}).get("city"))
+            for restaurant in cursor}
+
+
+def sync_documents(collection: Collection, documents: Iterable[dict], batch_size: int = 1000) -> dict:
+    """
+    make the collection equal to the documents, keyed by restaurant_link: new and changed documents are upserted and
+    the restaurants missing from the documents are deleted, with unordered bulk writes of batch_size operations.
+    A document is changed when its sync_hash differs from the stored one, unchanged restaurants are not touched, so
+    the commands applied to them (new ratings, features...) are kept
+    :param documents: documents as built by transform_rows, with their sync_hash
+    :return: report with the number of inserted, replaced, unchanged and deleted restaurants, the countries to
+    recompute in the rollups, the (country, city) locations whose restaurants changed and the links of the written
+    (written_links) and deleted (deleted_links) restaurants
+    """
+    before = time.time()
+    stored = stored_hashes(collection)
+    seen = set()
+    locations = set()
+    written = []
+    report = {"inserted": 0, "replaced": 0, "unchanged": 0, "deleted": 0}
+
+    def changed():
+        for document in documents:
+            if "sync_hash" not in document:
+                add_sync_hash(document)
+            link = document["restaurant_link"]
+            seen.add(link)
+            stored_hash, stored_country, stored_city = stored.get(link, (None, None, None))
+            if stored_hash == document["sync_hash"]:
+                report["unchanged"] += 1
+                continue
+            if link in stored:
+                locations.add((stored_country, stored_city))
+            locations.add((document["Position"]["country"], document["Position"]["city"]))
+            written.append(link)
+            yield ReplaceOne({"restaurant_link": link}, document, upsert=True)
+
+    for operations in batched(changed(), batch_size):
+        result = collection.bulk_write(operations, ordered=False)
+        report["inserted"] += result.upserted_count
+        report["replaced"] += result.matched_count
+
+    vanished = [link for link in stored if link not in seen]
+    locations.update(stored[link][1:] for link in vanished)
+    for links in batched(vanished, batch_size):
+        report["deleted"] += collection.delete_many({"restaurant_link": {"$in": links}}).deleted_count
+
+    report["countries"] = sorted({country for country, _ in locations} - {None})
+    report["locations"] = sorted(locations, key=str)
+    report["written_links"] = written
+    report["deleted_links"] = vanished
+    report["seconds"] = round(time.time() - before, 3)
+    return report
+
+
+def sync_csv(helper: MongoHelper, csv_path, batch_size: int = 1000) -> dict:
+    """
+    incrementally sync the Restaurants collection with a (newer) csv of the dataset, see
+    MongoHelper.sync_restaurants. The documents are of the schema of the helper, full or compact
+    """
+    csv_handler = CsvHandler(csv_path)
+    documents = (compact_rows if helper.compact else transform_rows)(csv_handler.rows(), csv_handler.header())
+    return helper.sync_restaurants(documents, batch_size)
@@ -0,0 +1,92 @@
+import time
+from typing import Any, NamedTuple
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+
+class IndexSpec(NamedTuple):
+    """
+    declaration of an index of the Restaurants collection
+    :param name: name of the index in Mongo
+    :param keys: list of (field, direction) as accepted by create_index
+    :param options: extra options of create_index, e.g. unique
+    :param queries: MongoHelper methods served by the index, only informative
+    """
+    name: str
+    keys: list[tuple[str, Any]]
+    options: dict = {}
+    queries: tuple[str, ...] = ()
+
+
+# Every index follows the equality - sort - range order of the query it serves
+INDEX_CATALOG: list[IndexSpec] = [
+    IndexSpec("restaurant_link_unique", [("restaurant_link", ASCENDING)], {"unique": True},
+              ("get_restaurants", "update_ratings", "update_restaurant_feature")),
+    # features is an array, so this is a multikey index
+    IndexSpec("city_features", [("Position.city", ASCENDING), ("features", ASCENDING)], {},
+              ("search_with_feature",)),
+    IndexSpec("city_vegetarian_gluten_free", [("Position.city", ASCENDING),
+                                              ("FoodInfo.vegetarian_friendly", ASCENDING),
+                                              ("FoodInfo.gluten_free", ASCENDING)], {},
+              ("get_vegan_restaurants_in_cities",)),
+    # with an $in on the city the sort is a merge of the per city index ranges
+    IndexSpec("city_rating", [("Position.city", ASCENDING), ("Rating.avg_rating", DESCENDING),
+                              ("Rating.excellent", DESCENDING)], {},
+              ("find_top10_highest_rating_restaurant_in_the_5most_popular_cities",)),
+    IndexSpec("city_price", [("Position.city", ASCENDING), ("Price.price_level", ASCENDING)], {},
+              ("assign_similarly_priced_restaurants",)),
+    IndexSpec("country_weighted_rating", [("Position.country", ASCENDING), ("weightedRating", DESCENDING)], {},
+              ("sort_with_weighted_rating",)),
+    IndexSpec("popularity_city_rank", [("Popularity.scope_city", ASCENDING), ("Popularity.rank", ASCENDING)], {},
+              ("search_popular_in_city",)),
+    # open_slots is an array, so this is a multikey index. It comes first to serve also the searches without city
+    IndexSpec("open_slots_city", [("Schedule.open_slots", ASCENDING), ("Position.city", ASCENDING)], {},
+              ("find_open_at", "add_weekend_availability")),
+    # a collection has at most one text index. No language: the names and keywords are in many languages, so they
+    # are neither stemmed nor stripped of stop words
+    IndexSpec("restaurant_text", [("restaurant_name", TEXT), ("keywords", TEXT), ("Popularity.top_tags", TEXT)],
+              {"weights": {"restaurant_name": 10, "keywords": 3, "Popularity.top_tags": 1}, "default_language": "none"},
+              ("search_text",)),
+    IndexSpec("city_search_name", [("Position.city", ASCENDING), ("search_name", ASCENDING)], {},
+              ("autocomplete",)),
+    IndexSpec("search_name", [("search_name", ASCENDING)], {},
+              ("autocomplete",)),
+    IndexSpec("location_2dsphere", [("Position.location", GEOSPHERE)], {},
+              ("search_restaurants_in_radius",)),
+]
+
+
+def index_sizes(collection: Collection) -> dict[str, int]:
+    """
+    size in bytes of every index of the collection, empty if the server does not expose storage stats
+    """
+    try:
+        stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]), None)
+    except OperationFailure:
+        return {}
+    return dict(stats["storageStats"].get("indexSizes", {})) if stats else {}
+
+
+def ensure_indexes(collection: Collection, catalog: list[IndexSpec] = INDEX_CATALOG) -> list[dict]:
+    """
+    create the indexes of the catalog that do not exist yet, existing indexes with the same name are left untouched
+    :param collection: collection to index
+    :param catalog: indexes to ensure
+    :return: report with, for every index, the build time in ms and the size in bytes
+    """
+    existing = collection.index_information()
+    report = []
+    for spec in catalog:
+        before = time.time()
+        created = spec.name not in existing
+        if created:
+            collection.create_index(spec.keys, name=spec.name, **spec.options)
+        report.append({"index": spec.name,
+                       "created": created,
+                       "build_time_ms": round((time.time() - before) * 1000, 2) if created else 0})
+    sizes = index_sizes(collection)
+    for row in report:
+        row["size_bytes"] = sizes.get(row["index"])
+    return report
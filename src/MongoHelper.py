@@ -1,10 +1,26 @@
 import itertools
-import math
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from geopy.distance import great_circle
+from typing import Generator, Iterable, Iterator
 from pymongo import MongoClient
 from pymongo import UpdateOne
 
+from src import QuerySpecs
+from src.ClientRegistry import DEFAULT_OPTIONS, ClientOptions, acquire_client, release_client
+from src.CompactSchema import CompactDatabase, encode_filter
+from src.DocumentTransformer import RATING_WEIGHTS, add_open_hours, add_search_name, minute_of_week, parse_popularity
+from src.FacetIndex import FACET_PROJECTION, FacetIndex
+from src.IndexManager import ensure_indexes
+from src.PriceAdjustment import PriceAdjustment, PriceRule, apply_price_adjustments
+from src.QueryCache import QueryCache, cached_query, document_tags
+from src.QueryInstrumentation import QueryInstrumentation, instrumented
+from src.QuerySpecs import CACHE_TAGS, Compute, Find, Query, Request, Rows, format_results, prettify
+from src.Rollups import (COUNTRY_ROLLUPS, build_rollups, record_excellent_ratings, refresh_if_most_expensive,
+                         refresh_most_expensive_matching)
+
 
 class Rating(Enum):
     excellent = 5
@@ -14,17 +30,175 @@ class Rating(Enum):
     terrible = 1
 
 
-def prettify(elements):
-    return '\n'.join(map(str, elements))
+PRICE_LEVELS = ["€", "€€-€€€", "€€€€"]
+
+
+def batched(iterable: Iterable, batch_size: int) -> Iterator[list]:
+    """
+    split an iterable in lists of at most batch_size elements
+    """
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def closest_priced(restaurants: list[dict], neighbours: int) -> Iterator[tuple[str, list[str]]]:
+    """
+    for every restaurant find the neighbours restaurants with the closest average price. The restaurants are sorted
+    by average price and the closest ones are taken expanding a window to the left and to the right of each of them.
+    Restaurants without a price range are only matched among themselves
+    :param restaurants: restaurants with restaurant_link and Price
+    :param neighbours: number of similar restaurants for each restaurant
+    :return: pairs of (restaurant link, links of the similar restaurants)
+    """
+    priced, unpriced = [], []
+    for r in restaurants:
+        low, high = r["Price"].get("min_price"), r["Price"].get("max_price")
+        if low is None or high is None:
+            unpriced.append((0.0, r["restaurant_link"]))
+        else:
+            priced.append(((low + high) / 2, r["restaurant_link"]))
+    for group in (sorted(priced), unpriced):
+        for i, (price, link) in enumerate(group):
+            left, right = i - 1, i + 1
+            similar = []
+            while len(similar) < neighbours and (left >= 0 or right < len(group)):
+                if right >= len(group) or (left >= 0 and price - group[left][0] <= group[right][0] - price):
+                    similar.append(group[left][1])
+                    left -= 1
+                else:
+                    similar.append(group[right][1])
+                    right += 1
+            yield link, similar
+
+
+def weighted_rating_expression() -> dict:
+    """
+    aggregation expression of the weightedRating of a restaurant with the RATING_WEIGHTS, see
+    DocumentTransformer.weighted_rating
+    """
+    return {"$add": [{"$multiply": [{"$ifNull": [f"$Rating.{name}", 0]}, weight]}
+                     for name, weight in RATING_WEIGHTS.items()]}
+
+
+def rating_update_pipeline(increments: dict[str, int]) -> list[dict]:
+    """
+    pipeline update adding ratings to the buckets of a restaurant and recomputing its average from the buckets and
+    its weightedRating
+    :param increments: number of new ratings for each bucket name, see Rating
+    """
+    buckets = [rating.name for rating in Rating]
+    return [
+        {"$set": {
+            **{f"Rating.{name}": {"$add": [{"$ifNull": [f"$Rating.{name}", 0]}, count]}
+               for name, count in increments.items() if count},
+            "Review.total_reviews_count": {"$add": [{"$ifNull": ["$Review.total_reviews_count", 0]},
+                                                    sum(increments.values())]}
+        }},
+        {"$set": {"Rating.avg_rating": {"$let": {
+            "vars": {
+                "count": {"$add": [{"$ifNull": [f"$Rating.{name}", 0]} for name in buckets]},
+                "total": {"$add": [{"$multiply": [{"$ifNull": [f"$Rating.{name}", 0]}, Rating[name].value]}
+                                   for name in buckets]}
+            },
+            "in": {"$cond": [{"$gt": ["$$count", 0]}, {"$divide": ["$$total", "$$count"]}, 0]}
+        }}}},
+        # the weights may include avg_rating
+        {"$set": {"weightedRating": weighted_rating_expression()}}
+    ]
 
 
 class MongoHelper:
     def database(self):
         return self.__db
 
-    def __init__(self, host: str, port: int, dbName: str):
-        self.__client: MongoClient = MongoClient(host=host, port=port)
-        self.__db = self.__client[dbName]
+    def __init__(self, host: str, port: int, dbName: str, query_cache: QueryCache = None,
+                 client_options: ClientOptions = DEFAULT_OPTIONS, instrumentation: QueryInstrumentation = None,
+                 facet_index: FacetIndex = None, compact: bool = False):
+        """
+        :param query_cache: cache of the query results, invalidated by the commands of this class. None disables it
+        :param client_options: pool size, timeouts, write concern and read preference of the connection. The helpers
+        with the same host, port and options share one pooled MongoClient, see ClientRegistry
+        :param instrumentation: times the queries and commands and explains the slow ones. It listens on its own
+        client, None disables it
+        :param facet_index: in process index of features, cuisines, diets and tags, kept up to date by the commands
+        of this class that change them. See build_facet_index
+        :param compact: the Restaurants collection holds documents of the compact schema, the queries are translated
+        and their results decoded so they are the same as on the full schema. See CompactSchema
+        """
+        if instrumentation is not None:
+            client_options = client_options._replace(
+                event_listeners=client_options.event_listeners + (instrumentation,))
+        self.instrumentation = instrumentation
+        self.__address = (host, port, client_options)
+        self.__client: MongoClient = acquire_client(host, port, client_options)
+        self.__db = CompactDatabase(self.__client[dbName]) if compact else self.__client[dbName]
+        self.compact = compact
+        self.__closed = False
+        self.query_cache = query_cache
+        self.facet_index = facet_index
+
+    def close(self):
+        """
+        release the shared client, the helper must not be used afterwards
+        """
+        if not self.__closed:
+            self.__closed = True
+            release_client(*self.__address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def cache_stats(self) -> dict:
+        """
+        hit, miss and invalidation counters of the query cache
+        """
+        return self.query_cache.stats() if self.query_cache is not None else {}
+
+    def _invalidate_document(self, document: dict):
+        if self.query_cache is not None and document is not None:
+            position = document.get("Position", {})
+            self.query_cache.invalidate(document_tags(position.get("country"), position.get("city")))
+
+    def build_facet_index(self) -> FacetIndex:
+        """
+        index the facets of the whole Restaurants collection and keep the index up to date from now on. To be called
+        again after the collection is imported or synced
+        """
+        self.facet_index = FacetIndex.from_collection(self.__db["Restaurants"])
+        return self.facet_index
+
+    def _refresh_facets_matching(self, query: dict):
+        if self.facet_index is not None:
+            for restaurant in self.__db["Restaurants"].find(query, FACET_PROJECTION, batch_size=10_000):
+                self.facet_index.refresh(restaurant)
+
+    def _locations_matching(self, query: dict) -> list[dict]:
+        """
+        :return: the distinct {country, city} of the restaurants matching the query
+        """
+        return [location["_id"] for location in self.__db["Restaurants"].aggregate([
+            {"$match": query},
+            {"$group": {"_id": {"country": "$Position.country", "city": "$Position.city"}}}
+        ])]
+
+    def _invalidate_locations(self, locations: list[dict]):
+        if self.query_cache is None:
+            return
+        tags = set()
+        for location in locations:
+            tags |= document_tags(location.get("country"), location.get("city"))
+        self.query_cache.invalidate(tags)
+
+    def _invalidate_matching(self, query: dict):
+        """
+        invalidate the cached results depending on the restaurants matching the query
+        """
+        if self.query_cache is not None:
+            self._invalidate_locations(self._locations_matching(query))
 
     def add_to_collection(self, collection_name: str, element: dict):
         self.__db[collection_name].insert_one(element)
@@ -32,376 +206,548 @@ class MongoHelper:
     def add_many_to_collection(self, documents, collection_name="Papers"):
         self.__db[collection_name].insert_many(documents=documents)
 
+    def add_stream_to_collection(self, documents: Iterable[dict], collection_name: str, batch_size: int = 1000,
+                                 max_pending_batches: int = 4) -> int:
+        """
+        insert a (possibly unbounded) stream of documents with unordered insert_many of batch_size documents.
+        The batches are written by a background thread so that producing the documents overlaps with the writes,
+        at most max_pending_batches batches are kept in memory at any time
+        :param documents: iterable of documents, consumed lazily
+        :param collection_name: name of the destination collection
+        :param batch_size: number of documents sent in each insert_many
+        :param max_pending_batches: number of batches buffered between the producer and the writer
+        :return: number of inserted documents
+        """
+        collection = self.__db[collection_name]
+        pending: queue.Queue = queue.Queue(maxsize=max_pending_batches)
+        inserted = 0
+        errors = []
+
+        def writer():
+            nonlocal inserted
+            while (batch := pending.get()) is not None:
+                if errors:
+                    # keep draining the queue so that the producer is never blocked
+                    continue
+                try:
+                    collection.insert_many(documents=batch, ordered=False)
+                    # inserted_ids is empty for RawBSONDocument batches, an insert that did not raise wrote the batch
+                    inserted += len(batch)
+                except Exception as e:
+                    errors.append(e)
+
+        writer_thread = threading.Thread(target=writer, name=f"{collection_name}-writer", daemon=True)
+        writer_thread.start()
+        try:
+            for batch in batched(documents, batch_size):
+                if errors:
+                    break
+                pending.put(batch)
+        finally:
+            pending.put(None)
+            writer_thread.join()
+        if errors:
+            raise errors[0]
+        return inserted
+
+    def build_rollups(self, countries: list[str] = None):
+        """
+        materialize the per country and per city aggregates read by the queries, see Rollups
+        :param countries: rebuild only these countries, all if None
+        """
+        build_rollups(self.__db, countries)
+
+    def _rebuild_rollups(self, countries: list[str]):
+        if countries and self.__db[COUNTRY_ROLLUPS].find_one({}, {"_id": 1}):
+            build_rollups(self.__db, countries)
+
+    def ensure_indexes(self) -> list[dict]:
+        """
+        create the indexes backing the queries of this class, see IndexManager.INDEX_CATALOG
+        :return: build time and size of every index
+        """
+        return ensure_indexes(self.__db["Restaurants"])
+
+    def add_locations(self):
+        """
+        add the GeoJSON point used by search_restaurants_in_radius to restaurants imported without it
+        """
+        self.__db["Restaurants"].update_many(
+            filter={"Position.location": {"$exists": False},
+                    # a coordinate at 0 is missing in the csv
+                    "Position.latitude": {"$gte": -90, "$lte": 90, "$ne": 0},
+                    "Position.longitude": {"$gte": -180, "$lte": 180, "$ne": 0}},
+            update=[{"$set": {"Position.location": {
+                "type": "Point", "coordinates": ["$Position.longitude", "$Position.latitude"]}}}])
+
+    def add_popularity_ranks(self, batch_size: int = 1000) -> int:
+        """
+        add the parsed popularity rank used by search_popular_in_city to restaurants imported without it
+        :return: number of updated restaurants
+        """
+        restaurants = self.__db["Restaurants"].find({"Popularity.rank": {"$exists": False},
+                                                     "Popularity.popularity_generic": {"$ne": ""}},
+                                                    {"Popularity.popularity_generic": 1})
+        updated = 0
+        for batch in batched(restaurants, batch_size):
+            updates = []
+            for restaurant in batch:
+                ranking = parse_popularity(restaurant["Popularity"]["popularity_generic"])
+                if ranking is not None:
+                    updates.append(UpdateOne({"_id": restaurant["_id"]},
+                                             {"$set": {f"Popularity.{key}": value for key, value in ranking.items()}}))
+            if updates:
+                updated += self.__db["Restaurants"].bulk_write(updates, ordered=False).modified_count
+        return updated
+
+    @instrumented
+    def add_open_hours(self, batch_size: int = 1000) -> int:
+        """
+        add the open_intervals and open_slots used by find_open_at to restaurants imported without them
+        :return: number of updated restaurants
+        """
+        restaurants = self.__db["Restaurants"].find({"Schedule.open_slots": {"$exists": False}},
+                                                    {"Schedule.original_open_hours": 1})
+        updated = 0
+        for batch in batched(restaurants, batch_size):
+            updates = []
+            for restaurant in batch:
+                add_open_hours(restaurant)
+                updates.append(UpdateOne({"_id": restaurant["_id"]}, {"$set": {
+                    "Schedule.open_intervals": restaurant["Schedule"]["open_intervals"],
+                    "Schedule.open_slots": restaurant["Schedule"]["open_slots"]}}))
+            updated += self.__db["Restaurants"].bulk_write(updates, ordered=False).modified_count
+        return updated
+
+    @instrumented
+    def add_search_names(self, batch_size: int = 1000) -> int:
+        """
+        add the search_name used by autocomplete to restaurants imported without it
+        :return: number of updated restaurants
+        """
+        restaurants = self.__db["Restaurants"].find({"search_name": {"$exists": False}}, {"restaurant_name": 1})
+        updated = 0
+        for batch in batched(restaurants, batch_size):
+            updates = []
+            for restaurant in batch:
+                add_search_name(restaurant)
+                updates.append(UpdateOne({"_id": restaurant["_id"]},
+                                         {"$set": {"search_name": restaurant["search_name"]}}))
+            updated += self.__db["Restaurants"].bulk_write(updates, ordered=False).modified_count
+        return updated
+
+    def recompute_weighted_ratings(self) -> int:
+        """
+        recompute the weightedRating of every restaurant on the server, after a change of RATING_WEIGHTS or for
+        restaurants imported without it. The weights are not a parameter: the import and the rating updates use
+        RATING_WEIGHTS too, other weights would be mixed with them
+        :return: number of updated restaurants
+        """
+        result = self.__db["Restaurants"].update_many(
+            {}, [{"$set": {"weightedRating": weighted_rating_expression()}}])
+        if result.modified_count and self.query_cache is not None:
+            self.query_cache.clear()
+        return result.modified_count
+
     def get_restaurants(self, restaurants_link: list) -> list:
         restaurants = self.__db["Restaurants"].find({"restaurant_link": {"$in": restaurants_link}})
         return [restaurant for restaurant in restaurants]
 
     # Queries -----------------------------------------------------------------
+    # the queries are defined in QuerySpecs, shared with the AsyncMongoHelper
+
+    def _fetch(self, request: Request, lazy: bool = False):
+        """
+        execute a request of a query
+        :param lazy: return the cursor instead of the list of documents
+        """
+        if isinstance(request, Compute):
+            return request.function(*request.args)
+        collection = self.__db[request.collection]
+        if isinstance(request, Find):
+            cursor = collection.find(request.filter, request.projection, sort=request.sort, skip=request.skip,
+                                     limit=request.limit, batch_size=request.batch_size)
+        else:
+            cursor = collection.aggregate(request.pipeline)
+        return cursor if lazy else list(cursor)
+
+    def _run(self, query: Query, stream: bool = False):
+        """
+        run a query of QuerySpecs
+        :param stream: return a generator reading the final documents lazily
+        """
+        if isinstance(query, Generator):
+            try:
+                request = next(query)
+                while True:
+                    request = query.send(self._fetch(request))
+            except StopIteration as stop:
+                query = stop.value
+        if not isinstance(query, Rows):
+            return query
+        documents = query.documents if isinstance(query.documents, list) else self._fetch(query.documents, lazy=True)
+        return format_results(documents, query.pretty, query.row, stream, query.plain)
+
     # Query ok
-    def search_with_feature(self, feature: str, city: str, pretty: bool):
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_with_feature"])
+    def search_with_feature(self, feature: str, city: str, pretty: bool, projection: dict = None,
+                            stream: bool = False, batch_size: int = 0):
         """
         filter restaurants in an area that posses a feature
         :param pretty: prettify the function
         :param feature: word to search
         :param city: city to search in
+        :param projection: fields returned when not pretty, the whole document if None
+        :param stream: return a generator reading the results lazily in batches of batch_size
+        :param batch_size: documents per round trip, 0 for the server default
         """
-        restaurants = self.__db["Restaurants"].find({
-            'Position.city': city,
-            'features': feature
-        })
-
-        if not pretty:
-            return [restaurant for restaurant in restaurants]
-        else:
-            return prettify([{"City:": restaurant["Position"]["city"],
-                              "Resturant with the feature": restaurant["restaurant_name"]
-                              } for restaurant in restaurants])
+        return self._run(QuerySpecs.search_with_feature(feature, city, pretty, projection, batch_size), stream)
 
     # Query ok
-    def search_popular_in_city(self, city_name: str, pretty: bool):
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_popular_in_city"])
+    def search_popular_in_city(self, city_name: str, pretty: bool, limit: int = 3):
         """
-        return the 3 most popular places (generic) in a city
+        return the most popular places (generic) in a city, a range of the popularity_city_rank index
         :param pretty:
         :param city_name: name of the city
+        :param limit: number of places
         :return: list of restaurants link
         """
-        restaurants = self.__db["Restaurants"].find({"Popularity.popularity_generic":
-                                                         {"$regex": f"^#[0-9]\D.*{city_name}$"}})\
-            .sort([("Popularity.popularity_generic", 1)]).limit(3)
-
-        if not pretty:
-            return [restaurant["restaurant_link"] for restaurant in restaurants]
-        else:
-            return prettify([{"resturant-name": restaurant["restaurant_name"], "restaurant-link": restaurant["restaurant_link"]}
-                    for restaurant in restaurants])
+        return self._run(QuerySpecs.search_popular_in_city(city_name, pretty, limit))
 
     # Query ok
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_restaurants_in_radius"])
     def search_restaurants_in_radius(self, my_latitude: float, my_longitude: float, max_distance: float, pretty: bool):
         """
-        find all restaurants in an area, Warning, the database seem to have incorrect values!!!
+        find the 10 closest restaurants in an area, sorted by distance. Uses the 2dsphere index on
+        Position.location, Warning, the database seem to have incorrect values!!!
         :param pretty:
         :param my_latitude: latitude of center point to search
         :param my_longitude: longitude of center point to search
-        :param max_distance: maximum distance from center point of search (is in degree, so very small value
-        should be provided, 1 deg of lat is around 111km, 1 del of long is 71 km)
+        :param max_distance: maximum distance from center point of search in meters
         :return: list of restaurants links
         """
-        expression = {
-            "$sqrt": {
-                "$add": [
-                    {
-                        "$pow": [
-                            {
-                                "$subtract": [my_longitude, "$Position.longitude"]
-                            },
-                            2
-                        ]
-                    },
-                    {
-                        "$pow": [
-                            {
-                                "$subtract": [my_latitude, "$Position.latitude"]
-                            },
-                            2
-                        ]
-                    }
-                ]
-            }
-        }
-        restaurants = self.__db["Restaurants"].find({"$expr": {"$lte": [expression, max_distance]}}).limit(10)
-
-        if not pretty:
-            return [restaurant.get("restaurant_link") for restaurant in restaurants]
-        else:
-            return prettify([{"city": restaurant["Position"]["city"], "lat": restaurant["Position"]["latitude"],
-                              "lon": restaurant["Position"]["longitude"]}
-                             for restaurant in restaurants])
-
-    def get_vegan_restaurants_in_cities(self, cities: list[str], pretty: bool):
-        result = self.__db["Restaurants"].find({"FoodInfo.vegetarian_friendly": "Y",
-                                                "FoodInfo.gluten_free": "Y",
-                                                "Position.city": {"$in": cities}
-                                                })
-        if not pretty:
-            return [el for el in result]
-        else:
-            return prettify([{"City": el["Position"]["city"],
-                              "Restaurant name": el["restaurant_name"],
-                              "Is vegan": el["FoodInfo"]["vegan_options"]
-                              }
-                             for el in result])
-
-    def sort_with_weighted_rating(self, country: str, pretty: bool):
-        cursor = self.__db["Restaurants"].aggregate([
-            {"$match": {"Position.country": country}},
-            {"$project": {
-                "restaurant_link": 1,
-                "weightedRating": {
-                    "$add": [
-                        {"$ifNull": ["$Rating.food", 0]},
-                        {"$ifNull": ["$Rating.atmosphere", 0]},
-                        {"$ifNull": ["$Rating.value", 0]},
-                        {"$ifNull": ["$Rating.service", 0]}
-                    ]
-                }
-            }},
-            {"$sort": {"weightedRating": -1}},
-            {"$limit": 30}
-        ])
-        if not pretty:
-            return [el for el in cursor]
-        else:
-            return prettify(
-                [{"restaurant link": el["restaurant_link"], "weighted rating": el["weightedRating"]} for el in cursor])
+        return self._run(QuerySpecs.search_restaurants_in_radius(my_latitude, my_longitude, max_distance, pretty))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["get_vegan_restaurants_in_cities"])
+    def get_vegan_restaurants_in_cities(self, cities: list[str], pretty: bool, projection: dict = None,
+                                        stream: bool = False, batch_size: int = 0):
+        """
+        :param projection: fields returned when not pretty, the whole document if None
+        :param stream: return a generator reading the results lazily in batches of batch_size
+        :param batch_size: documents per round trip, 0 for the server default
+        """
+        return self._run(QuerySpecs.get_vegan_restaurants_in_cities(cities, pretty, projection, batch_size), stream)
 
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["sort_with_weighted_rating"])
+    def sort_with_weighted_rating(self, country: str, pretty: bool, limit: int = 30):
+        """
+        the restaurants of a country with the highest weightedRating, a walk of the country_weighted_rating index
+        """
+        return self._run(QuerySpecs.sort_with_weighted_rating(country, pretty, limit))
 
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["get_english_speaking_always_open_restaurants"])
     def get_english_speaking_always_open_restaurants(self, open_days: int, reviews: int, min_price: int,
-                                                     max_price: int, pretty: bool):
-        cursor = self.__db["Restaurants"].find({"Schedule.open_days_per_week": open_days,
-                                                "Review.total_reviews_count": {"$gte": reviews},
-                                                "Review.default_language": "English",
-                                                "Price.min_price": {"$gte": min_price},
-                                                "Price.max_price": {"$lte": max_price}})
-        if not pretty:
-            return [el for el in cursor]
-        else:
-            return prettify([{"Restaurant": el["restaurant_name"],
-                              "Open Days per week": el["Schedule"]["open_days_per_week"],
-                              "Total review count": el["Review"]["total_reviews_count"],
-                              "Minimum price": el["Price"]["min_price"],
-                              "Maximum price": el["Price"]["max_price"]
-                              }
-                             for el in cursor])
+                                                     max_price: int, pretty: bool, projection: dict = None,
+                                                     stream: bool = False, batch_size: int = 0):
+        """
+        :param projection: fields returned when not pretty, the whole document if None
+        :param stream: return a generator reading the results lazily in batches of batch_size
+        :param batch_size: documents per round trip, 0 for the server default
+        """
+        return self._run(QuerySpecs.get_english_speaking_always_open_restaurants(
+            open_days, reviews, min_price, max_price, pretty, projection, batch_size), stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["find_open_at"])
+    def find_open_at(self, day: str, hour: int, minute: int = 0, city: str = None, pretty: bool = True,
+                     projection: dict = None, stream: bool = False, batch_size: int = 0):
+        """
+        restaurants open at a time of the week. The hour selects the candidates on the open_slots_city index, the
+        minute is checked on the open intervals
+        :param day: Mon, Tue, Wed, Thu, Fri, Sat or Sun
+        :param hour: 0 to 23
+        :param minute: 0 to 59
+        :param city: search only in this city, everywhere if None
+        :param projection: fields returned when not pretty, the whole document if None
+        :param stream: return a generator reading the results lazily in batches of batch_size
+        """
+        return self._run(QuerySpecs.find_open_at(day, hour, minute, city, pretty, projection, batch_size), stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["search_text"])
+    def search_text(self, text: str, country: str = None, city: str = None, page: int = 0, page_size: int = 10,
+                    pretty: bool = True, projection: dict = None):
+        """
+        restaurants whose name, keywords or top tags contain the words of text, on the restaurant_text index. The
+        most relevant come first, a match in the name weights more than one in the keywords or in the tags
+        :param text: words to search, "quoted phrases" and -excluded words as in $text
+        :param country: search only in this country
+        :param city: search only in this city
+        :param page: page of the results, from 0
+        :param page_size: restaurants per page
+        :param projection: fields returned when not pretty, the whole document if None. The relevance is in score
+        """
+        return self._run(QuerySpecs.search_text(text, country, city, page, page_size, pretty, projection))
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["autocomplete"])
+    def autocomplete(self, prefix: str, city: str = None, limit: int = 10, pretty: bool = True):
+        """
+        restaurants whose name starts with prefix, ignoring case and accents. The names are read in order from a
+        range of the search_name index (city_search_name with a city)
+        :param prefix: beginning of the name, e.g. what has been typed so far
+        :param city: search only in this city, everywhere if None
+        :param limit: number of suggestions
+        """
+        return self._run(QuerySpecs.autocomplete(prefix, city, limit, pretty))
 
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["find_most_expensive_restaurant_in_each_country"])
     def find_most_expensive_restaurant_in_each_country(self, pretty : bool):
-        cursor = self.__db["Restaurants"].aggregate([
-            # filter only for the resturanr tagged "€€-€€€"
-            {"$match": {"Price.price_level": "€€-€€€"}},
-            {"$match": {"Price.max_price": {"$exists": True}}},
-            {"$sort": {"Price.max_price": -1}},
-            # $$ROOT returns the entire document restaurant most expensive for each group
-            {"$group": {
-                "_id": "$Position.country",
-                "most_expensive_restaurant": {"$first": "$$ROOT"}
-            }}
-        ])
-        if not pretty:
-            return list(cursor)
-        else:
-            return prettify([{"Country": row['_id'],
-                              "restaurant": row["most_expensive_restaurant"]["restaurant_name"],
-                              "Max Price": row["most_expensive_restaurant"]["Price"]["max_price"],
-                              "Symbolic price": row["most_expensive_restaurant"]["Price"]["price_level"]
-                              }
-                             for row in cursor])
-
-    def find_top10_highest_rating_restaurant_in_the_5most_popular_cities(self, pretty : bool):
-        # Find the most popular cities in the world,
-        # in order to do it we assumed that the most popular cities are the cities with most entries in the db
-        top_cities_cursor = self.__db["Restaurants"].aggregate([
-            # $ne filters out string equal to ""
-            {"$match": {"Position.city": {"$exists": True, "$ne": ""}}},
-            {"$group": {"_id": "$Position.city", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 5}
-        ])
-
-        # Retrive the highest revived restaurant in the most popular cities. The reviewed score is determined useing
-        # both the average rating of a restaurant and the number of excellent reviews
-        top_cities = [city['_id'] for city in top_cities_cursor]
-        restaurant_cursor = self.__db["Restaurants"].find({
-            "Position.city": {"$in": top_cities},
-        }).sort([("Rating.avg_rating", -1), ("Rating.excellent", -1)]).limit(10)
-
-        if not pretty:
-            return [restaurant for restaurant in restaurant_cursor]
-        else:
-            return prettify([{
-                "City": restaurant["Position"]["city"],
-                "Restaurant": restaurant["restaurant_name"],
-                "Average rating": restaurant["Rating"]["avg_rating"],
-                "Number of excellent ratings": restaurant["Rating"]["excellent"]
-            }
-                for restaurant in restaurant_cursor])
+        return self._run(QuerySpecs.find_most_expensive_restaurant_in_each_country(pretty))
 
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["find_top10_highest_rating_restaurant_in_the_5most_popular_cities"])
+    def find_top10_highest_rating_restaurant_in_the_5most_popular_cities(self, pretty : bool, projection: dict = None,
+                                                                          stream: bool = False):
+        return self._run(QuerySpecs.find_top10_highest_rating_restaurant_in_the_5most_popular_cities(
+            pretty, projection), stream)
+
+    @instrumented
+    @cached_query(tags=CACHE_TAGS["get_top5_countries_with_the_highest_average_excellent_reviews"])
     def get_top5_countries_with_the_highest_average_excellent_reviews(self, pretty : bool):
-        cursor = self.__db["Restaurants"].aggregate([
-            # takes only restaurant with excenllent rating
-            {"$match": {"Rating.excellent": {"$exists": True}}},
-            # Groups for country, sums up excellent ratings and counting restaurants.
-            {"$group": {
-                "_id": "$Position.country",
-                "total_excellents": {"$sum": "$Rating.excellent"},
-                "num_restaurants": {"$sum": 1}
-            }},
-            # Calculate the average of excellent reviews, $project adds field to the group
-            {"$project": {
-                "avg_excellent": {"$divide": ["$total_excellents", "$num_restaurants"]}
-            }},
-            {"$sort": {"avg_excellent": -1}},
-            {"$limit": 5}
-        ])
-        if not pretty:
-            return [result for result in cursor]
-        else:
-            return prettify([{"Country": row['_id'],
-                              "Average of excellent reviews": math.floor(row['avg_excellent'])}
-                             for row in cursor])
-
-    def find_the_closest_three_restaurant_in_randon_city(self):
-
-        # find a random city with at least 10 restaurant and at most 100
-        cities = [
-            {"$group": {"_id": "$Position.city", "counts": {"$sum": 1}}},
-            {"$match": {"counts": {"$gte": 20, "$lte": 100}}},
-            {"$sample": {"size": 1}}
-        ]
-        city = list(self.__db["Restaurants"].aggregate(cities))
-        city_name = city[0]["_id"] if city else None
-        number_of_resturant = city[0]["counts"]
-
-        if city_name is None:
-            raise ValueError("city name is none")
-
-        # Create a map with all restaurants in city,
-        # containing the key restaurant_name, values: position latitude, position.longitude
-        query = {
-            "Position.city": city_name,
-            "Position.latitude": {"$exists": True},
-            "Position.longitude": {"$exists": True}
-        }
-        restaurants_positions = list(self.__db["Restaurants"].find(query,
-                                                                   {"restaurant_name": 1, "Position.latitude": 1,
-                                                                    "Position.longitude": 1}))
-
-        if restaurants_positions is None:
-            raise ValueError("no positions for restaurant")
-
-        min_distance = float("inf")
-        triple = None
-        # tool to find 3 resturants with smallest location fast, mongoDB could not have done it
-        for r1, r2, r3 in itertools.combinations(restaurants_positions, 3):
-            location1 = (r1["Position"]["latitude"], r1["Position"]["longitude"])
-            location2 = (r2["Position"]["latitude"], r2["Position"]["longitude"])
-            location3 = (r3["Position"]["latitude"], r3["Position"]["longitude"])
-            distance = great_circle(location1, location2, location3).meters
-
-            if distance < min_distance:
-                min_distance = distance
-                triple = (r1["restaurant_name"], r2["restaurant_name"], r3["restaurant_name"])
-
-        print(
-            f"in City {city_name} with number of restaurants {number_of_resturant}. The closest restaurants between "
-            f"each other are: {triple[0]},{triple[1]} and {triple[2]}, "
-            f"distance between the them is {math.floor(min_distance)} m")
+        return self._run(QuerySpecs.get_top5_countries_with_the_highest_average_excellent_reviews(pretty))
 
-    # Commands -----------------------------------------------------------------
+    @instrumented
+    def find_the_closest_three_restaurant_in_randon_city(self, pretty: bool = True, k: int = 3,
+                                                         city_name: str = None, min_restaurants: int = 20):
+        """
+        find the k restaurants closest to each other in a city, see ClosestCluster.tightest_cluster
+        :param pretty: return a sentence instead of a dict
+        :param k: number of restaurants of the cluster
+        :param city_name: city to search in, a random city with at least min_restaurants restaurants if None
+        :param min_restaurants: minimum size of the random city
+        :return: the city, the restaurants of the cluster and its radius and diameter in meters
+        """
+        return self._run(QuerySpecs.find_the_closest_three_restaurant_in_randon_city(pretty, k, city_name,
+                                                                                      min_restaurants))
 
-    def increase_price_for_restaurants_with_seating(self, minimum_price: int, increase: int):
-        self.__db["Restaurants"].update_many(filter={"Position.city": "Paris",
-                                                     "features": {"$all": ["Seating", "ServesAlcohol"]},
-                                                     "FoodInfo.cuisines": {"$in": ["French"]},
-                                                     "Schedule.open_days_per_week": {"$gte": 5}
-                                                     },
-                                             update=[{
-                                                 "$set": {
-                                                     "Price.min_price": {
-                                                         "$switch": {
-                                                             "branches": [
-                                                                 {"case":
-                                                                      {"$eq": ["Price.min_price", None]},
-                                                                  "then": minimum_price
-                                                                  }
-                                                             ],
-                                                             "default": {"$sum": ["Price.min_price", increase]}
-                                                         }
-                                                     }
-
-                                                 },
-                                             }])
-        return
+    # Commands -----------------------------------------------------------------
 
+    @instrumented
+    def increase_price_for_restaurants_with_seating(self, minimum_price: int, increase: int, city: str = "Paris",
+                                                    cuisine: str = "French") -> list[dict]:
+        """
+        raise the minimum price of the restaurants of a cuisine in a city that have seating, serve alcohol and are
+        open at least 5 days per week, restaurants without a price get minimum_price
+        """
+        return self.adjust_prices([PriceAdjustment(
+            name=f"seating {city} {cuisine}",
+            filter={"Position.city": city,
+                    "features": {"$all": ["Seating", "ServesAlcohol"]},
+                    "FoodInfo.cuisines": {"$in": [cuisine]},
+                    "Schedule.open_days_per_week": {"$gte": 5}},
+            rule=PriceRule(increase=increase, default=minimum_price))])
+
+    @instrumented
+    def adjust_prices(self, adjustments: list[PriceAdjustment], workers: int = 1,
+                      single_batch: bool = False) -> list[dict]:
+        """
+        apply price rules to the restaurants matching their filters, see PriceAdjustment.apply_price_adjustments
+        :return: matched, modified and elapsed milliseconds of every adjustment
+        """
+        # the filters may depend on the prices, the restaurants they match are located before the prices change
+        locations = self._locations_matching({"$or": [adjustment.filter for adjustment in adjustments]})
+        if self.compact and single_batch:
+            # the bulk operations are sent as they are, their filters are translated here
+            adjustments = [adjustment._replace(filter=encode_filter(adjustment.filter)) for adjustment in adjustments]
+        report = apply_price_adjustments(self.__db["Restaurants"], adjustments, workers, single_batch)
+        if any(row["modified"] for row in report):
+            self._invalidate_locations(locations)
+            self._rebuild_rollups(sorted({location.get("country") for location in locations} - {None}))
+        return report
+
+    @instrumented
+    def sync_restaurants(self, documents: Iterable[dict], batch_size: int = 1000) -> dict:
+        """
+        make the Restaurants collection equal to the documents, see IncrementalSync.sync_documents. The cached
+        results of the touched countries and cities are invalidated, the facet index and the rollups are updated
+        :return: inserted, replaced, unchanged and deleted restaurants and the touched countries
+        """
+        # IncrementalSync imports this module
+        from src.IncrementalSync import sync_documents
+        report = sync_documents(self.__db["Restaurants"], documents, batch_size)
+        locations = report.pop("locations")
+        written, deleted = report.pop("written_links"), report.pop("deleted_links")
+        self._invalidate_locations([{"country": country, "city": city} for country, city in locations])
+        if self.facet_index is not None:
+            for links in batched(written, 10_000):
+                self._refresh_facets_matching({"restaurant_link": {"$in": links}})
+            for link in deleted:
+                self.facet_index.remove(link)
+        self._rebuild_rollups(report["countries"])
+        return report
+
+    @instrumented
     def add_weekend_availability(self):
-        self.__db["Restaurants"].update_many(filter={
-            "Schedule.original_open_hours.Sat": {"$exists": True},
-            "Schedule.original_open_hours.Sun": {"$exists": True}
-        },
-            update={"$push": {"features": "openDuringTheWeekEnd"}})
+        """
+        add the feature openDuringTheWeekEnd to the restaurants open on both Saturday and Sunday, running it again
+        changes nothing
+        """
+        saturday, sunday = (minute_of_week(day, 0) // 60 for day in ("Sat", "Sun"))
+        query = {"$and": [{"Schedule.open_slots": {"$elemMatch": {"$gte": saturday, "$lt": saturday + 24}}},
+                          {"Schedule.open_slots": {"$elemMatch": {"$gte": sunday, "$lt": sunday + 24}}}]}
+        missing = {**query, "features": {"$ne": "openDuringTheWeekEnd"}}
+        # the restaurants that get the feature, the facet index is updated for them only
+        links = []
+        if self.facet_index is not None:
+            cursor = self.__db["Restaurants"].find(missing, {"_id": 0, "restaurant_link": 1}, batch_size=10_000)
+            links = [restaurant["restaurant_link"] for restaurant in cursor]
+        result = self.__db["Restaurants"].update_many(filter=missing,
+                                                      update={"$addToSet": {"features": "openDuringTheWeekEnd"}})
+        if result.modified_count:
+            self._invalidate_matching(query)
+            # a feature changes no rollup value, only the snapshots of the most expensive restaurants embed it
+            refresh_most_expensive_matching(self.__db, query)
+            for link in links:
+                self.facet_index.add_value(link, "features", "openDuringTheWeekEnd")
         return
 
     # Command ok
+    @instrumented
     def update_ratings(self, restaurant_link: str, rating: Rating):
         """
-        update the rating of a restaurant
+        update the rating of a restaurant. The bucket is incremented and the average recomputed by the server in a
+        single pipeline update, so concurrent ratings of the same restaurant are never lost
         :param restaurant_link: the link to the restaurant
         :param rating: new rating to add
         :return:
         """
-        old_rating = self.__db["Restaurants"].find_one({"restaurant_link": restaurant_link}).get("Rating")
-        if not rating or not old_rating:
+        restaurant = self.__db["Restaurants"].find_one_and_update(
+            {"restaurant_link": restaurant_link, "Rating": {"$exists": True}},
+            rating_update_pipeline({rating.name: 1}),
+            projection={"restaurant_link": 1, "Position.country": 1, "Position.city": 1})
+        if not restaurant:
             print(f"Restaurant link: {restaurant_link} not found in DB")
             return
-        old_rating_table: dict = {
-            "excellent": old_rating.get("excellent"),
-            "very_good": old_rating.get("very_good"),
-            "average": old_rating.get("average"),
-            "poor": old_rating.get("poor"),
-            "terrible": old_rating.get("terrible"),
-        }
-        old_rating_table[rating.name] = old_rating_table[rating.name] + 1
-
-        total = 0
-        review_count = 0
-        for key, val in old_rating_table.items():
-            review_count = review_count + val
-            total = total + (val * Rating[key].value)
-        new_average = total / review_count
-
-        self.__db["Restaurants"].update_one({"restaurant_link": restaurant_link},
-                                            {"$set": {
-                                                "Rating.avg_rating": new_average,
-                                                f"Rating.{rating.name}": old_rating_table[rating.name]
-                                            },
-                                                "$inc": {"Review.total_reviews_count": 1}
-                                            })
+        self._after_ratings([restaurant], {restaurant_link: Counter({rating.name: 1})})
+
+    @instrumented
+    def update_ratings_many(self, ratings: Iterable[tuple[str, Rating]], chunk_size: int = 1000) -> int:
+        """
+        add many ratings at once, the ratings of the same restaurant are merged in a single update and the updates
+        are sent in unordered bulk writes
+        :param ratings: pairs of (restaurant link, rating)
+        :param chunk_size: number of restaurants updated by each bulk_write
+        :return: number of updated restaurants
+        """
+        increments: dict[str, Counter] = {}
+        for restaurant_link, rating in ratings:
+            increments.setdefault(restaurant_link, Counter())[rating.name] += 1
+
+        modified = 0
+        for links in batched(increments, chunk_size):
+            result = self.__db["Restaurants"].bulk_write(
+                [UpdateOne({"restaurant_link": link, "Rating": {"$exists": True}},
+                           rating_update_pipeline(increments[link]))
+                 for link in links], ordered=False)
+            modified += result.modified_count
+            restaurants = []
+            if self.query_cache is not None or any(increments[link][Rating.excellent.name] for link in links):
+                # the restaurants are read back only when the cache or the rollups have to be updated
+                restaurants = self.__db["Restaurants"].find({"restaurant_link": {"$in": links}},
+                                                            {"restaurant_link": 1, "Position.country": 1,
+                                                             "Position.city": 1})
+            self._after_ratings(restaurants, {link: increments[link] for link in links})
+        return modified
+
+    def _after_ratings(self, restaurants: Iterable[dict], increments: dict[str, Counter]):
+        """
+        keep the rollups and the query cache in sync with rating updates
+        """
+        excellent = Counter()
+        for restaurant in restaurants:
+            position = restaurant.get("Position", {})
+            excellent[(position.get("country"), position.get("city"))] += \
+                increments.get(restaurant.get("restaurant_link"), Counter())[Rating.excellent.name]
+            self._invalidate_document(restaurant)
+        for (country, city), count in excellent.items():
+            record_excellent_ratings(self.__db, country, city, count)
+        refresh_if_most_expensive(self.__db, list(increments))
 
     # Command ok
+    @instrumented
     def update_restaurant_feature(self, restaurant_link: str, new_feature: str):
         """
         add a feature to a restaurant if it do not exist
         :param restaurant_link: link to restaurant
         :param new_feature: feature to add
         """
-        self.__db["Restaurants"].update_one({"restaurant_link": restaurant_link}, {
+        before = self.__db["Restaurants"].find_one_and_update({"restaurant_link": restaurant_link}, {
             "$addToSet": {"features": new_feature}
-        })
-
+        }, projection={"features": 1, "Position.country": 1, "Position.city": 1})
+        if before is not None and new_feature not in before.get("features", []):
+            refresh_if_most_expensive(self.__db, [restaurant_link])
+            self._invalidate_document(before)
+            if self.facet_index is not None:
+                self.facet_index.add_value(restaurant_link, "features", new_feature)
+
+    @instrumented
     def update_restaurant_by_assigning_a_similarly_priced_resturant_to_each_other_in_Osnabruck(self):
-        price_levels = ["€", "€€-€€€", "€€€€"]
-        to_be_updated = []
-
-        for level in price_levels:
-            all_restaurants = list(self.__db["Restaurants"].find(
-                # IMPORTANT: unfortunately I could only do it in small cities,
-                # for large cities or the entirety of the db takes too much time
-                {"Position.city": "Osnabruck", "Price.price_level": level},
-                {"restaurant_link": 1}
-            ))
-            all_resturant_links = [r["restaurant_link"] for r in all_restaurants]
-
-            # Assign similar restaurants
-            for restaurant_link in all_resturant_links:
-                # [:4] limit to 4 the operation --> imprve performance
-                similar_priced_restaurant = [r for r in all_resturant_links if r != restaurant_link][:4]
-                to_be_updated.append(UpdateOne(
-                    {"restaurant_link": restaurant_link},
-                    {"$set": {"similar_priced_restaurants": similar_priced_restaurant}}
-                ))
-
-        # write all in bulk should improve performance
-        if to_be_updated:
-            self.__db["Restaurants"].bulk_write(to_be_updated)
+        self.assign_similarly_priced_restaurants(city="Osnabruck")
 
+    @instrumented
+    def assign_similarly_priced_restaurants(self, city: str = None, neighbours: int = 4, chunk_size: int = 1000,
+                                            workers: int = 1) -> int:
+        """
+        assign to every restaurant the restaurants of the same city and price level with the closest prices
+        :param city: city to update, the whole collection if None
+        :param neighbours: number of similar restaurants stored in similar_priced_restaurants
+        :param chunk_size: number of updates sent in each unordered bulk_write
+        :param workers: number of cities updated in parallel, only used when city is None
+        :return: number of updated restaurants
+        """
+        if city is None and workers > 1:
+            cities = self.__db["Restaurants"].distinct("Position.city", {"Price.price_level": {"$in": PRICE_LEVELS}})
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return sum(executor.map(
+                    lambda c: self.assign_similarly_priced_restaurants(c, neighbours, chunk_size), cities))
+
+        query = {"Price.price_level": {"$in": PRICE_LEVELS}}
+        if city is not None:
+            query["Position.city"] = city
+        # the cursor walks the city_price index, so a single group is in memory at any time
+        cursor = self.__db["Restaurants"].find(
+            query, {"_id": 0, "restaurant_link": 1, "Position.country": 1, "Position.city": 1, "Price": 1}
+        ).sort([("Position.city", 1), ("Price.price_level", 1)])
+        groups = itertools.groupby(cursor, key=lambda r: (r["Position"].get("city"), r["Price"]["price_level"]))
+        locations = set()
+
+        def updates():
+            for (group_city, _), group in groups:
+                group = list(group)
+                locations.update((restaurant["Position"].get("country"), group_city) for restaurant in group)
+                for link, similar in closest_priced(group, neighbours):
+                    yield UpdateOne({"restaurant_link": link}, {"$set": {"similar_priced_restaurants": similar}})
+
+        updated = 0
+        modified = 0
+        for chunk in batched(updates(), chunk_size):
+            modified += self.__db["Restaurants"].bulk_write(chunk, ordered=False).modified_count
+            updated += len(chunk)
+        if modified:
+            # the full documents returned by the cached queries include similar_priced_restaurants
+            self._invalidate_locations([{"country": country, "city": group_city} for country, group_city in locations])
+        return updated
+
+    @instrumented
     def print_restaurants_connection_in_Osnabruck(self):
         restaurants = self.__db["Restaurants"].find({"Position.city": "Osnabruck"})
         return prettify([{
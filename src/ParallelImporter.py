@@ -0,0 +1,58 @@
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from src.CompactSchema import compact_rows
+from src.CsvHandler import MappedCsvHandler
+from src.DocumentTransformer import transform_rows
+from src.MongoHelper import MongoHelper
+
+
+def read_byte_range(csv_path, start: int, end: int) -> Iterator[list[str]]:
+    """
+    lazily parse the rows of the csv that begin in [start, end)
+    """
+    def lines():
+        with open(csv_path, mode="rb") as csvfile:
+            csvfile.seek(start)
+            position = start
+            for raw in csvfile:
+                if position >= end:
+                    return
+                position += len(raw)
+                yield raw.decode("utf-8")
+
+    yield from csv.reader(lines(), delimiter=',')
+
+
+def _import_shard(csv_path: str, start: int, end: int, headers: dict[str, int], host: str, port: int, dbName: str,
+                  collection_name: str, batch_size: int, compact: bool = False) -> int:
+    # every worker owns its MongoClient, clients must not be shared across processes
+    with MongoHelper(host=host, port=port, dbName=dbName) as mongoHelper:
+        transform = compact_rows if compact else transform_rows
+        documents = transform(read_byte_range(csv_path, start, end), headers)
+        return mongoHelper.add_stream_to_collection(documents, collection_name=collection_name,
+                                                    batch_size=batch_size)
+
+
+def import_parallel(csv_path, workers: int, host: str = "localhost", port: int = 27017, dbName: str = "DDM",
+                    collection_name: str = "Restaurants", batch_size: int = 1000, compact: bool = False) -> int:
+    """
+    import the csv with a pool of processes, each worker parses and transforms a byte range of the file with the same
+    number of rows and inserts the documents over its own connection
+    :param csv_path: path to the csv
+    :param workers: number of processes
+    :param compact: store the documents of the compact schema, see CompactSchema
+    :return: number of inserted documents
+    """
+    csv_path = str(Path(csv_path))
+    # the row index splits the file on row boundaries, also when quoted fields contain new lines
+    with MappedCsvHandler(csv_path) as csv_handler:
+        headers = csv_handler.header()
+        ranges = csv_handler.byte_ranges(workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_import_shard, csv_path, start, end, headers, host, port, dbName,
+                                   collection_name, batch_size, compact)
+                   for start, end in ranges]
+        return sum(future.result() for future in futures)
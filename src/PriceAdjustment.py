@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from pymongo import UpdateMany
+from pymongo.collection import Collection
+
+
+class PriceRule(NamedTuple):
+    """
+    how the prices of the matched restaurants change, new price = round(price * (1 + percent / 100) + increase)
+    :param increase: amount added to the price
+    :param percent: percentage added to the price, before the increase
+    :param default: price given to the restaurants without one, None leaves them without a price
+    :param fields: price fields changed by the rule
+    """
+    increase: float = 0
+    percent: float = 0
+    default: Optional[int] = None
+    fields: tuple = ("Price.min_price",)
+
+
+class PriceAdjustment(NamedTuple):
+    """
+    a rule applied to the restaurants matching a filter
+    :param name: name of the adjustment in the report
+    :param filter: query on the Restaurants collection, e.g. {"Position.city": "Paris", "FoodInfo.cuisines": "French"}
+    :param rule: change of the prices
+    """
+    name: str
+    filter: dict
+    rule: PriceRule
+
+
+def compile_rule(rule: PriceRule) -> list[dict]:
+    """
+    :return: update pipeline applying the rule, the prices are read from the document on the server
+    """
+    prices = {}
+    for field in rule.fields:
+        price = f"${field}"
+        adjusted = {"$add": [{"$multiply": [price, 1 + rule.percent / 100]}, rule.increase]}
+        prices[field] = {"$cond": [
+            # a missing field is not equal to null, $ifNull covers both
+            {"$eq": [{"$ifNull": [price, None]}, None]},
+            price if rule.default is None else rule.default,
+            {"$toInt": {"$round": [adjusted, 0]}}
+        ]}
+    return [{"$set": prices}]
+
+
+def city_shards(collection: Collection, query: dict, shards: int) -> list[dict]:
+    """
+    split a query in at most shards queries on disjoint sets of cities
+    """
+    cities = sorted(collection.distinct("Position.city", query), key=str)
+    groups = [cities[shard::shards] for shard in range(shards)]
+    return [{"$and": [query, {"Position.city": {"$in": group}}]} for group in groups if group]
+
+
+def _update(collection: Collection, query: dict, pipeline: list[dict]) -> tuple[int, int]:
+    result = collection.update_many(query, pipeline)
+    return result.matched_count, result.modified_count
+
+
+def apply_price_adjustments(collection: Collection, adjustments: list[PriceAdjustment], workers: int = 1,
+                            single_batch: bool = False) -> list[dict]:
+    """
+    apply the adjustments in order, a restaurant matched by several adjustments gets all of them
+    :param workers: with more than one worker every adjustment is split by city in workers updates run in parallel
+    :param single_batch: send all the adjustments in a single ordered bulk_write, one round trip but only the total
+    counts are known
+    :return: report with matched, modified and elapsed milliseconds of every adjustment, or of the whole batch
+    """
+    if single_batch:
+        before = time.perf_counter()
+        result = collection.bulk_write([UpdateMany(adjustment.filter, compile_rule(adjustment.rule))
+                                        for adjustment in adjustments], ordered=True)
+        return [{"adjustment": "all", "matched": result.matched_count, "modified": result.modified_count,
+                 "elapsed_ms": round((time.perf_counter() - before) * 1000, 3)}]
+
+    report = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for adjustment in adjustments:
+            before = time.perf_counter()
+            pipeline = compile_rule(adjustment.rule)
+            queries = city_shards(collection, adjustment.filter, workers) if workers > 1 else [adjustment.filter]
+            counts = list(executor.map(lambda query: _update(collection, query, pipeline), queries))
+            report.append({"adjustment": adjustment.name,
+                           "matched": sum(matched for matched, _ in counts),
+                           "modified": sum(modified for _, modified in counts),
+                           "elapsed_ms": round((time.perf_counter() - before) * 1000, 3)})
+    return report
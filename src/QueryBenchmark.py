@@ -0,0 +1,222 @@
+import argparse
+import json
+import math
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from pymongo.database import Database
+
+from src import ClientRegistry
+from src.CsvHandler import CsvHandler
+from src.DocumentTransformer import transform_rows
+from src.MongoHelper import MongoHelper, Rating
+from src.Rollups import CITY_ROLLUPS, COUNTRY_ROLLUPS
+from src.SyntheticData import generate_csv
+from src.main import Command, queries
+
+# collections restored before every run of a write command
+DATASET_COLLECTIONS = ("Restaurants", COUNTRY_ROLLUPS, CITY_ROLLUPS)
+SNAPSHOT_SUFFIX = "Snapshot"
+
+# commands changing the collection, the dataset is restored before every run of them, warmup runs included, so that
+# each measured run applies the write to the freshly loaded dataset
+WRITE_COMMANDS = {Command.ADD_WEEKEND_AVAILABILITY, Command.UPDATE_RATINGS, Command.UPDATE_RESTAURANT_FEATURE,
+                  Command.INCREASE_PRICE_SEATING, Command.ASSIGN_SIMILAR_PRICED_OSNABRUCK,
+                  Command.ASSIGN_SIMILAR_PRICED}
+
+
+def commands(helper: MongoHelper, restaurant_link: str) -> list[tuple[Command, Callable]]:
+    """
+    the write commands run by execute_command, on a restaurant that exists in the benchmark dataset
+    """
+    return [
+        (Command.ADD_WEEKEND_AVAILABILITY, helper.add_weekend_availability),
+        (Command.UPDATE_RATINGS, lambda: helper.update_ratings(restaurant_link, Rating.average)),
+        (Command.UPDATE_RESTAURANT_FEATURE, lambda: helper.update_restaurant_feature(restaurant_link, "toilets")),
+        (Command.INCREASE_PRICE_SEATING, lambda: helper.increase_price_for_restaurants_with_seating(10, 5)),
+        (Command.ASSIGN_SIMILAR_PRICED_OSNABRUCK,
+         helper.update_restaurant_by_assigning_a_similarly_priced_resturant_to_each_other_in_Osnabruck),
+        (Command.ASSIGN_SIMILAR_PRICED, helper.assign_similarly_priced_restaurants),
+    ]
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """
+    nearest rank percentile, q in [0, 100]
+    """
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def docs_examined(db: Database) -> Optional[int]:
+    """
+    documents read by the query executor of the server since it started, None if serverStatus is not available
+    """
+    try:
+        executor = db.client.admin.command("serverStatus")["metrics"]["queryExecutor"]
+    except Exception:
+        return None
+    return executor["scannedObjects"]
+
+
+def measure(operation: Callable, warmup: int, repetitions: int, setup: Callable = None,
+            examined: Callable[[], Optional[int]] = lambda: None) -> tuple[list[float], Optional[int]]:
+    """
+    :param setup: called before every run and not measured, e.g. to restore the state changed by a write
+    :param examined: counter of the documents read by the server, see docs_examined
+    :return: latency in milliseconds of each repetition and documents examined by them, the warmup runs are
+    discarded
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        operation()
+    latencies = []
+    total_examined = 0
+    for _ in range(repetitions):
+        if setup is not None:
+            setup()
+        examined_before = examined()
+        before = time.perf_counter()
+        operation()
+        latencies.append((time.perf_counter() - before) * 1000)
+        examined_after = examined()
+        if examined_before is None or examined_after is None or total_examined is None:
+            total_examined = None
+        else:
+            total_examined += examined_after - examined_before
+    return latencies, total_examined
+
+
+def load_dataset(helper: MongoHelper, csv_path, batch_size: int = 1000) -> dict:
+    """
+    replace the Restaurants collection and its rollups with the csv, then build the indexes and the rollups
+    :return: import time and the steps that failed, e.g. on a server without $merge
+    """
+    db = helper.database()
+    for collection_name in DATASET_COLLECTIONS:
+        db.drop_collection(collection_name)
+    csv_handler = CsvHandler(csv_path)
+    before = time.perf_counter()
+    inserted = helper.add_stream_to_collection(transform_rows(csv_handler.rows(), csv_handler.header()),
+                                               collection_name="Restaurants", batch_size=batch_size)
+    report = {"inserted": inserted, "import_seconds": round(time.perf_counter() - before, 3), "setup_errors": []}
+    for step in (helper.ensure_indexes, helper.build_rollups):
+        try:
+            step()
+        except Exception as exception:
+            report["setup_errors"].append(f"{step.__name__}: {exception}")
+    for collection_name in DATASET_COLLECTIONS:
+        db[collection_name].aggregate([{"$out": collection_name + SNAPSHOT_SUFFIX}])
+    return report
+
+
+def restore_dataset(db: Database):
+    """
+    replace the documents of the dataset collections with the ones saved by load_dataset, a server side copy much
+    faster than importing the csv again. $out keeps the indexes of the replaced collection
+    """
+    for collection_name in DATASET_COLLECTIONS:
+        db[collection_name + SNAPSHOT_SUFFIX].aggregate([{"$out": collection_name}])
+
+
+def _result(command: Command, latencies: list[float], examined: Optional[int]) -> dict:
+    return {"command": command.name,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "throughput_ops_per_sec": round(len(latencies) / (sum(latencies) / 1000), 2),
+            "docs_examined_per_op": None if examined is None else round(examined / len(latencies), 1)}
+
+
+def run(rows: int, warmup: int, repetitions: int, host: str = "localhost", port: int = 27017,
+        dbName: str = "DDMBenchmark", selected: list[Command] = None, seed: int = 42) -> dict:
+    """
+    benchmark every query and command of execute_command, each one on its own, against a synthetic dataset.
+    With the same rows and seed the dataset is the same, so the reports of different runs are comparable
+    :param rows: restaurants in the synthetic dataset
+    :param warmup: runs discarded before measuring
+    :param repetitions: measured runs of each command
+    :param dbName: database used by the benchmark, it is dropped and filled with the synthetic dataset
+    :param selected: commands to run, all if None
+    """
+    with tempfile.TemporaryDirectory() as directory, MongoHelper(host=host, port=port, dbName=dbName) as helper:
+        csv_path = generate_csv(Path(directory) / "synthetic.csv", rows, seed)
+        dataset = load_dataset(helper, csv_path)
+        db = helper.database()
+        restaurant_link = db["Restaurants"].find_one({}, {"restaurant_link": 1},
+                                                     sort=[("restaurant_link", 1)])["restaurant_link"]
+
+        benchmarks = queries(helper, False) + commands(helper, restaurant_link)
+        results = []
+        for command, operation in benchmarks:
+            if selected is not None and command not in selected:
+                continue
+            try:
+                latencies, examined = measure(operation, warmup, repetitions,
+                                              (lambda: restore_dataset(db)) if command in WRITE_COMMANDS else None,
+                                              lambda: docs_examined(db))
+            except Exception as exception:
+                results.append({"command": command.name, "error": str(exception)})
+                continue
+            results.append(_result(command, latencies, examined))
+
+        try:
+            server_version = db.client.server_info()["version"]
+        except Exception:
+            server_version = None
+    return {"rows": rows, "seed": seed, "warmup": warmup, "repetitions": repetitions,
+            "server_version": server_version, "dataset": dataset, "results": results}
+
+
+def compare(report: dict, baseline: dict) -> list[dict]:
+    """
+    ratio of the p50 and p95 latencies of the report to the ones of a previous report, > 1 is slower
+    """
+    previous = {result["command"]: result for result in baseline["results"] if "error" not in result}
+    return [{"command": result["command"],
+             "p50_ratio": round(result["p50_ms"] / previous[result["command"]]["p50_ms"], 2),
+             "p95_ratio": round(result["p95_ms"] / previous[result["command"]]["p95_ms"], 2)}
+            for result in report["results"]
+            if "error" not in result and result["command"] in previous]
+
+
+def use_mongomock():
+    """
+    run against an in memory mongomock server instead of a mongod. Operators that mongomock does not implement
+    ($merge, pipeline updates, $collStats...) are reported as errors of the commands using them
+    """
+    import mongomock
+    client = mongomock.MongoClient()
+    ClientRegistry.MongoClient = lambda *args, **kwargs: client
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--db", default="DDMBenchmark")
+    parser.add_argument("--command", action="append", choices=[c.name for c in Command if c not in
+                                                               (Command.ALL, Command.IMPORT_DB, Command.SYNC_DB)],
+                        help="benchmark only this command, can be repeated")
+    parser.add_argument("--baseline", help="report of a previous run, the latency ratios are added to the output")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--mongomock", action="store_true", help="use an in memory mongomock server")
+    args = parser.parse_args()
+    if args.mongomock:
+        use_mongomock()
+    report = run(args.rows, args.warmup, args.repetitions, args.host, args.port, args.db,
+                 None if args.command is None else [Command[name] for name in args.command], args.seed)
+    if args.baseline:
+        report["comparison"] = compare(report, json.loads(Path(args.baseline).read_text()))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
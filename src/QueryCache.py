@@ -0,0 +1,173 @@
+import copy
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+GLOBAL_TAG = "global"
+
+
+def city_tag(city: str) -> str:
+    return f"city:{city}"
+
+
+def country_tag(country: str) -> str:
+    return f"country:{country}"
+
+
+def document_tags(country: str, city: str) -> set[str]:
+    """
+    tags invalidated by a write to a restaurant of the given country and city. Queries tagged global read across
+    cities and countries, so any write invalidates them
+    """
+    return {GLOBAL_TAG, country_tag(country), city_tag(city)}
+
+
+class QueryCache:
+    """
+    LRU cache with time to live whose entries are tagged with the part of the collection they were computed from
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_entries: number of results kept, the least recently used is evicted first
+        :param ttl: seconds after which a result is recomputed
+        :param clock: source of time, in seconds
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        # key -> (value, expiration, tags)
+        self._entries: OrderedDict[Any, tuple[Any, float, frozenset[str]]] = OrderedDict()
+        self._keys_by_tag: dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key) -> tuple[bool, Any]:
+        """
+        :return: (True, value) on hit, (False, None) on miss or expired entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self._clock():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, key, value, tags: Iterable[str]):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, self._clock() + self._ttl, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """
+        drop every result tagged with at least one of the tags
+        :return: number of dropped results
+        """
+        with self._lock:
+            keys = set().union(*(self._keys_by_tag.get(tag, ()) for tag in tags))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                    "entries": len(self._entries)}
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def cached_query(tags: Callable[..., Iterable[str]]):
+    """
+    cache the result of a query method in the query_cache of the helper, if it has one.
+    The key is the name of the method with its arguments, defaults included. Calls with stream=True are not cached
+    :param tags: function receiving the arguments of the method by name and returning the tags of the result
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        def lookup(self, args, kwargs) -> tuple[Optional[tuple], dict]:
+            """
+            :return: the key of the call and its arguments by name, no key if the result must not be cached
+            """
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(list(bound.arguments.items())[1:])
+            # a lazily consumed cursor cannot be replayed
+            return None if arguments.get("stream") else (method.__name__, _freeze(arguments)), arguments
+
+        def copied(value):
+            # results that are not strings are mutable, the caller gets its own copy
+            return value if isinstance(value, str) else copy.deepcopy(value)
+
+        if inspect.iscoroutinefunction(method):
+            # the coroutines of the AsyncMongoHelper, with the same keys as the MongoHelper methods of the same name
+            @functools.wraps(method)
+            async def coroutine_wrapper(self, *args, **kwargs):
+                cache: QueryCache = self.query_cache
+                if cache is None:
+                    return await method(self, *args, **kwargs)
+                key, arguments = lookup(self, args, kwargs)
+                if key is None:
+                    return await method(self, *args, **kwargs)
+                hit, value = cache.get(key)
+                if not hit:
+                    value = await method(self, *args, **kwargs)
+                    cache.put(key, value, tags(**arguments))
+                return copied(value)
+            return coroutine_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache: QueryCache = self.query_cache
+            if cache is None:
+                return method(self, *args, **kwargs)
+            key, arguments = lookup(self, args, kwargs)
+            if key is None:
+                return method(self, *args, **kwargs)
+            hit, value = cache.get(key)
+            if not hit:
+                value = method(self, *args, **kwargs)
+                cache.put(key, value, tags(**arguments))
+            return copied(value)
+        return wrapper
+    return decorator
@@ -0,0 +1,210 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+from pymongo import monitoring
+
+LOGGER = logging.getLogger(__name__)
+
+# upper bounds in milliseconds of the buckets of the latency histograms, the last bucket is unbounded
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# commands that can be re run with explain
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+
+# fields of a sent command that belong to the session or to the connection, explain rejects them
+_SESSION_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "$db", "$clusterTime",
+                   "$readPreference"}
+
+# name of the MongoHelper method running on this thread or task
+_current_method: contextvars.ContextVar[str] = contextvars.ContextVar("current_method", default="-")
+
+
+class Histogram:
+    """
+    latency histogram with the fixed buckets of BUCKETS_MS
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, milliseconds: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+
+    def snapshot(self) -> dict:
+        labels = [f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {"count": self.count,
+                "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0,
+                "max_ms": round(self.max_ms, 3),
+                "buckets": {label: count for label, count in zip(labels, self.counts) if count}}
+
+
+def plan_summary(explain: dict) -> dict:
+    """
+    keys and documents examined, returned documents and stages of an explain("executionStats") output, for a find or
+    for an aggregation whose plan is nested in its stages
+    """
+    stages = []
+    statistics = []
+
+    def visit(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            if "executionStats" in node and isinstance(node["executionStats"], dict):
+                statistics.append(node["executionStats"])
+            for value in node.values():
+                visit(value)
+        elif isinstance(node, list):
+            for value in node:
+                visit(value)
+
+    visit(explain)
+    return {"keys_examined": sum(s.get("totalKeysExamined", 0) for s in statistics),
+            "docs_examined": sum(s.get("totalDocsExamined", 0) for s in statistics),
+            "returned": sum(s.get("nReturned", 0) for s in statistics),
+            "stages": sorted(set(stages)),
+            "collscan": "COLLSCAN" in stages}
+
+
+class QueryInstrumentation(monitoring.CommandListener):
+    """
+    command listener timing the commands sent by the MongoHelper methods. Commands slower than slow_ms are re run
+    with explain("executionStats") after the method returns and logged as JSON with their plan summary.
+    It is registered only on the client of the helpers that receive it, the other helpers do not pay for it
+    """
+
+    def __init__(self, slow_ms: float = 100.0, explain: bool = True, logger: logging.Logger = LOGGER):
+        """
+        :param slow_ms: commands taking at least this many milliseconds are logged
+        :param explain: explain the slow commands, keys and documents examined and COLLSCAN are added to the log
+        """
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._methods: dict[str, Histogram] = {}
+        self._commands: dict[str, Histogram] = {}
+        self._failures: dict[str, int] = {}
+        # request_id -> (method, database, command) of the commands in flight
+        self._in_flight: dict[int, tuple[str, str, dict]] = {}
+        # (method, database, command, milliseconds) waiting for explain
+        self._slow: list[tuple[str, str, dict, float]] = []
+        self.slow_commands: list[dict] = []
+
+    # CommandListener ---------------------------------------------------------
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            with self._lock:
+                self._in_flight[event.request_id] = (_current_method.get(), event.database_name, event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        milliseconds = event.duration_micros / 1000
+        with self._lock:
+            self._commands.setdefault(event.command_name, Histogram()).record(milliseconds)
+            started = self._in_flight.pop(event.request_id, None)
+            if started is not None and milliseconds >= self.slow_ms:
+                self._slow.append((*started, milliseconds))
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        with self._lock:
+            self._in_flight.pop(event.request_id, None)
+            self._failures[event.command_name] = self._failures.get(event.command_name, 0) + 1
+
+    # -------------------------------------------------------------------------
+    def record_method(self, method: str, milliseconds: float):
+        with self._lock:
+            self._methods.setdefault(method, Histogram()).record(milliseconds)
+
+    def report_slow_commands(self, client):
+        """
+        log the slow commands seen since the last call, explaining them on client. Run outside of the listener
+        callbacks, a listener must not send commands itself
+        """
+        with self._lock:
+            slow, self._slow = self._slow, []
+        for method, database, command, milliseconds in slow:
+            record = {"method": method, "command": next(iter(command)), "collection": command[next(iter(command))],
+                      "duration_ms": round(milliseconds, 3)}
+            if self.explain:
+                try:
+                    explained = client[database].command(
+                        {"explain": {key: value for key, value in command.items() if key not in _SESSION_FIELDS},
+                         "verbosity": "executionStats"})
+                    record.update(plan_summary(explained))
+                except Exception as exception:
+                    # e.g. aggregations ending with $merge cannot be explained with executionStats
+                    record["explain_error"] = str(exception)
+            with self._lock:
+                self.slow_commands.append(record)
+            self._logger.warning(json.dumps(record, default=str))
+
+    def snapshot(self) -> dict:
+        """
+        latency histograms of the MongoHelper methods and of the commands, failures and slow commands
+        """
+        with self._lock:
+            return {"methods": {name: histogram.snapshot() for name, histogram in self._methods.items()},
+                    "commands": {name: histogram.snapshot() for name, histogram in self._commands.items()},
+                    "failures": dict(self._failures),
+                    "slow_commands": list(self.slow_commands)}
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+            self._commands.clear()
+            self._failures.clear()
+            self._slow.clear()
+            self.slow_commands.clear()
+
+
+def instrumented(method):
+    """
+    time a MongoHelper method in the instrumentation of the helper and attribute its commands to it. A helper without
+    instrumentation calls the method directly. Methods returning a stream are timed until the cursor is created.
+    The coroutines of the AsyncMongoHelper are timed until they complete, their slow commands are explained in a
+    thread on the synchronous client of explain_client()
+    """
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def coroutine_wrapper(self, *args, **kwargs):
+            instrumentation: Optional[QueryInstrumentation] = self.instrumentation
+            if instrumentation is None:
+                return await method(self, *args, **kwargs)
+            token = _current_method.set(method.__name__)
+            before = time.perf_counter()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                instrumentation.record_method(method.__name__, (time.perf_counter() - before) * 1000)
+                _current_method.reset(token)
+                await asyncio.to_thread(instrumentation.report_slow_commands, self.explain_client())
+        return coroutine_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation: Optional[QueryInstrumentation] = self.instrumentation
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        token = _current_method.set(method.__name__)
+        before = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            instrumentation.record_method(method.__name__, (time.perf_counter() - before) * 1000)
+            _current_method.reset(token)
+            instrumentation.report_slow_commands(self.database().client)
+    return wrapper
@@ -0,0 +1,340 @@
+import math
+from typing import Any, Callable, Generator, Iterable, NamedTuple, Optional, Union
+
+from src.ClosestCluster import tightest_cluster
+from src.DocumentTransformer import minute_of_week, normalize_name
+from src.QueryCache import GLOBAL_TAG, city_tag, country_tag
+from src.Rollups import CITY_ROLLUPS, COUNTRY_ROLLUPS, MOST_EXPENSIVE_PRICE_LEVEL, top_cities_pipeline
+
+# The read queries are written once here and run by both MongoHelper and AsyncMongoHelper. A query is a function
+# returning Rows, or a generator yielding the requests it depends on (Find, Aggregate, Compute) and receiving their
+# results as lists before returning Rows or its final value. The helpers only execute the requests, each with its
+# own driver, so a query gives the same result on both.
+
+
+class Find(NamedTuple):
+    collection: str
+    filter: dict
+    projection: Optional[dict] = None
+    sort: Optional[list] = None
+    skip: int = 0
+    limit: int = 0
+    batch_size: int = 0
+
+
+class Aggregate(NamedTuple):
+    collection: str
+    pipeline: list[dict]
+
+
+class Compute(NamedTuple):
+    """
+    CPU bound step of a query, run in a thread by the AsyncMongoHelper to keep the event loop free
+    """
+    function: Callable
+    args: tuple
+
+
+class Rows(NamedTuple):
+    """
+    result of a query made of documents, shaped by format_results
+    :param documents: the request reading them, or the documents already read
+    :param row: function from document to the dict shown in pretty mode
+    :param plain: function from document to the value returned when not pretty, the document itself if None
+    """
+    documents: Union[Find, Aggregate, list]
+    pretty: bool
+    row: Callable[[dict], dict]
+    plain: Optional[Callable[[dict], Any]] = None
+
+
+Request = Union[Find, Aggregate, Compute]
+Query = Union[Rows, Generator[Request, list, Any]]
+
+# fields read by the pretty output of each query, only these are fetched in pretty mode
+PRETTY_PROJECTIONS: dict[str, dict] = {
+    "search_with_feature": {"_id": 0, "Position.city": 1, "restaurant_name": 1},
+    "search_popular_in_city": {"_id": 0, "restaurant_name": 1, "restaurant_link": 1},
+    "search_restaurants_in_radius": {"_id": 0, "Position.city": 1, "Position.latitude": 1, "Position.longitude": 1},
+    "get_vegan_restaurants_in_cities": {"_id": 0, "Position.city": 1, "restaurant_name": 1,
+                                        "FoodInfo.vegan_options": 1},
+    "get_english_speaking_always_open_restaurants": {"_id": 0, "restaurant_name": 1,
+                                                     "Schedule.open_days_per_week": 1,
+                                                     "Review.total_reviews_count": 1,
+                                                     "Price.min_price": 1, "Price.max_price": 1},
+    "find_open_at": {"_id": 0, "restaurant_name": 1, "Position.city": 1, "Schedule.original_open_hours": 1},
+    "search_text": {"_id": 0, "restaurant_name": 1, "restaurant_link": 1, "Position.city": 1},
+    "autocomplete": {"_id": 0, "restaurant_name": 1, "restaurant_link": 1, "Position.city": 1},
+    "find_top10_highest_rating_restaurant_in_the_5most_popular_cities": {"_id": 0, "Position.city": 1,
+                                                                         "restaurant_name": 1,
+                                                                         "Rating.avg_rating": 1,
+                                                                         "Rating.excellent": 1},
+}
+
+
+# part of the collection each query reads, see QueryCache.cached_query. The functions receive the arguments of the
+# helper method by name
+CACHE_TAGS: dict[str, Callable[..., list[str]]] = {
+    "search_with_feature": lambda city, **_: [city_tag(city)],
+    "search_popular_in_city": lambda city_name, **_: [city_tag(city_name)],
+    "search_restaurants_in_radius": lambda **_: [GLOBAL_TAG],
+    "get_vegan_restaurants_in_cities": lambda cities, **_: [city_tag(city) for city in cities],
+    "sort_with_weighted_rating": lambda country, **_: [country_tag(country)],
+    "get_english_speaking_always_open_restaurants": lambda **_: [GLOBAL_TAG],
+    "find_open_at": lambda city=None, **_: [GLOBAL_TAG if city is None else city_tag(city)],
+    "search_text": lambda country=None, city=None, **_: [
+        city_tag(city) if city is not None else country_tag(country) if country is not None else GLOBAL_TAG],
+    "autocomplete": lambda city=None, **_: [GLOBAL_TAG if city is None else city_tag(city)],
+    "find_most_expensive_restaurant_in_each_country": lambda **_: [GLOBAL_TAG],
+    "find_top10_highest_rating_restaurant_in_the_5most_popular_cities": lambda **_: [GLOBAL_TAG],
+    "get_top5_countries_with_the_highest_average_excellent_reviews": lambda **_: [GLOBAL_TAG],
+}
+
+
+def prettify(elements):
+    return '\n'.join(map(str, elements))
+
+
+def format_results(documents: Iterable[dict], pretty: bool, row: Callable[[dict], dict], stream: bool = False,
+                   plain: Callable[[dict], Any] = None):
+    """
+    shape the documents returned by a query
+    :param documents: cursor or list of documents
+    :param pretty: format every document with row
+    :param row: function from document to the dict shown in pretty mode
+    :param stream: return a generator consuming the cursor lazily instead of a list or a string
+    :param plain: function from document to the value returned when not pretty, the document itself if None
+    """
+    if not pretty and plain is not None:
+        documents = map(plain, documents)
+    if stream:
+        return (str(row(document)) if pretty else document for document in documents)
+    if not pretty:
+        return list(documents)
+    return prettify(row(document) for document in documents)
+
+
+# Queries -----------------------------------------------------------------
+
+def search_with_feature(feature: str, city: str, pretty: bool, projection: dict = None, batch_size: int = 0) -> Query:
+    return Rows(Find("Restaurants", {'Position.city': city, 'features': feature},
+                     PRETTY_PROJECTIONS["search_with_feature"] if pretty else projection, batch_size=batch_size),
+                pretty, lambda restaurant: {
+                    "City:": restaurant["Position"]["city"],
+                    "Resturant with the feature": restaurant["restaurant_name"]
+                })
+
+
+def search_popular_in_city(city_name: str, pretty: bool, limit: int = 3) -> Query:
+    return Rows(Find("Restaurants", {"Popularity.scope_city": city_name}, PRETTY_PROJECTIONS["search_popular_in_city"],
+                     sort=[("Popularity.rank", 1)], limit=limit),
+                pretty, lambda restaurant: {"resturant-name": restaurant["restaurant_name"],
+                                            "restaurant-link": restaurant["restaurant_link"]},
+                plain=lambda restaurant: restaurant["restaurant_link"])
+
+
+def search_restaurants_in_radius(my_latitude: float, my_longitude: float, max_distance: float,
+                                 pretty: bool) -> Query:
+    return Rows(Find("Restaurants", {"Position.location": {"$nearSphere": {
+        "$geometry": {"type": "Point", "coordinates": [my_longitude, my_latitude]},
+        "$maxDistance": max_distance
+    }}}, PRETTY_PROJECTIONS["search_restaurants_in_radius"] if pretty else {"restaurant_link": 1}, limit=10),
+        pretty, lambda restaurant: {"city": restaurant["Position"]["city"], "lat": restaurant["Position"]["latitude"],
+                                    "lon": restaurant["Position"]["longitude"]},
+        plain=lambda restaurant: restaurant.get("restaurant_link"))
+
+
+def get_vegan_restaurants_in_cities(cities: list[str], pretty: bool, projection: dict = None,
+                                    batch_size: int = 0) -> Query:
+    return Rows(Find("Restaurants", {"FoodInfo.vegetarian_friendly": "Y",
+                                     "FoodInfo.gluten_free": "Y",
+                                     "Position.city": {"$in": cities}},
+                     PRETTY_PROJECTIONS["get_vegan_restaurants_in_cities"] if pretty else projection,
+                     batch_size=batch_size),
+                pretty, lambda el: {
+                    "City": el["Position"]["city"],
+                    "Restaurant name": el["restaurant_name"],
+                    "Is vegan": el["FoodInfo"]["vegan_options"]
+                })
+
+
+def sort_with_weighted_rating(country: str, pretty: bool, limit: int = 30) -> Query:
+    return Rows(Find("Restaurants", {"Position.country": country}, {"restaurant_link": 1, "weightedRating": 1},
+                     sort=[("weightedRating", -1)], limit=limit),
+                pretty, lambda el: {"restaurant link": el["restaurant_link"], "weighted rating": el["weightedRating"]})
+
+
+def get_english_speaking_always_open_restaurants(open_days: int, reviews: int, min_price: int, max_price: int,
+                                                 pretty: bool, projection: dict = None,
+                                                 batch_size: int = 0) -> Query:
+    return Rows(Find("Restaurants", {"Schedule.open_days_per_week": open_days,
+                                     "Review.total_reviews_count": {"$gte": reviews},
+                                     "Review.default_language": "English",
+                                     "Price.min_price": {"$gte": min_price},
+                                     "Price.max_price": {"$lte": max_price}},
+                     PRETTY_PROJECTIONS["get_english_speaking_always_open_restaurants"] if pretty else projection,
+                     batch_size=batch_size),
+                pretty, lambda el: {
+                    "Restaurant": el["restaurant_name"],
+                    "Open Days per week": el["Schedule"]["open_days_per_week"],
+                    "Total review count": el["Review"]["total_reviews_count"],
+                    "Minimum price": el["Price"]["min_price"],
+                    "Maximum price": el["Price"]["max_price"]
+                })
+
+
+def find_open_at(day: str, hour: int, minute: int = 0, city: str = None, pretty: bool = True,
+                 projection: dict = None, batch_size: int = 0) -> Query:
+    moment = minute_of_week(day, hour, minute)
+    query = {"Schedule.open_slots": moment // 60,
+             "Schedule.open_intervals": {"$elemMatch": {"start": {"$lte": moment}, "end": {"$gt": moment}}}}
+    if city is not None:
+        query["Position.city"] = city
+    return Rows(Find("Restaurants", query, PRETTY_PROJECTIONS["find_open_at"] if pretty else projection,
+                     batch_size=batch_size),
+                pretty, lambda restaurant: {
+                    "City": restaurant["Position"]["city"],
+                    "Restaurant": restaurant["restaurant_name"],
+                    "Open hours": restaurant["Schedule"]["original_open_hours"].get(day)
+                })
+
+
+def search_text(text: str, country: str = None, city: str = None, page: int = 0, page_size: int = 10,
+                pretty: bool = True, projection: dict = None) -> Query:
+    query = {"$text": {"$search": text}}
+    if country is not None:
+        query["Position.country"] = country
+    if city is not None:
+        query["Position.city"] = city
+    fields = PRETTY_PROJECTIONS["search_text"] if pretty else projection
+    return Rows(Find("Restaurants", query, {**(fields or {}), "score": {"$meta": "textScore"}},
+                     sort=[("score", {"$meta": "textScore"}), ("weightedRating", -1)],
+                     skip=page * page_size, limit=page_size),
+                pretty, lambda restaurant: {
+                    "City": restaurant["Position"]["city"],
+                    "Restaurant": restaurant["restaurant_name"],
+                    "Link": restaurant["restaurant_link"],
+                    "Score": round(restaurant["score"], 2)
+                })
+
+
+def autocomplete(prefix: str, city: str = None, limit: int = 10, pretty: bool = True) -> Query:
+    start = normalize_name(prefix)
+    if not start:
+        return Rows([], pretty, dict)
+    # U+10FFFF sorts after every character, so the range holds exactly the names starting with the prefix
+    query = {"search_name": {"$gte": start, "$lt": start + "\U0010ffff"}}
+    if city is not None:
+        query["Position.city"] = city
+    return Rows(Find("Restaurants", query, PRETTY_PROJECTIONS["autocomplete"], sort=[("search_name", 1)], limit=limit),
+                pretty, lambda restaurant: {
+                    "City": restaurant["Position"]["city"],
+                    "Restaurant": restaurant["restaurant_name"],
+                    "Link": restaurant["restaurant_link"]
+                })
+
+
+def find_most_expensive_restaurant_in_each_country(pretty: bool) -> Query:
+    # single document reads on the rollups, the aggregation is only run when they are not built
+    rows = yield Find(COUNTRY_ROLLUPS, {"most_expensive_restaurant": {"$exists": True}},
+                      {"most_expensive_restaurant": 1})
+    return Rows(rows if rows else Aggregate("Restaurants", [
+        # filter only for the resturanr tagged "€€-€€€"
+        {"$match": {"Price.price_level": MOST_EXPENSIVE_PRICE_LEVEL}},
+        {"$match": {"Price.max_price": {"$exists": True}}},
+        {"$sort": {"Price.max_price": -1}},
+        # $$ROOT returns the entire document restaurant most expensive for each group
+        {"$group": {
+            "_id": "$Position.country",
+            "most_expensive_restaurant": {"$first": "$$ROOT"}
+        }}
+    ]), pretty, lambda row: {"Country": row['_id'],
+                             "restaurant": row["most_expensive_restaurant"]["restaurant_name"],
+                             "Max Price": row["most_expensive_restaurant"]["Price"]["max_price"],
+                             "Symbolic price": row["most_expensive_restaurant"]["Price"]["price_level"]
+                             })
+
+
+def find_top10_highest_rating_restaurant_in_the_5most_popular_cities(pretty: bool, projection: dict = None) -> Query:
+    # Find the most popular cities in the world,
+    # in order to do it we assumed that the most popular cities are the cities with most entries in the db
+    top_cities = yield Aggregate(CITY_ROLLUPS, top_cities_pipeline(5))
+    if not top_cities:
+        top_cities = yield Aggregate("Restaurants", [
+            # $ne filters out string equal to ""
+            {"$match": {"Position.city": {"$exists": True, "$ne": ""}}},
+            {"$group": {"_id": "$Position.city", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": 5}
+        ])
+
+    # Retrive the highest revived restaurant in the most popular cities. The reviewed score is determined useing
+    # both the average rating of a restaurant and the number of excellent reviews
+    return Rows(Find("Restaurants", {"Position.city": {"$in": [city['_id'] for city in top_cities]}},
+                     PRETTY_PROJECTIONS["find_top10_highest_rating_restaurant_in_the_5most_popular_cities"] if pretty
+                     else projection, sort=[("Rating.avg_rating", -1), ("Rating.excellent", -1)], limit=10),
+                pretty, lambda restaurant: {
+                    "City": restaurant["Position"]["city"],
+                    "Restaurant": restaurant["restaurant_name"],
+                    "Average rating": restaurant["Rating"]["avg_rating"],
+                    "Number of excellent ratings": restaurant["Rating"]["excellent"]
+                })
+
+
+def get_top5_countries_with_the_highest_average_excellent_reviews(pretty: bool) -> Query:
+    rows = yield Find(COUNTRY_ROLLUPS, {"num_restaurants": {"$gt": 0}}, {"avg_excellent": 1},
+                      sort=[("avg_excellent", -1)], limit=5)
+    return Rows(rows if rows else Aggregate("Restaurants", [
+        # takes only restaurant with excenllent rating
+        {"$match": {"Rating.excellent": {"$exists": True}}},
+        # Groups for country, sums up excellent ratings and counting restaurants.
+        {"$group": {
+            "_id": "$Position.country",
+            "total_excellents": {"$sum": "$Rating.excellent"},
+            "num_restaurants": {"$sum": 1}
+        }},
+        # Calculate the average of excellent reviews, $project adds field to the group
+        {"$project": {
+            "avg_excellent": {"$divide": ["$total_excellents", "$num_restaurants"]}
+        }},
+        {"$sort": {"avg_excellent": -1}},
+        {"$limit": 5}
+    ]), pretty, lambda row: {"Country": row['_id'],
+                             "Average of excellent reviews": math.floor(row['avg_excellent'])})
+
+
+def find_the_closest_three_restaurant_in_randon_city(pretty: bool = True, k: int = 3, city_name: str = None,
+                                                     min_restaurants: int = 20) -> Query:
+    if city_name is None:
+        # find a random city with at least min_restaurants restaurant
+        city = yield Aggregate("Restaurants", [
+            {"$group": {"_id": "$Position.city", "counts": {"$sum": 1}}},
+            {"$match": {"counts": {"$gte": max(min_restaurants, k)}}},
+            {"$sample": {"size": 1}}
+        ])
+        if not city:
+            raise ValueError("city name is none")
+        city_name = city[0]["_id"]
+
+    # restaurants without coordinates are stored with latitude and longitude 0
+    restaurants_positions = yield Find("Restaurants", {
+        "Position.city": city_name,
+        "Position.latitude": {"$exists": True, "$ne": 0},
+        "Position.longitude": {"$exists": True, "$ne": 0}
+    }, {"_id": 0, "restaurant_name": 1, "restaurant_link": 1, "Position.latitude": 1, "Position.longitude": 1})
+    cluster = yield Compute(tightest_cluster, ([r["Position"]["latitude"] for r in restaurants_positions],
+                                               [r["Position"]["longitude"] for r in restaurants_positions], k))
+    if cluster is None:
+        raise ValueError(f"less than {k} restaurants with a position in {city_name}")
+
+    result = {"city": city_name,
+              "number_of_restaurants": len(restaurants_positions),
+              "restaurants": [restaurants_positions[i] for i in cluster.indices],
+              "radius": cluster.radius,
+              "diameter": cluster.diameter}
+    if not pretty:
+        return result
+    names = ", ".join(r["restaurant_name"] for r in result["restaurants"])
+    return (f"in City {city_name} with number of restaurants {result['number_of_restaurants']}. The closest "
+            f"restaurants between each other are: {names}, "
+            f"they are all within {math.floor(cluster.diameter)} m from each other")
@@ -0,0 +1,128 @@
+from typing import Iterable
+
+from pymongo.database import Database
+
+# one document per country: num_restaurants, total_excellents, avg_excellent, most_expensive_restaurant
+COUNTRY_ROLLUPS = "CountryRollups"
+# one document per city of a country, _id is {"country": ..., "city": ...}: count, total_excellents
+CITY_ROLLUPS = "CityRollups"
+
+# the most expensive restaurant is searched among the restaurants of this price level
+MOST_EXPENSIVE_PRICE_LEVEL = "€€-€€€"
+
+
+def _match(countries: Iterable[str] = None) -> dict:
+    return {} if countries is None else {"Position.country": {"$in": list(countries)}}
+
+
+def _merge(collection_name: str) -> dict:
+    return {"$merge": {"into": collection_name, "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}}
+
+
+def _average_excellent() -> dict:
+    return {"$cond": [{"$gt": ["$num_restaurants", 0]},
+                      {"$divide": ["$total_excellents", "$num_restaurants"]},
+                      None]}
+
+
+def build_country_stats(db: Database, countries: Iterable[str] = None):
+    db["Restaurants"].aggregate([
+        {"$match": _match(countries)},
+        {"$group": {
+            "_id": "$Position.country",
+            "total_excellents": {"$sum": "$Rating.excellent"},
+            # only the restaurants with an excellent rating count for the average
+            "num_restaurants": {"$sum": {"$cond": [{"$eq": [{"$type": "$Rating.excellent"}, "missing"]}, 0, 1]}}
+        }},
+        {"$set": {"avg_excellent": _average_excellent()}},
+        _merge(COUNTRY_ROLLUPS)
+    ], allowDiskUse=True)
+
+
+def build_most_expensive(db: Database, countries: Iterable[str] = None):
+    db["Restaurants"].aggregate([
+        {"$match": {**_match(countries),
+                    "Price.price_level": MOST_EXPENSIVE_PRICE_LEVEL,
+                    "Price.max_price": {"$exists": True}}},
+        {"$sort": {"Price.max_price": -1}},
+        {"$group": {"_id": "$Position.country", "most_expensive_restaurant": {"$first": "$$ROOT"}}},
+        # derived links between restaurants are not part of the snapshot, they change too often
+        {"$unset": "most_expensive_restaurant.similar_priced_restaurants"},
+        _merge(COUNTRY_ROLLUPS)
+    ], allowDiskUse=True)
+
+
+def _city_key(country: str, city: str) -> dict:
+    return {"country": country, "city": city}
+
+
+def build_city_stats(db: Database, countries: Iterable[str] = None):
+    # the cities no longer present in the rebuilt countries must not keep their old counts
+    db[CITY_ROLLUPS].delete_many({} if countries is None else {"_id.country": {"$in": list(countries)}})
+    db["Restaurants"].aggregate([
+        {"$match": _match(countries)},
+        {"$group": {
+            "_id": {"country": "$Position.country", "city": "$Position.city"},
+            "count": {"$sum": 1},
+            "total_excellents": {"$sum": "$Rating.excellent"}
+        }},
+        _merge(CITY_ROLLUPS)
+    ], allowDiskUse=True)
+
+
+def build_rollups(db: Database, countries: Iterable[str] = None):
+    """
+    compute the country and city rollups with $merge, the existing rollups are updated in place
+    :param db: database holding the Restaurants collection
+    :param countries: recompute only the rollups of these countries and of their cities, all if None
+    """
+    countries = None if countries is None else list(countries)
+    build_country_stats(db, countries)
+    build_most_expensive(db, countries)
+    build_city_stats(db, countries)
+
+
+def record_excellent_ratings(db: Database, country: str, city: str, excellent: int):
+    """
+    add new excellent ratings of a restaurant to the rollups of its country and city
+    """
+    if not excellent:
+        return
+    db[COUNTRY_ROLLUPS].update_one({"_id": country}, [
+        {"$set": {"total_excellents": {"$add": [{"$ifNull": ["$total_excellents", 0]}, excellent]}}},
+        {"$set": {"avg_excellent": _average_excellent()}}
+    ])
+    db[CITY_ROLLUPS].update_one({"_id": _city_key(country, city)}, {"$inc": {"total_excellents": excellent}})
+
+
+def top_cities_pipeline(limit: int) -> list[dict]:
+    """
+    the cities with the most restaurants, a city name present in several countries counts as one city
+    """
+    return [
+        {"$match": {"_id.city": {"$nin": ["", None]}}},
+        {"$group": {"_id": "$_id.city", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": -1}},
+        {"$limit": limit}
+    ]
+
+
+def refresh_most_expensive_matching(db: Database, query: dict):
+    """
+    refresh the snapshots of the most expensive restaurants matching query, for updates that change the restaurants
+    but not the rollup values
+    """
+    links = db[COUNTRY_ROLLUPS].distinct("most_expensive_restaurant.restaurant_link")
+    if links:
+        refresh_if_most_expensive(db, db["Restaurants"].distinct(
+            "restaurant_link", {"$and": [query, {"restaurant_link": {"$in": links}}]}))
+
+
+def refresh_if_most_expensive(db: Database, restaurant_links: list[str]):
+    """
+    refresh the snapshot of the most expensive restaurant of the countries where it is one of the given restaurants
+    """
+    countries = db[COUNTRY_ROLLUPS].distinct("_id", {"most_expensive_restaurant.restaurant_link":
+                                                         {"$in": restaurant_links}})
+    if countries:
+        build_most_expensive(db, countries)
@@ -0,0 +1,238 @@
+import argparse
+import json
+import time
+from typing import Iterable, Iterator, Union
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # the snapshots are optional, the rest of the project does not need pyarrow
+    pa = pc = pq = None
+
+from src.CsvHandler import CsvHandler
+from src.DocumentTransformer import (RESTAURANT_SCHEMA, max_price, min_price, split_list, split_list_keep_spaces,
+                                     transform_rows)
+from src.MongoHelper import MongoHelper, batched
+from src.Rollups import MOST_EXPENSIVE_PRICE_LEVEL
+
+# A snapshot is a Parquet file with one struct column for each field of the restaurant document (Position, Rating...)
+# for the vectorized queries, and a DOCUMENT_COLUMN with the whole document encoded in BSON. The reload sends the BSON
+# as it is, so it costs neither the parsing of the csv nor the encoding of the documents
+DOCUMENT_COLUMN = "bson"
+
+# fields added to the document after the columns are converted, see RESTAURANT_DERIVED_FIELDS
+DERIVED_FIELD_TYPES: dict[str, str] = {
+    "Position.location": "point",
+    "Popularity.rank": "int",
+    "Popularity.rank_total": "int",
+    "Popularity.category": "string",
+    "Popularity.scope_city": "string",
+    "Schedule.open_intervals": "intervals",
+    "Schedule.open_slots": "int_list",
+    "weightedRating": "float",
+    "search_name": "string",
+    "sync_hash": "string",
+}
+
+# free form objects, stored in the snapshot as JSON text
+JSON_FIELDS = [column.path for column in RESTAURANT_SCHEMA if column.type is json.loads]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("snapshots need pyarrow: python3 -m pip install pyarrow")
+
+
+def _arrow_type(kind: str):
+    return {"string": pa.string(), "float": pa.float64(), "int": pa.int64(), "list": pa.list_(pa.string()),
+            "int_list": pa.list_(pa.int64()),
+            "intervals": pa.list_(pa.struct([("start", pa.int64()), ("end", pa.int64())])),
+            "point": pa.struct([("type", pa.string()), ("coordinates", pa.list_(pa.float64()))])}[kind]
+
+
+def _column_kind(column) -> str:
+    if column.type in (split_list, split_list_keep_spaces):
+        return "list"
+    if column.type is float:
+        return "float"
+    if column.type in (min_price, max_price):
+        return "int"
+    return "string"
+
+
+def arrow_schema():
+    """
+    Arrow schema of a restaurant document, with one struct column for each of Position, Popularity, Price...
+    """
+    _require_pyarrow()
+    tree: dict = {}
+    fields = [(column.path, _column_kind(column)) for column in RESTAURANT_SCHEMA] + list(DERIVED_FIELD_TYPES.items())
+    for path, kind in fields:
+        *parents, leaf = path.split(".")
+        node = tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = _arrow_type(kind)
+
+    def struct(node: dict) -> list:
+        return [(key, pa.struct(struct(child)) if isinstance(child, dict) else child) for key, child in node.items()]
+
+    return pa.schema(struct(tree) + [(DOCUMENT_COLUMN, pa.binary())])
+
+
+def _to_row(document: dict) -> dict:
+    row = dict(document)
+    row.pop("_id", None)
+    row[DOCUMENT_COLUMN] = bson.encode(row)
+    for path in JSON_FIELDS:
+        parent, leaf = path.split(".")
+        row[parent] = {**row[parent], leaf: json.dumps(row[parent][leaf])}
+    return row
+
+
+def write_snapshot(documents: Iterable[dict], path, batch_size: int = 10_000) -> int:
+    """
+    write restaurant documents to a Parquet file, batch by batch. The BSON column keeps the whole document, the
+    struct columns only the fields of the imported document (not e.g. similar_priced_restaurants)
+    :param documents: documents as built by transform_rows or read from the Restaurants collection
+    :param path: destination file
+    :return: number of written documents
+    """
+    schema = arrow_schema()
+    written = 0
+    with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+        for batch in batched(documents, batch_size):
+            writer.write_table(pa.Table.from_pylist([_to_row(document) for document in batch], schema=schema))
+            written += len(batch)
+    return written
+
+
+def export_csv(csv_path, path, batch_size: int = 10_000) -> int:
+    """
+    parse and transform the csv once and keep the result as a snapshot
+    """
+    csv_handler = CsvHandler(csv_path)
+    return write_snapshot(transform_rows(csv_handler.rows(), csv_handler.header()), path, batch_size)
+
+
+def export_collection(helper: MongoHelper, path, collection_name: str = "Restaurants",
+                      batch_size: int = 10_000) -> int:
+    """
+    snapshot the current content of a collection
+    """
+    cursor = helper.database()[collection_name].find({}, {"_id": 0}, batch_size=batch_size)
+    return write_snapshot(cursor, path, batch_size)
+
+
+def read_snapshot(path, batch_size: int = 10_000, raw: bool = False) -> Iterator[Union[dict, RawBSONDocument]]:
+    """
+    lazily read the documents of a snapshot, in the format of the Restaurants collection
+    :param raw: yield the documents still encoded, pymongo inserts them without encoding them again
+    """
+    _require_pyarrow()
+    for record_batch in pq.ParquetFile(str(path)).iter_batches(batch_size=batch_size, columns=[DOCUMENT_COLUMN]):
+        for encoded in record_batch.column(0).to_pylist():
+            yield RawBSONDocument(encoded) if raw else bson.decode(encoded)
+
+
+def load_snapshot(helper: MongoHelper, path, collection_name: str = "Restaurants", batch_size: int = 1000) -> int:
+    """
+    insert the documents of a snapshot in a collection, without parsing the csv again. A compact helper converts
+    the documents of the full schema stored in the snapshot, so they are decoded instead of sent as they are
+    :return: number of inserted documents
+    """
+    return helper.add_stream_to_collection(read_snapshot(path, raw=not helper.compact),
+                                           collection_name=collection_name, batch_size=batch_size)
+
+
+def read_table(path, columns: list[str] = None):
+    """
+    load a snapshot as a flat Arrow table, nested fields become columns named by their path, e.g. Position.city
+    :param columns: top level fields to read, e.g. ["Position", "Rating"], all but the BSON documents if None
+    """
+    _require_pyarrow()
+    if columns is None:
+        columns = [name for name in pq.read_schema(str(path)).names if name != DOCUMENT_COLUMN]
+    return pq.read_table(str(path), columns=columns).flatten()
+
+
+# Vectorized queries ----------------------------------------------------------
+# the aggregate queries of MongoHelper computed on a flat table, they return the raw (not pretty) rows
+
+def top5_countries_with_the_highest_average_excellent_reviews(table) -> list[dict]:
+    rated = table.filter(pc.is_valid(table["Rating.excellent"]))
+    groups = rated.group_by("Position.country").aggregate([("Rating.excellent", "mean")])
+    groups = groups.sort_by([("Rating.excellent_mean", "descending")]).slice(0, 5)
+    return [{"_id": row["Position.country"], "avg_excellent": row["Rating.excellent_mean"]}
+            for row in groups.to_pylist()]
+
+
+def most_expensive_restaurant_in_each_country(table) -> list[dict]:
+    candidates = table.filter(pc.and_(pc.equal(table["Price.price_level"], MOST_EXPENSIVE_PRICE_LEVEL),
+                                      pc.is_valid(table["Price.max_price"])))
+    candidates = candidates.sort_by([("Price.max_price", "descending")])
+    # without threads the first row of each group is the first in the sorted order
+    groups = candidates.group_by("Position.country", use_threads=False).aggregate(
+        [("restaurant_name", "first"), ("restaurant_link", "first"), ("Price.max_price", "first"),
+         ("Price.price_level", "first")])
+    return [{"_id": row["Position.country"],
+             "most_expensive_restaurant": {"restaurant_link": row["restaurant_link_first"],
+                                           "restaurant_name": row["restaurant_name_first"],
+                                           "Price": {"max_price": row["Price.max_price_first"],
+                                                     "price_level": row["Price.price_level_first"]}}}
+            for row in groups.to_pylist()]
+
+
+def top10_highest_rating_restaurant_in_the_5most_popular_cities(table) -> list[dict]:
+    cities = table.filter(pc.and_(pc.is_valid(table["Position.city"]), pc.not_equal(table["Position.city"], "")))
+    counts = cities.group_by("Position.city").aggregate([("Position.city", "count")])
+    top_cities = counts.sort_by([("Position.city_count", "descending")]).slice(0, 5)["Position.city"]
+    restaurants = table.filter(pc.is_in(table["Position.city"], value_set=top_cities))
+    restaurants = restaurants.sort_by([("Rating.avg_rating", "descending"), ("Rating.excellent", "descending")])
+    return restaurants.slice(0, 10).select(["restaurant_link", "restaurant_name", "Position.city",
+                                            "Rating.avg_rating", "Rating.excellent"]).to_pylist()
+
+
+def sort_with_weighted_rating(table, country: str) -> list[dict]:
+    restaurants = table.filter(pc.equal(table["Position.country"], country))
+    restaurants = restaurants.select(["restaurant_link", "weightedRating"])
+    return restaurants.sort_by([("weightedRating", "descending")]).slice(0, 30).to_pylist()
+
+
+def benchmark(csv_path, path) -> dict:
+    """
+    time the client side of a reload, without Mongo: the csv path parses, transforms and encodes every document in
+    BSON, the snapshot path reads the encoded documents
+    """
+    before = time.perf_counter()
+    csv_handler = CsvHandler(csv_path)
+    from_csv = sum(1 for document in transform_rows(csv_handler.rows(), csv_handler.header())
+                   if bson.encode(document))
+    csv_seconds = time.perf_counter() - before
+    before = time.perf_counter()
+    from_snapshot = sum(1 for _ in read_snapshot(path, raw=True))
+    snapshot_seconds = time.perf_counter() - before
+    return {"documents": from_csv, "snapshot_documents": from_snapshot, "csv_seconds": round(csv_seconds, 3),
+            "snapshot_seconds": round(snapshot_seconds, 3), "speedup": round(csv_seconds / snapshot_seconds, 2)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["export-csv", "export-db", "load", "benchmark"])
+    parser.add_argument("--csv", default="tripadvisor_european_restaurants.csv")
+    parser.add_argument("--snapshot", default="restaurants.parquet")
+    args = parser.parse_args()
+    if args.action == "export-csv":
+        print(f"Exported {export_csv(args.csv, args.snapshot)} restaurants")
+    elif args.action == "benchmark":
+        print(json.dumps(benchmark(args.csv, args.snapshot)))
+    else:
+        with MongoHelper(host="localhost", port=27017, dbName="DDM") as mongoHelper:
+            if args.action == "export-db":
+                print(f"Exported {export_collection(mongoHelper, args.snapshot)} restaurants")
+            else:
+                print(f"Imported {load_snapshot(mongoHelper, args.snapshot)} restaurants")
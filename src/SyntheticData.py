@@ -0,0 +1,142 @@
+import csv
+import json
+import random
+from pathlib import Path
+
+# columns of tripadvisor_european_restaurants.csv, see the comment in main.py
+COLUMNS = ["restaurant_link", "restaurant_name", "original_location", "country", "region", "province", "city",
+           "address", "latitude", "longitude", "claimed", "awards", "popularity_detailed", "popularity_generic",
+           "top_tags", "price_level", "price_range", "meals", "cuisines", "special_diets", "features",
+           "vegetarian_friendly", "vegan_options", "gluten_free", "original_open_hours", "open_days_per_week",
+           "open_hours_per_week", "working_shifts_per_week", "avg_rating", "total_reviews_count", "default_language",
+           "reviews_count_in_default_language", "excellent", "very_good", "average", "poor", "terrible", "food",
+           "service", "value", "atmosphere", "keywords"]
+
+# (country, region, city, latitude, longitude, weight)
+CITIES = [
+    ("France", "Ile-de-France", "Paris", 48.85341, 2.3488, 30),
+    ("France", "Nouvelle-Aquitaine", "Dax", 43.7102, -1.0536, 2),
+    ("France", "Ile-de-France", "Franconville", 48.9888, 2.2306, 1),
+    ("England", "London", "London", 51.5072, -0.1276, 30),
+    ("Italy", "Lazio", "Rome", 41.9028, 12.4964, 20),
+    ("Italy", "Lombardy", "Milan", 45.4642, 9.19, 15),
+    ("Spain", "Catalonia", "Barcelona", 41.3874, 2.1686, 15),
+    ("Spain", "Community of Madrid", "Madrid", 40.4168, -3.7038, 15),
+    ("Germany", "Lower Saxony", "Osnabruck", 52.2799, 8.0472, 2),
+    ("Germany", "Berlin", "Berlin", 52.52, 13.405, 12),
+    ("Switzerland", "Canton of Zurich", "Zurich", 47.3769, 8.5417, 5),
+    ("Greece", "Attica", "Athens", 37.9838, 23.7275, 6),
+]
+
+FEATURES = ["Reservations", "Seating", "Serves Alcohol", "Table Service", "Wheelchair Accessible", "Takeout",
+            "Outdoor Seating", "Free Wifi", "Accepts Credit Cards", "Delivery", "Parking Available", "Full Bar"]
+CUISINES = ["French", "European", "Italian", "Pizza", "Mediterranean", "Spanish", "German", "British", "Greek",
+            "Cafe", "Bar", "Pub", "Seafood", "Asian", "Japanese", "Sushi", "Fast Food", "Vegetarian Friendly"]
+SPECIAL_DIETS = ["Vegetarian Friendly", "Vegan Options", "Gluten Free Options"]
+MEALS = ["Breakfast", "Brunch", "Lunch", "Dinner", "Drinks", "Late Night"]
+TOP_TAGS = ["Cheap Eats", "Mid-range", "Fine Dining", "French", "Italian", "Pizza", "Cafe", "Bar", "European"]
+AWARDS = ["Certificate of Excellence 2019", "Certificate of Excellence 2018", "Travelers Choice 2020"]
+LANGUAGES = ["English", "French", "Italian", "Spanish", "German", "All languages"]
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+PRICE_LEVELS = {"€": (2, 25), "€€-€€€": (8, 80), "€€€€": (40, 400)}
+
+
+def _open_hours(rng: random.Random) -> dict:
+    shifts = rng.choice([["12:00-14:30", "19:00-22:30"], ["08:00-18:00"], ["11:30-23:00"], ["18:00-02:00"]])
+    closed = set(rng.sample(DAYS, rng.randint(0, 3)))
+    return {day: ([] if day in closed else shifts) for day in DAYS}
+
+
+def _price_range(rng: random.Random, level: str, country: str) -> str:
+    low, high = PRICE_LEVELS[level]
+    min_price = rng.randint(low, high)
+    max_price = rng.randint(min_price + 1, min_price * 4 + 10)
+    if country == "Switzerland":
+        return f"CHF\u00A0{min_price:,}-CHF\u00A0{max_price:,}"
+    if country == "England":
+        return f"£{min_price:,}-£{max_price:,}"
+    return f"€{min_price:,}-€{max_price:,}"
+
+
+def _join(values: list[str]) -> str:
+    return ", ".join(values)
+
+
+def synthetic_row(rng: random.Random, index: int) -> dict:
+    """
+    generate one TripAdvisor shaped row, with the same formats and the same kind of empty cells of the real dataset
+    :param rng: source of randomness, seed it to get reproducible files
+    :param index: progressive number of the row, used to build a unique restaurant_link
+    :return: map from column name to cell
+    """
+    country, region, city, latitude, longitude, _ = rng.choices(CITIES, weights=[c[5] for c in CITIES])[0]
+    level = rng.choice(list(PRICE_LEVELS))
+    open_hours = _open_hours(rng) if rng.random() < 0.7 else None
+    buckets = [rng.randint(0, 200) if rng.random() < 0.9 else "" for _ in range(5)]
+    reviews = sum(b for b in buckets if b != "")
+    rank = rng.randint(1, 2000)
+    sub_ratings = [rng.choice(["", "3.0", "3.5", "4.0", "4.5", "5.0"]) for _ in range(4)]
+    row = {
+        "restaurant_link": f"g{100000 + index % 5000}-d{10000000 + index}",
+        "restaurant_name": f"{rng.choice(['Le', 'La', 'Il', 'The', 'El', 'Zum'])} {rng.choice(CUISINES)} {index}",
+        "original_location": json.dumps(["Europe", country, region, city]),
+        "country": country,
+        "region": region,
+        "province": "" if rng.random() < 0.3 else f"{city} Province",
+        "city": city,
+        "address": f"{rng.randint(1, 200)} Street {index % 977}, {city} {country}",
+        "latitude": "" if rng.random() < 0.02 else f"{latitude + rng.gauss(0, 0.03):.6f}",
+        "longitude": "" if rng.random() < 0.02 else f"{longitude + rng.gauss(0, 0.04):.6f}",
+        "claimed": rng.choice(["Claimed", "Unclaimed", ""]),
+        "awards": _join(rng.sample(AWARDS, rng.randint(0, 2))),
+        "popularity_detailed": f"#{rank} of {rank + rng.randint(0, 3000)} Restaurants in {city}",
+        "popularity_generic": f"#{rank} of {rank + rng.randint(0, 4000)} places to eat in {city}",
+        "top_tags": _join(rng.sample(TOP_TAGS, rng.randint(0, 4))),
+        "price_level": level if rng.random() < 0.85 else "",
+        "price_range": _price_range(rng, level, country) if rng.random() < 0.4 else "",
+        "meals": _join(rng.sample(MEALS, rng.randint(0, 4))),
+        "cuisines": _join(rng.sample(CUISINES, rng.randint(0, 5))),
+        "special_diets": _join(rng.sample(SPECIAL_DIETS, rng.randint(0, 3))),
+        "features": _join(rng.sample(FEATURES, rng.randint(0, 7))),
+        "vegetarian_friendly": rng.choice("YN"),
+        "vegan_options": rng.choice("YN"),
+        "gluten_free": rng.choice("YN"),
+        "original_open_hours": "" if open_hours is None else json.dumps(open_hours),
+        "open_days_per_week": "" if open_hours is None else f"{sum(1 for s in open_hours.values() if s):.1f}",
+        "open_hours_per_week": "" if open_hours is None else f"{rng.uniform(10, 90):.2f}",
+        "working_shifts_per_week": "" if open_hours is None else f"{rng.randint(1, 14):.1f}",
+        "avg_rating": "" if reviews == 0 else f"{rng.choice([3.0, 3.5, 4.0, 4.5, 5.0]):.1f}",
+        "total_reviews_count": f"{reviews:.1f}",
+        "default_language": rng.choice(LANGUAGES),
+        "reviews_count_in_default_language": f"{reviews // 2:.1f}",
+        "excellent": f"{buckets[0]}" if buckets[0] != "" else "",
+        "very_good": f"{buckets[1]}" if buckets[1] != "" else "",
+        "average": f"{buckets[2]}" if buckets[2] != "" else "",
+        "poor": f"{buckets[3]}" if buckets[3] != "" else "",
+        "terrible": f"{buckets[4]}" if buckets[4] != "" else "",
+        "food": sub_ratings[0],
+        "service": sub_ratings[1],
+        "value": sub_ratings[2],
+        "atmosphere": sub_ratings[3],
+        "keywords": "" if rng.random() < 0.9 else _join(rng.sample(CUISINES, 2)),
+    }
+    return row
+
+
+def generate_csv(path, rows: int, seed: int = 42) -> Path:
+    """
+    write a synthetic csv with the columns of the TripAdvisor dataset
+    :param path: destination file
+    :param rows: number of restaurants
+    :param seed: seed of the generator, the same seed always produces the same file
+    :return: the path of the file
+    """
+    path = Path(path)
+    rng = random.Random(seed)
+    with open(path, newline='', mode="w", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile, delimiter=',')
+        writer.writerow(COLUMNS)
+        for index in range(rows):
+            row = synthetic_row(rng, index)
+            writer.writerow([row[column] for column in COLUMNS])
+    return path
@@ -0,0 +1,178 @@
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from src.CsvHandler import CsvHandler
+from src.DocumentTransformer import RESTAURANT_SCHEMA, Column, compile_schema
+from src.SyntheticData import generate_csv
+
+
+def legacy_row_to_document(line: list[str], headers: dict[str, int]) -> dict:
+    """
+    the hand written transform used by initializeDB before the column schema, kept as baseline
+    """
+    features = [] if line[headers["features"]] == "" else line[headers["features"]].replace(" ", "").split(",")
+    awards = [] if line[headers["awards"]] == "" else line[headers["awards"]].split(",")
+    keywords = [] if line[headers["keywords"]] == "" else line[headers["keywords"]].split(",")
+    res = {"restaurant_link": line[headers["restaurant_link"]],
+           "restaurant_name": line[headers["restaurant_name"]],
+           "claimed": line[headers["claimed"]],
+           "awards": awards,
+           "keywords": keywords,
+           "features": features
+           }
+    continent = line[headers["original_location"]].replace("[", "").replace('"', "").split(",")[0]
+    position = {
+        # "original_location": line[headers["original_location"]],
+        "continent": continent,
+        'country': line[headers["country"]],
+        "region": line[headers["region"]],
+        "province": line[headers["province"]],
+        "city": line[headers["city"]],
+        "address": line[headers["address"]],
+        "latitude": float(line[headers["latitude"]]) if line[headers["latitude"]] != "" else 0,
+        "longitude": float(line[headers["longitude"]]) if line[headers["longitude"]] != "" else 0
+    }
+    top_args = [] if line[headers["top_tags"]] == "" else line[headers["top_tags"]].replace(" ", "").split(",")
+    popularity = {
+        "popularity_detailed": line[headers["popularity_detailed"]],
+        "popularity_generic": line[headers["popularity_generic"]],
+        "top_tags": top_args,
+    }
+    pr = line[headers["price_range"]].replace(",", "")
+    pr = pr.replace("CHF\u00A0", "$")
+    min_price = None
+    max_price = None
+    if pr != "":
+        min_price = int(pr.split("-")[0][1:])
+        max_price = int(pr.split("-")[1][1:])
+
+    priceInfo = {
+        "price_level": line[headers["price_level"]],
+        "min_price": min_price,
+        "max_price": max_price
+    }
+    meals = [] if line[headers["meals"]] == "" else line[headers["meals"]].replace(" ", "").split(",")
+    cuisine = [] if line[headers["cuisines"]] == "" else line[headers["cuisines"]].replace(" ", "").split(",")
+    special_diets = [] if line[headers["special_diets"]] == "" else line[headers["special_diets"]].replace(" ",
+                                                                                                           "").split(
+        ",")
+    foodInf = {
+        "meals": meals,
+        "cuisines": cuisine,
+        "special_diets": special_diets,
+        "vegetarian_friendly": line[headers["vegetarian_friendly"]],
+        "vegan_options": line[headers["vegan_options"]],
+        "gluten_free": line[headers["gluten_free"]],
+    }
+    schedule = {
+        "original_open_hours": {} if line[headers["original_open_hours"]] == "" else json.loads(
+            line[headers["original_open_hours"]]),
+        "open_days_per_week": None if line[headers["open_days_per_week"]] == "" else float(
+            line[headers["open_days_per_week"]]),
+        "open_hours_per_week": None if line[headers["open_hours_per_week"]] == "" else float(
+            line[headers["open_hours_per_week"]]),
+        "working_shifts_per_week": None if line[headers["working_shifts_per_week"]] == "" else float(
+            line[headers["working_shifts_per_week"]]),
+    }
+    reviews = {
+        "total_reviews_count": float(line[headers["total_reviews_count"]]) if line[headers[
+            "total_reviews_count"]] != "" else 0,
+        'default_language': line[headers["default_language"]],
+        'reviews_count_in_default_language': float(line[headers["reviews_count_in_default_language"]]) if line[
+                                                                                                              headers[
+                                                                                                                  "reviews_count_in_default_language"]] != "" else 0,
+    }
+    ratings = {
+        "avg_rating": float(line[headers["avg_rating"]]) if line[headers["avg_rating"]] != "" else 0,
+        "excellent": float(line[headers["excellent"]]) if line[headers["excellent"]] != "" else 0,
+        "very_good": float(line[headers["very_good"]]) if line[headers["very_good"]] != "" else 0,
+        "average": float(line[headers["average"]]) if line[headers["average"]] != "" else 0,
+        "poor": float(line[headers["poor"]]) if line[headers["poor"]] != "" else 0,
+        "terrible": float(line[headers["terrible"]]) if line[headers["terrible"]] != "" else 0,
+        "food": float(line[headers["food"]]) if line[headers["food"]] != "" else 0,
+        "service": float(line[headers["service"]]) if line[headers["service"]] != "" else 0,
+        "value": float(line[headers["value"]]) if line[headers["value"]] != "" else 0,
+        "atmosphere": float(line[headers["atmosphere"]]) if line[headers["atmosphere"]] != "" else 0
+    }
+    res["Position"] = position
+    res["Popularity"] = popularity
+    res["Price"] = priceInfo
+    res["FoodInfo"] = foodInf
+    res["Schedule"] = schedule
+    res["Review"] = reviews
+    res["Rating"] = ratings
+    return res
+
+
+def rows_per_second(transform, rows: list[list[str]], repetitions: int) -> float:
+    best = float("inf")
+    for _ in range(repetitions):
+        before = time.perf_counter()
+        for line in rows:
+            transform(line)
+        best = min(best, time.perf_counter() - before)
+    return len(rows) / best
+
+
+def microseconds_per_row(transform, rows: list[list[str]], repetitions: int) -> float:
+    return round(1_000_000 / rows_per_second(transform, rows, repetitions), 3)
+
+
+def profile(headers: dict[str, int], content: list[list[str]], repetitions: int) -> dict:
+    """
+    split the cost of a row of the compiled converter: extracting the cells and building the nested document without
+    any conversion, then the conversion of every typed column on its own. The typed conversions (json.loads of the
+    open hours, the list splits, the floats) are about three quarters of the row, so removing the header lookups,
+    the only work the compiled schema saves, cannot make the transform much faster than the legacy one
+    """
+    untyped = [Column(column.name, column.path) for column in RESTAURANT_SCHEMA]
+    costs = {"row": microseconds_per_row(compile_schema(RESTAURANT_SCHEMA, headers), content, repetitions),
+             "extract_and_build": microseconds_per_row(compile_schema(untyped, headers), content, repetitions)}
+    # cost of calling the measuring lambda, subtracted from every conversion
+    overhead = microseconds_per_row(lambda line: line[0] if line[0] != "" else None, content, repetitions)
+    conversions = {}
+    for column in RESTAURANT_SCHEMA:
+        if column.type is None:
+            continue
+        index, convert = headers[column.name], column.type
+        conversions[column.path] = round(max(microseconds_per_row(
+            lambda line: convert(line[index]) if line[index] != "" else None, content, repetitions) - overhead, 0), 3)
+    costs["conversions"] = dict(sorted(conversions.items(), key=lambda item: -item[1]))
+    return costs
+
+
+def run(rows: int, repetitions: int, with_profile: bool = False) -> dict:
+    """
+    compare the legacy transform with the compiled schema on a synthetic csv, the rows are parsed once and kept in
+    memory so that only the transform is measured. speedup is the measured ratio of the two, close to 1 and varying
+    from run to run, see profile for why
+    :param with_profile: add the cost in microseconds per row of each part of the transform
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        csv_handler = CsvHandler(generate_csv(Path(directory) / "synthetic.csv", rows))
+        headers = csv_handler.header()
+        content = csv_handler.content()
+
+    convert = compile_schema(RESTAURANT_SCHEMA, headers)
+    if any(convert(line) != legacy_row_to_document(line, headers) for line in content):
+        raise AssertionError("compiled schema and legacy transform produce different documents")
+
+    before = rows_per_second(lambda line: legacy_row_to_document(line, headers), content, repetitions)
+    after = rows_per_second(convert, content, repetitions)
+    report = {"rows": rows, "legacy_rows_per_sec": round(before), "compiled_rows_per_sec": round(after),
+              "speedup": round(after / before, 2)}
+    if with_profile:
+        report["microseconds_per_row"] = profile(headers, content, repetitions)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--profile", action="store_true", help="report the cost of each part of the transform")
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.repetitions, args.profile), indent=2 if args.profile else None))
@@ -1,9 +1,20 @@
+import argparse
+import asyncio
 import json
+import logging
 import time
 from enum import Enum
+from typing import Callable
 
+from src.AsyncMongoHelper import AsyncMongoHelper
+from src.CompactSchema import compact_rows
 from src.CsvHandler import CsvHandler
+from src.DocumentTransformer import transform_rows
+from src.IncrementalSync import sync_csv
 from src.MongoHelper import MongoHelper, Rating
+from src.ParallelImporter import import_parallel
+from src.QueryInstrumentation import QueryInstrumentation
+from src.QuerySpecs import prettify
 
 
 # (restaurant_link,restaurant_name,claimed,awards,keywords, features
@@ -17,107 +28,35 @@ from src.MongoHelper import MongoHelper, Rating
 
 
 
-def initializeDB():
-    csv_handler: CsvHandler = CsvHandler("tripadvisor_european_restaurants.csv")
-    content = csv_handler.content()
+def initializeDB(csv_path: str = "tripadvisor_european_restaurants.csv", batch_size: int = 1000, workers: int = 1,
+                 compact: bool = False):
+    """
+    stream the csv in the Restaurants collection, rows are parsed, transformed and inserted in batches of
+    batch_size documents so that the memory usage does not depend on the size of the csv.
+    With workers > 1 the csv is split in byte ranges imported by a pool of processes
+    :param compact: store the documents of the compact schema, see CompactSchema
+    """
+    if workers > 1:
+        inserted = import_parallel(csv_path, workers=workers, host="localhost", port=27017, dbName="DDM",
+                                   collection_name="Restaurants", batch_size=batch_size, compact=compact)
+        print(f"Imported {inserted} restaurants with {workers} workers")
+        return
+
+    csv_handler: CsvHandler = CsvHandler(csv_path)
     headers: dict[str, int] = csv_handler.header()
-    restaurants = []
-    for line in content:
-        features = [] if line[headers["features"]] == "" else line[headers["features"]].replace(" ", "").split(",")
-        awards = [] if line[headers["awards"]] == "" else line[headers["awards"]].split(",")
-        keywords = [] if line[headers["keywords"]] == "" else line[headers["keywords"]].split(",")
-        res = {"restaurant_link": line[headers["restaurant_link"]],
-               "restaurant_name": line[headers["restaurant_name"]],
-               "claimed": line[headers["claimed"]],
-               "awards": awards,
-               "keywords": keywords,
-               "features": features
-               }
-        continent = line[headers["original_location"]].replace("[", "").replace('"', "").split(",")[0]
-        position = {
-            # "original_location": line[headers["original_location"]],
-            "continent": continent,
-            'country': line[headers["country"]],
-            "region": line[headers["region"]],
-            "province": line[headers["province"]],
-            "city": line[headers["city"]],
-            "address": line[headers["address"]],
-            "latitude": float(line[headers["latitude"]]) if line[headers["latitude"]] != "" else 0,
-            "longitude": float(line[headers["longitude"]]) if line[headers["longitude"]] != "" else 0
-        }
-        top_args = [] if line[headers["top_tags"]] == "" else line[headers["top_tags"]].replace(" ", "").split(",")
-        popularity = {
-            "popularity_detailed": line[headers["popularity_detailed"]],
-            "popularity_generic": line[headers["popularity_generic"]],
-            "top_tags": top_args,
-        }
-        pr = line[headers["price_range"]].replace(",", "")
-        pr = pr.replace("CHF\u00A0", "$")
-        min_price = None
-        max_price = None
-        if pr != "":
-            min_price = int(pr.split("-")[0][1:])
-            max_price = int(pr.split("-")[1][1:])
-
-        priceInfo = {
-            "price_level": line[headers["price_level"]],
-            "min_price": min_price,
-            "max_price": max_price
-        }
-        meals = [] if line[headers["meals"]] == "" else line[headers["meals"]].replace(" ", "").split(",")
-        cuisine = [] if line[headers["cuisines"]] == "" else line[headers["cuisines"]].replace(" ", "").split(",")
-        special_diets = [] if line[headers["special_diets"]] == "" else line[headers["special_diets"]].replace(" ",
-                                                                                                               "").split(
-            ",")
-        foodInf = {
-            "meals": meals,
-            "cuisines": cuisine,
-            "special_diets": special_diets,
-            "vegetarian_friendly": line[headers["vegetarian_friendly"]],
-            "vegan_options": line[headers["vegan_options"]],
-            "gluten_free": line[headers["gluten_free"]],
-        }
-        schedule = {
-            "original_open_hours": {} if line[headers["original_open_hours"]] == "" else json.loads(
-                line[headers["original_open_hours"]]),
-            "open_days_per_week": None if line[headers["open_days_per_week"]] == "" else float(
-                line[headers["open_days_per_week"]]),
-            "open_hours_per_week": None if line[headers["open_hours_per_week"]] == "" else float(
-                line[headers["open_hours_per_week"]]),
-            "working_shifts_per_week": None if line[headers["working_shifts_per_week"]] == "" else float(
-                line[headers["working_shifts_per_week"]]),
-        }
-        reviews = {
-            "total_reviews_count": float(line[headers["total_reviews_count"]]) if line[headers[
-                "total_reviews_count"]] != "" else 0,
-            'default_language': line[headers["default_language"]],
-            'reviews_count_in_default_language': float(line[headers["reviews_count_in_default_language"]]) if line[
-                                                                                                                  headers[
-                                                                                                                      "reviews_count_in_default_language"]] != "" else 0,
-        }
-        ratings = {
-            "avg_rating": float(line[headers["avg_rating"]]) if line[headers["avg_rating"]] != "" else 0,
-            "excellent": float(line[headers["excellent"]]) if line[headers["excellent"]] != "" else 0,
-            "very_good": float(line[headers["very_good"]]) if line[headers["very_good"]] != "" else 0,
-            "average": float(line[headers["average"]]) if line[headers["average"]] != "" else 0,
-            "poor": float(line[headers["poor"]]) if line[headers["poor"]] != "" else 0,
-            "terrible": float(line[headers["terrible"]]) if line[headers["terrible"]] != "" else 0,
-            "food": float(line[headers["food"]]) if line[headers["food"]] != "" else 0,
-            "service": float(line[headers["service"]]) if line[headers["service"]] != "" else 0,
-            "value": float(line[headers["value"]]) if line[headers["value"]] != "" else 0,
-            "atmosphere": float(line[headers["atmosphere"]]) if line[headers["atmosphere"]] != "" else 0
-        }
-        res["Position"] = position
-        res["Popularity"] = popularity
-        res["Price"] = priceInfo
-        res["FoodInfo"] = foodInf
-        res["Schedule"] = schedule
-        res["Review"] = reviews
-        res["Rating"] = ratings
-        restaurants.append(res)
-
-    mh: MongoHelper = MongoHelper(host="localhost", port=27017, dbName="DDM")
-    mh.add_many_to_collection(collection_name="Restaurants", documents=restaurants)
+    restaurants = (compact_rows if compact else transform_rows)(csv_handler.rows(), headers)
+
+    with MongoHelper(host="localhost", port=27017, dbName="DDM") as mh:
+        inserted = mh.add_stream_to_collection(restaurants, collection_name="Restaurants", batch_size=batch_size)
+    print(f"Imported {inserted} restaurants")
+
+
+def syncDB(mh: MongoHelper, csv_path: str = "tripadvisor_european_restaurants.csv", batch_size: int = 1000):
+    """
+    bring the Restaurants collection in line with a newer csv, only the new, changed and vanished restaurants are
+    written, then the rollups of the touched countries are recomputed
+    """
+    print(sync_csv(mh, csv_path, batch_size=batch_size))
 
 
 def get_restaurant_in_radius(mh: MongoHelper, lat: float, long: float, radius: float):
@@ -150,45 +89,94 @@ class Command(Enum):
     UPDATE_RESTAURANT_FEATURE = 13
     INCREASE_PRICE_SEATING = 14
     ASSIGN_SIMILAR_PRICED_OSNABRUCK = 15
+    ASSIGN_SIMILAR_PRICED = 16
     IMPORT_DB = 17
+    SYNC_DB = 18
+    OPEN_AT = 19
+    TEXT_SEARCH = 20
+    AUTOCOMPLETE = 21
     ALL = 99
 
 
-def execute_command(command, PRETTY, SEPARATOR):
+def queries(helper, PRETTY) -> list[tuple[Command, Callable]]:
+    """
+    the read queries run by execute_command with their arguments
+    :param helper: a MongoHelper, or an AsyncMongoHelper in which case the calls return coroutines
+    """
+    return [
+        (Command.VEGAN_RESTAURANTS, lambda: helper.get_vegan_restaurants_in_cities(["Franconville"], pretty=PRETTY)),
+        (Command.WEIGHTED_RATING, lambda: helper.sort_with_weighted_rating("France", pretty=PRETTY)),
+        (Command.ENGLISH_SPEAKING_RESTAURANTS,
+         lambda: helper.get_english_speaking_always_open_restaurants(6, 0, 10, 200, pretty=PRETTY)),
+        (Command.RESTAURANTS_IN_RADIUS,
+         lambda: helper.search_restaurants_in_radius(48.85341, 2.3488, 1000, pretty=PRETTY)),
+        (Command.POPULAR_IN_CITY, lambda: helper.search_popular_in_city("Paris", pretty=PRETTY)),
+        (Command.RESTAURANT_WITH_FEATURE,
+         lambda: helper.search_with_feature("WheelchairAccessible", "Paris", pretty=PRETTY)),
+        (Command.MOST_EXPENSIVE_EACH_COUNTRY,
+         lambda: helper.find_most_expensive_restaurant_in_each_country(pretty=PRETTY)),
+        (Command.TOP10_HIGHEST_RATING,
+         lambda: helper.find_top10_highest_rating_restaurant_in_the_5most_popular_cities(pretty=PRETTY)),
+        (Command.TOP5_COUNTRIES_REVIEWS,
+         lambda: helper.get_top5_countries_with_the_highest_average_excellent_reviews(pretty=PRETTY)),
+        (Command.CLOSEST_THREE_RANDOM_CITY,
+         lambda: helper.find_the_closest_three_restaurant_in_randon_city(pretty=PRETTY)),
+        (Command.OPEN_AT, lambda: helper.find_open_at("Sat", 20, 30, city="Paris", pretty=PRETTY)),
+        (Command.TEXT_SEARCH, lambda: helper.search_text("pizza pasta", country="France", pretty=PRETTY)),
+        (Command.AUTOCOMPLETE, lambda: helper.autocomplete("le p", city="Paris", pretty=PRETTY)),
+    ]
+
+
+async def run_queries_concurrently(command, PRETTY, concurrency: int, instrumentation: QueryInstrumentation = None,
+                                   compact: bool = False) -> list:
+    """
+    run the selected read queries concurrently on an AsyncMongoHelper, at most concurrency at the same time
+    :return: the results in the order of queries()
+    """
+    helper = AsyncMongoHelper(host="localhost", port=27017, dbName="DDM", instrumentation=instrumentation,
+                              compact=compact)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(query):
+        async with semaphore:
+            return await query()
+
+    try:
+        return await asyncio.gather(*(bounded(query) for cmd, query in queries(helper, PRETTY)
+                                      if command == cmd or command == Command.ALL))
+    finally:
+        helper.close()
+
+
+def execute_command(command, PRETTY, SEPARATOR, workers: int = 1, concurrency: int = 0,
+                    instrumentation: QueryInstrumentation = None, compact: bool = False):
+    """
+    :param workers: processes used by IMPORT_DB and cities updated in parallel by ASSIGN_SIMILAR_PRICED
+    :param concurrency: if > 0 the read queries run concurrently, at most concurrency at the same time
+    :param instrumentation: if given, the latencies of the queries and commands are printed at the end and the slow
+    commands are logged with their explain plan
+    :param compact: the Restaurants collection holds documents of the compact schema, IMPORT_DB stores them so
+    """
     if command == Command.IMPORT_DB:
-        initializeDB()
-    mongoHelper = MongoHelper(host="localhost", port=27017, dbName="DDM")
+        initializeDB(workers=workers, compact=compact)
+    mongoHelper = MongoHelper(host="localhost", port=27017, dbName="DDM", instrumentation=instrumentation,
+                              compact=compact)
+    if command == Command.IMPORT_DB:
+        print(prettify(mongoHelper.ensure_indexes()))
+        mongoHelper.build_rollups()
+    if command == Command.SYNC_DB:
+        syncDB(mongoHelper)
     before = time.time()
     # --------------------------------------------------------------------- Queries
-    if command == Command.VEGAN_RESTAURANTS or command == Command.ALL:
-        print(mongoHelper.get_vegan_restaurants_in_cities(["Franconville"], pretty=PRETTY))
-    if command == Command.WEIGHTED_RATING or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.sort_with_weighted_rating("France", pretty=PRETTY))
-    if command == Command.ENGLISH_SPEAKING_RESTAURANTS or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.get_english_speaking_always_open_restaurants(6, 0, 10, 200, pretty=PRETTY))
-    if command == Command.RESTAURANTS_IN_RADIUS or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.search_restaurants_in_radius(48.85341, 2.3488, 0.01, pretty=PRETTY))
-    if command == Command.POPULAR_IN_CITY or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.search_popular_in_city("Paris", pretty=PRETTY))
-    if command == Command.RESTAURANT_WITH_FEATURE or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.search_with_feature("WheelchairAccessible", "Paris", pretty=PRETTY))
-    if command == Command.MOST_EXPENSIVE_EACH_COUNTRY or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.find_most_expensive_restaurant_in_each_country(pretty=PRETTY))
-    if command == Command.TOP10_HIGHEST_RATING or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.find_top10_highest_rating_restaurant_in_the_5most_popular_cities(pretty=PRETTY))
-    if command == Command.TOP5_COUNTRIES_REVIEWS or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.get_top5_countries_with_the_highest_average_excellent_reviews(pretty=PRETTY))
-    if command == Command.CLOSEST_THREE_RANDOM_CITY or command == Command.ALL:
-        addSeparator(SEPARATOR)
-        print(mongoHelper.find_the_closest_three_restaurant_in_randon_city())
+    if concurrency > 0:
+        results = asyncio.run(run_queries_concurrently(command, PRETTY, concurrency, instrumentation, compact))
+    else:
+        results = (query() for cmd, query in queries(mongoHelper, PRETTY)
+                   if command == cmd or command == Command.ALL)
+    for index, result in enumerate(results):
+        if index > 0:
+            addSeparator(SEPARATOR)
+        print(result)
     # --------------------------------------------------------------------- Commands
     if command == Command.ADD_WEEKEND_AVAILABILITY or command == Command.ALL:
         mongoHelper.add_weekend_availability()
@@ -202,8 +190,14 @@ def execute_command(command, PRETTY, SEPARATOR):
         mongoHelper.update_restaurant_by_assigning_a_similarly_priced_resturant_to_each_other_in_Osnabruck()
         addSeparator(SEPARATOR)
         print(mongoHelper.print_restaurants_connection_in_Osnabruck())
+    # the whole collection takes minutes, so it is not part of ALL
+    if command == Command.ASSIGN_SIMILAR_PRICED:
+        print(f"Updated {mongoHelper.assign_similarly_priced_restaurants(workers=workers)} restaurants")
     after = time.time()
+    mongoHelper.close()
     print(f"Time: {(after - before) * 1000}")
+    if instrumentation is not None:
+        print(json.dumps(instrumentation.snapshot(), indent=2, default=str))
     pass
 
 
@@ -213,8 +207,25 @@ def addSeparator(separator: bool):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--command", choices=[c.name for c in Command], default=Command.ALL.name)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used by IMPORT_DB, of cities updated in parallel by "
+                             "ASSIGN_SIMILAR_PRICED")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="run the read queries concurrently, at most this many at the same time")
+    parser.add_argument("--slow-ms", type=float,
+                        help="time the queries and commands, log the explain plan of commands slower than this")
+    parser.add_argument("--compact", action="store_true",
+                        help="use the compact schema, it must be the same for IMPORT_DB and the other commands")
+    args = parser.parse_args()
+    instrumentation = None
+    if args.slow_ms is not None:
+        logging.basicConfig(level=logging.INFO)
+        instrumentation = QueryInstrumentation(slow_ms=args.slow_ms)
     # initializeDB()
-    execute_command(Command.ALL, True, True)
+    execute_command(Command[args.command], True, True, workers=args.workers, concurrency=args.concurrency,
+                    instrumentation=instrumentation, compact=args.compact)
     pass
 
 # Example usage
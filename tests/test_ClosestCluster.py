@@ -0,0 +1,74 @@
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from src.ClosestCluster import haversine, tightest_cluster
+
+PARIS = (48.8566, 2.3522)
+MOSCOW = (55.7558, 37.6173)
+
+
+def brute_force_radius(latitudes, longitudes, k: int) -> float:
+    """
+    smallest distance from a restaurant to its k-th nearest one (itself included), from the full distance matrix
+    """
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    distances = haversine(latitudes, longitudes, latitudes, longitudes)
+    np.fill_diagonal(distances, -1)
+    return float(np.sort(distances, axis=1)[:, k - 1].min())
+
+
+def city(n: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    return PARIS[0] + rng.normal(0, 0.03, n), PARIS[1] + rng.normal(0, 0.05, n)
+
+
+class TightestClusterTest(unittest.TestCase):
+
+    def assert_brute_force(self, latitudes, longitudes, k: int):
+        cluster = tightest_cluster(latitudes, longitudes, k)
+        self.assertEqual(len(cluster.indices), k)
+        self.assertEqual(len(set(cluster.indices)), k)
+        self.assertAlmostEqual(cluster.radius, brute_force_radius(latitudes, longitudes, k), places=6)
+        # the radius is the distance from the center to the farthest member
+        members = np.radians(latitudes)[cluster.indices], np.radians(longitudes)[cluster.indices]
+        self.assertAlmostEqual(cluster.radius, float(haversine(members[0][:1], members[1][:1], *members).max()),
+                               places=6)
+
+    def test_matches_brute_force(self):
+        for seed in range(5):
+            for k in (2, 3, 5):
+                with self.subTest(seed=seed, k=k):
+                    self.assert_brute_force(*city(500, seed), k)
+
+    def test_shared_coordinates(self):
+        latitudes, longitudes = city(300)
+        latitudes[:4], longitudes[:4] = PARIS
+        cluster = tightest_cluster(latitudes, longitudes, 3)
+        self.assertEqual(cluster.radius, 0)
+        self.assertTrue(set(cluster.indices) <= {0, 1, 2, 3})
+
+    def test_outlier_matches_brute_force(self):
+        latitudes, longitudes = city(2000)
+        latitudes, longitudes = np.append(latitudes, MOSCOW[0]), np.append(longitudes, MOSCOW[1])
+        self.assert_brute_force(latitudes, longitudes, 3)
+
+    def test_outlier_memory_is_bounded(self):
+        latitudes, longitudes = city(20_000)
+        latitudes, longitudes = np.append(latitudes, MOSCOW[0]), np.append(longitudes, MOSCOW[1])
+        tracemalloc.start()
+        try:
+            tightest_cluster(latitudes, longitudes, 3)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # a single 20k x 20k distance matrix would take 3.2 GB
+        self.assertLess(peak, 100 * 2 ** 20)
+
+    def test_too_few_points(self):
+        self.assertIsNone(tightest_cluster([1.0, 2.0], [1.0, 2.0], 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
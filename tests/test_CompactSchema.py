@@ -0,0 +1,113 @@
+import copy
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from src.CompactSchema import (CompactCollection, compact_rows, decode_document, encode_document, encode_filter,
+                               encode_pipeline)
+from src.CsvHandler import CsvHandler
+from src.DocumentTransformer import transform_rows
+from src.SyntheticData import generate_csv
+
+# cells emptied in some rows, so the documents have empty enumerations and empty numbers
+BLANKED = ("claimed", "price_level", "vegan_options", "gluten_free", "excellent", "avg_rating", "total_reviews_count")
+
+
+def unhashed(documents: list[dict]) -> list[dict]:
+    # sync_hash is a hash of the stored values, it differs between the two schemas
+    return [{key: value for key, value in document.items() if key != "sync_hash"} for document in documents]
+
+
+class InsertRecorder:
+    def insert_many(self, documents, *args, **kwargs):
+        self.documents = documents
+
+
+class CompactDocumentTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_handler = CsvHandler(generate_csv(Path(directory) / "synthetic.csv", 200, seed=7))
+            headers = csv_handler.header()
+            rows = list(csv_handler.rows())
+        rng = random.Random(7)
+        for row in rows:
+            for name in BLANKED:
+                if rng.random() < 0.3:
+                    row[headers[name]] = ""
+        cls.full = list(transform_rows(rows, headers))
+        cls.compact = list(compact_rows(rows, headers))
+
+    def test_compact_values(self):
+        for document in self.compact:
+            self.assertIn(document.get("claimed", True), (True, False))
+            self.assertIn(document["Price"].get("price_level", 1), (1, 2, 3))
+            self.assertIsInstance(document["Rating"]["excellent"], int)
+        # empty enumerations are left out, empty numbers are 0 as in the full schema
+        blank = [(full, compact) for full, compact in zip(self.full, self.compact) if full["claimed"] == ""]
+        self.assertTrue(blank)
+        self.assertTrue(all("claimed" not in compact for _, compact in blank))
+        self.assertTrue(any(full["Rating"]["excellent"] == 0 for full in self.full))
+
+    def test_decode_restores_the_full_schema(self):
+        self.assertEqual(unhashed([decode_document(copy.deepcopy(document)) for document in self.compact]),
+                         unhashed(self.full))
+
+    def test_encode_matches_compact_rows(self):
+        self.assertEqual(unhashed([encode_document(copy.deepcopy(document)) for document in self.full]),
+                         unhashed(self.compact))
+        # compact documents are left as they are
+        self.assertEqual([encode_document(copy.deepcopy(document)) for document in self.compact], self.compact)
+
+    def test_raw_documents_are_encoded(self):
+        collection = InsertRecorder()
+        CompactCollection(collection).insert_many([RawBSONDocument(bson.encode(document)) for document in self.full])
+        self.assertEqual(unhashed(collection.documents), unhashed(self.compact))
+
+    def test_decode_with_projection(self):
+        document = {"Price": {"max_price": 10}, "restaurant_name": "Plain"}
+        decoded = decode_document(copy.deepcopy(document), {"Price": 1, "restaurant_name": 1})
+        self.assertEqual(decoded, {"Price": {"max_price": 10, "price_level": ""}, "restaurant_name": "Plain"})
+        # a field the projection excludes is not restored
+        decoded = decode_document(copy.deepcopy(document), {"Price.max_price": 1, "restaurant_name": 1})
+        self.assertEqual(decoded, document)
+        self.assertEqual(decode_document({"_id": "France", "avg": 3}, defaults=False), {"_id": "France", "avg": 3})
+
+
+class EncodeFilterTest(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(encode_filter({"FoodInfo.vegan_options": "Y", "Position.city": "Paris"}),
+                         {"FoodInfo.vegan_options": True, "Position.city": "Paris"})
+        self.assertEqual(encode_filter({"Price.price_level": {"$in": ["€", "€€€€", ""]}}),
+                         {"Price.price_level": {"$in": [1, 3, None]}})
+        self.assertEqual(encode_filter({"claimed": {"$ne": ""}}), {"claimed": {"$ne": None}})
+        self.assertEqual(encode_filter({"claimed": ""}), {"claimed": None})
+        # values that are not codes are kept
+        self.assertEqual(encode_filter({"Price.price_level": "unknown"}), {"Price.price_level": "unknown"})
+
+    def test_exists(self):
+        # the full schema always has the field, empty or not
+        self.assertEqual(encode_filter({"claimed": {"$exists": True}, "restaurant_link": "g1"}),
+                         {"restaurant_link": "g1"})
+        self.assertEqual(encode_filter({"claimed": {"$exists": False}}), {"claimed": {"$in": []}})
+        self.assertEqual(encode_filter({"claimed": {"$not": {"$exists": True}}}), {"claimed": {"$in": []}})
+        self.assertEqual(encode_filter({"Rating": {"$exists": True}}), {"Rating": {"$exists": True}})
+
+    def test_logical_operators_and_pipelines(self):
+        query = {"$or": [{"FoodInfo.gluten_free": "N"}, {"$and": [{"claimed": {"$eq": "Claimed"}}]}]}
+        self.assertEqual(encode_filter(query),
+                         {"$or": [{"FoodInfo.gluten_free": False}, {"$and": [{"claimed": {"$eq": True}}]}]})
+        pipeline = [{"$match": {"most_expensive_restaurant.Price.price_level": "€€-€€€"}}, {"$limit": 1}]
+        self.assertEqual(encode_pipeline(pipeline),
+                         [{"$match": {"most_expensive_restaurant.Price.price_level": 2}}, {"$limit": 1}])
+        self.assertIsNone(encode_filter(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import csv
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.CsvHandler import CsvHandler, MappedCsvHandler
+
+HEADER = ["restaurant_link", "restaurant_name", "city", "keywords"]
+ROWS = [
+    ["g1", "Café de Flore", "Paris", "coffee"],
+    ["g2", "Trattoria\n\"Da Mario\"", "Rome", "pizza, pasta"],
+    ["g3", "", "Rome", "line one\nline two\n\nline four"],
+    ["g4", "Plain", "", ""],
+    ["g5", "Ünïcödé, quoted", "München", "\"\""],
+]
+
+
+def write_csv(path: Path, rows: list[list[str]]):
+    with open(path, mode="w", newline="", encoding="utf-8") as csvfile:
+        csv.writer(csvfile).writerows([HEADER, *rows])
+
+
+class MappedCsvHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "restaurants.csv"
+        write_csv(self.path, ROWS)
+
+    def handler(self) -> MappedCsvHandler:
+        handler = MappedCsvHandler(self.path)
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_rows_match_csv_handler(self):
+        handler = self.handler()
+        self.assertEqual(handler.header(), CsvHandler(self.path).header())
+        self.assertEqual(list(handler.rows()), list(CsvHandler(self.path).rows()))
+        self.assertEqual(list(handler.rows()), ROWS)
+
+    def test_random_access(self):
+        handler = self.handler()
+        self.assertEqual(len(handler), len(ROWS))
+        for index, row in enumerate(ROWS):
+            with self.subTest(index=index):
+                self.assertEqual(handler[index], row)
+        self.assertEqual(handler[-1], ROWS[-1])
+        self.assertRaises(IndexError, handler.row, len(ROWS))
+        self.assertEqual(list(handler.rows(1, 3)), ROWS[1:3])
+        self.assertEqual(list(handler.column("keywords", 2)), [row[3] for row in ROWS[2:]])
+        sample = handler.sample(2, seed=1)
+        self.assertEqual(len(sample), 2)
+        # the sampled rows are read in file order
+        self.assertEqual(sample, [row for row in ROWS if row in sample])
+
+    def test_ranges_cover_every_row_once(self):
+        handler = self.handler()
+        for parts in (1, 2, 3, 5, 8):
+            with self.subTest(parts=parts):
+                ranges = handler.row_ranges(parts)
+                self.assertEqual([row for start, stop in ranges for row in handler.rows(start, stop)], ROWS)
+
+    def test_index_is_cached_and_rebuilt_when_the_csv_changes(self):
+        self.handler()
+        index_path = Path(f"{self.path}.idx")
+        self.assertTrue(index_path.exists())
+        self.assertEqual(list(self.handler().rows()), ROWS)
+        write_csv(self.path, ROWS[:2])
+        self.assertEqual(list(self.handler().rows()), ROWS[:2])
+
+    def test_empty_csv(self):
+        write_csv(self.path, [])
+        handler = self.handler()
+        self.assertEqual(len(handler), 0)
+        self.assertEqual(list(handler.rows()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
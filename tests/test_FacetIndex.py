@@ -0,0 +1,72 @@
+import unittest
+
+from src.FacetIndex import All, Any, FacetIndex, Not, Term
+
+
+def restaurant(link: str, city: str, features=(), cuisines=(), diets=()) -> dict:
+    return {"restaurant_link": link, "Position": {"city": city}, "features": list(features),
+            "FoodInfo": {"cuisines": list(cuisines), "special_diets": list(diets)}}
+
+
+RESTAURANTS = [
+    restaurant("a", "Paris", ["Seating", "Wifi"], ["French"], ["Vegan"]),
+    restaurant("b", "Paris", ["Seating"], ["Italian"]),
+    restaurant("c", "Paris", [], ["Italian"], ["Vegan"]),
+    restaurant("d", "Rome", ["Seating"], ["Italian"]),
+    restaurant("e", "Rome", ["Wifi"], ["Pizza"], ["Vegan"]),
+]
+
+SEATING = Term("features", "Seating")
+ITALIAN = Term("cuisines", "Italian")
+VEGAN = Term("special_diets", "Vegan")
+
+
+class FacetIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FacetIndex.build(RESTAURANTS)
+
+    def test_terms_and_combinations(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(sorted(self.index.search(SEATING)), ["a", "b", "d"])
+        self.assertEqual(sorted(self.index.search(All((SEATING, ITALIAN)))), ["b", "d"])
+        self.assertEqual(sorted(self.index.search(Any((ITALIAN, VEGAN)))), ["a", "b", "c", "d", "e"])
+        self.assertEqual(sorted(self.index.search(Not(SEATING))), ["c", "e"])
+        self.assertEqual(sorted(self.index.search(All((VEGAN, Not(ITALIAN))))), ["a", "e"])
+        self.assertEqual(self.index.count(Term("features", "Unknown")), 0)
+
+    def test_cities_and_limit(self):
+        self.assertEqual(self.index.count(ITALIAN, cities=["Paris"]), 2)
+        self.assertEqual(self.index.count(ITALIAN, cities=["Rome", "Berlin"]), 1)
+        self.assertEqual(len(self.index.search(Any((SEATING, VEGAN)), limit=2)), 2)
+
+    def test_facet_counts(self):
+        self.assertEqual(self.index.facet_counts(VEGAN, "features"), {"Wifi": 2, "Seating": 1})
+        self.assertEqual(self.index.facet_counts(SEATING, "cuisines", cities=["Paris"]), {"French": 1, "Italian": 1})
+
+    def test_refresh_replaces_the_values(self):
+        self.index.refresh(restaurant("b", "Paris", ["Wifi"], ["Italian"]))
+        self.assertEqual(sorted(self.index.search(SEATING)), ["a", "d"])
+        self.assertEqual(sorted(self.index.search(Term("features", "Wifi"))), ["a", "b", "e"])
+        self.assertEqual(len(self.index), 5)
+
+    def test_refresh_moves_to_another_city(self):
+        self.index.refresh(restaurant("a", "Rome", ["Seating"]))
+        self.assertEqual(self.index.count(SEATING, cities=["Paris"]), 1)
+        self.assertEqual(sorted(self.index.search(SEATING, cities=["Rome"])), ["a", "d"])
+        self.assertEqual(sorted(self.index.search(Not(SEATING), cities=["Paris"])), ["c"])
+        self.assertEqual(len(self.index), 5)
+
+    def test_add_value_and_remove(self):
+        self.index.add_value("c", "features", "Seating")
+        self.index.add_value("unknown", "features", "Seating")
+        self.assertEqual(sorted(self.index.search(SEATING)), ["a", "b", "c", "d"])
+        self.index.remove("a")
+        self.assertEqual(sorted(self.index.search(SEATING)), ["b", "c", "d"])
+        # a removed restaurant does not match a negation either
+        self.assertEqual(sorted(self.index.search(Not(ITALIAN))), ["e"])
+        self.assertEqual(len(self.index), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
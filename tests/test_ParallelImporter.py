@@ -0,0 +1,37 @@
+import csv
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.CsvHandler import CsvHandler, MappedCsvHandler
+from src.ParallelImporter import read_byte_range
+
+HEADER = ["restaurant_link", "restaurant_name", "keywords"]
+
+
+class ReadByteRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "restaurants.csv"
+        # every third row has a quoted field spanning several lines, with quotes and commas in it
+        rows = [[f"g{i}", f"Restaurant \"{i}\", Ünïcödé" if i % 2 else f"Restaurant {i}",
+                 "one\ntwo\n\nthree" if i % 3 == 0 else f"keyword {i}"] for i in range(50)]
+        with open(self.path, mode="w", newline="", encoding="utf-8") as csvfile:
+            csv.writer(csvfile).writerows([HEADER, *rows])
+
+    def test_byte_ranges_split_on_row_boundaries(self):
+        expected = list(CsvHandler(self.path).rows())
+        with MappedCsvHandler(self.path) as handler:
+            for workers in (1, 2, 3, 7, 64):
+                with self.subTest(workers=workers):
+                    ranges = handler.byte_ranges(workers)
+                    self.assertLessEqual(len(ranges), workers)
+                    shards = [list(read_byte_range(self.path, start, end)) for start, end in ranges]
+                    self.assertTrue(all(shards))
+                    self.assertEqual([row for shard in shards for row in shard], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
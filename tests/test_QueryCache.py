@@ -0,0 +1,107 @@
+import unittest
+
+from src.QueryCache import GLOBAL_TAG, QueryCache, cached_query, city_tag, country_tag, document_tags
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def test_invalidate_drops_only_the_tagged_entries(self):
+        cache = QueryCache()
+        cache.put("paris", 1, {city_tag("Paris"), country_tag("France")})
+        cache.put("lyon", 2, {city_tag("Lyon"), country_tag("France")})
+        cache.put("rome", 3, {city_tag("Rome"), country_tag("Italy")})
+        self.assertEqual(cache.invalidate({city_tag("Paris")}), 1)
+        self.assertEqual(cache.get("paris"), (False, None))
+        self.assertEqual(cache.get("lyon"), (True, 2))
+        self.assertEqual(cache.invalidate({country_tag("France"), country_tag("Spain")}), 1)
+        self.assertEqual(cache.get("rome"), (True, 3))
+        self.assertEqual(cache.stats()["invalidations"], 2)
+
+    def test_document_tags_invalidate_the_global_queries(self):
+        cache = QueryCache()
+        cache.put("top5", [], {GLOBAL_TAG})
+        cache.put("rome", [], {city_tag("Rome")})
+        cache.invalidate(document_tags("France", "Paris"))
+        self.assertEqual(cache.get("top5"), (False, None))
+        self.assertEqual(cache.get("rome"), (True, []))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = QueryCache(max_entries=2)
+        cache.put("a", 1, {"t"})
+        cache.put("b", 2, {"t"})
+        cache.get("a")
+        cache.put("c", 3, {"t"})
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, 1))
+        # the evicted entry is no longer reachable from its tags
+        self.assertEqual(cache.invalidate({"t"}), 2)
+
+    def test_entries_expire(self):
+        clock = Clock()
+        cache = QueryCache(ttl=10, clock=clock)
+        cache.put("a", 1, set())
+        clock.now = 9.9
+        self.assertEqual(cache.get("a"), (True, 1))
+        clock.now = 10
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class Helper:
+    def __init__(self, query_cache=None):
+        self.query_cache = query_cache
+        self.calls = 0
+
+    @cached_query(tags=lambda city, limit, stream: {city_tag(city)})
+    def restaurants(self, city: str, limit: int = 3, stream: bool = False):
+        self.calls += 1
+        return [{"city": city, "limit": limit}]
+
+
+class CachedQueryTest(unittest.TestCase):
+
+    def test_same_arguments_hit(self):
+        helper = Helper(QueryCache())
+        first = helper.restaurants("Paris")
+        # defaults are part of the key
+        self.assertEqual(helper.restaurants("Paris", limit=3), first)
+        self.assertEqual(helper.calls, 1)
+        helper.restaurants("Paris", 4)
+        self.assertEqual(helper.calls, 2)
+
+    def test_results_are_copies(self):
+        helper = Helper(QueryCache())
+        helper.restaurants("Paris")[0]["city"] = "changed"
+        self.assertEqual(helper.restaurants("Paris"), [{"city": "Paris", "limit": 3}])
+
+    def test_invalidated_by_tag(self):
+        cache = QueryCache()
+        helper = Helper(cache)
+        helper.restaurants("Paris")
+        helper.restaurants("Rome")
+        cache.invalidate(document_tags("France", "Paris"))
+        helper.restaurants("Paris")
+        helper.restaurants("Rome")
+        self.assertEqual(helper.calls, 3)
+
+    def test_streams_and_helpers_without_cache_are_not_cached(self):
+        helper = Helper(QueryCache())
+        helper.restaurants("Paris", stream=True)
+        helper.restaurants("Paris", stream=True)
+        self.assertEqual(helper.calls, 2)
+        uncached = Helper()
+        uncached.restaurants("Paris")
+        uncached.restaurants("Paris")
+        self.assertEqual(uncached.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()